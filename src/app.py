@@ -1,7 +1,13 @@
 import streamlit as st
 import oncotree_utils as tools
-import tempfile
+import record_sources
+import test_models
+import hashlib
+import io
 import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 
 st.set_page_config(page_title="AI Oncotree Coder Assistant", layout="centered")
@@ -12,9 +18,23 @@ st.text("Predict oncotree tissue, name, and code from tumor JSON using locally-r
 if "override_confirmed" not in st.session_state:
     st.session_state["override_confirmed"] = False
 
+# Optional pool of Ollama hosts (comma-separated OLLAMA_HOSTS); one shared pool across sessions
+@st.cache_resource
+def get_ollama_pool():
+    hosts = tools.parse_hosts(os.environ.get("OLLAMA_HOSTS"))
+    if not hosts:
+        return None  # default client (OLLAMA_HOST)
+    return tools.OllamaPool(hosts, max_per_host=int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4))
+
+ollama_pool = get_ollama_pool()
+
 # LLM settings (kept minimal)
-# call once at startup
-available_models = tools.discover_local_ollama_models()
+# model discovery is cached for a minute so widget reruns don't hit the Ollama API
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_local_models():
+    return tools.discover_local_ollama_models(client=ollama_pool)
+
+available_models = cached_local_models()
 
 # show a helpful sidebar message if empty
 if not available_models:
@@ -29,35 +49,368 @@ model = st.sidebar.selectbox("Model", options=available_models or ["(no models)"
 # Temperature slider to select temp
 temperature = st.sidebar.number_input("Temperature", min_value=0.0, max_value=1.0, value=0.0, step=0.01)
 
-# helpers
-def _write_tmp(uploaded, suffix):
-    if uploaded is None:
+# Keep the selected model loaded between predictions (Ollama keep_alive, e.g. 30m, 2h, -1 = forever)
+keep_alive = st.sidebar.text_input("Keep model loaded for", value=os.environ.get("ONCOTREE_KEEP_ALIVE", "30m")).strip() or None
+if keep_alive and keep_alive.lstrip("-").isdigit():
+    keep_alive = int(keep_alive)
+
+# Preload the model on startup / selection so the first prediction doesn't pay the load time.
+# Re-checked every few minutes; on an already loaded model this is a cheap no-op request.
+@st.cache_data(ttl=240, show_spinner=False)
+def cached_warm_up(model, keep_alive):
+    try:
+        return tools.warm_up_model(model, keep_alive=keep_alive, client=ollama_pool)
+    except Exception as e:
+        return {"error": str(e)}
+
+if available_models:
+    with st.spinner(f"Loading {model}..."):
+        warm = cached_warm_up(model, keep_alive)
+    if "error" in warm:
+        st.sidebar.warning(f"Could not preload {model}: {warm['error']}")
+    elif warm["load_seconds"] > tools.COLD_LOAD_SECONDS:
+        st.sidebar.caption(f"{model} loaded in {warm['load_seconds']:.1f}s")
+
+# Compact the tumor JSON (drop empty/ID fields, minify) to cut prompt tokens
+compact = st.sidebar.checkbox("Compact tumor JSON in prompts", value=False)
+
+# Constrain answers to the canonical list (JSON-schema enum + short generation cap)
+constrained = st.sidebar.checkbox("Constrain output to canonical list", value=False)
+
+# Rule fast path: skip the LLM when the report already names exactly one OncoTree entry
+fast_path = st.sidebar.checkbox("Resolve from the report when it names an OncoTree entry", value=False)
+
+# Stream the reply live and stop it as soon as it has named a canonical entry
+stream_live = st.sidebar.checkbox("Stream answers (stop once a canonical answer is complete)", value=False)
+
+# Optional ensemble: ask several models at once and majority-vote; their agreement is the confidence
+ensemble_choice = st.sidebar.multiselect("Ensemble: vote across models", options=available_models, default=[])
+ensemble = tuple(ensemble_choice) if len(ensemble_choice) > 1 else None
+quorum = st.sidebar.number_input("Stop once this many models agree", min_value=1, max_value=max(1, len(ensemble_choice)),
+                                 value=len(ensemble_choice) // 2 + 1, step=1, disabled=ensemble is None)
+for ensemble_model in ensemble or ():
+    if "error" in cached_warm_up(ensemble_model, keep_alive):
+        st.sidebar.warning(f"Could not preload {ensemble_model}")
+
+# Optional embedding retrieval: send only the top-K most similar OncoTree names, and (with a
+# margin above 0) skip the tissue LLM call when the embedding ranking is decisive (needs numpy)
+embed_choice = st.sidebar.selectbox("Embedding model for candidate retrieval", options=["(off)"] + available_models, index=0)
+embed_model = None if embed_choice == "(off)" else embed_choice
+embed_top_k = st.sidebar.number_input("Names sent to the model (top-K)", min_value=1, value=20, step=1, disabled=embed_model is None)
+tissue_margin = st.sidebar.number_input("Skip tissue LLM call at similarity margin (0 = off)", min_value=0.0,
+                                        max_value=1.0, value=0.0, step=0.01, disabled=embed_model is None)
+
+# Optional debug panel with per-stage timings and Ollama token counts
+show_debug = st.sidebar.checkbox("Show debug metrics", value=False)
+
+def show_stage_metrics(label, details):
+    if not show_debug:
+        return
+    with st.expander(f"Debug metrics — {label}", expanded=False):
+        llm = details.get("llm") or {}
+        if llm.get("wall_seconds") is not None:
+            cols = st.columns(4)
+            cols[0].metric("LLM wall", f"{llm['wall_seconds']:.2f}s")
+            load = llm.get("load_duration", 0) / 1e9
+            cols[1].metric("Load", f"{load:.2f}s", "cold" if load > tools.COLD_LOAD_SECONDS else "warm",
+                           delta_color="inverse" if load > tools.COLD_LOAD_SECONDS else "off")
+            cols[2].metric("Prefill", f"{llm.get('prompt_eval_count', 0)} tok / {llm.get('prompt_eval_duration', 0) / 1e9:.2f}s")
+            cols[3].metric("Generation", f"{llm.get('eval_count', 0)} tok / {llm.get('eval_duration', 0) / 1e9:.2f}s")
+        st.json(details)
+
+# persistent prediction cache shared across sessions (re-uploads skip the LLM)
+@st.cache_resource
+def get_prediction_cache():
+    return tools.PredictionCache(os.environ.get("ONCOTREE_CACHE", "../.cache/predictions.sqlite"))
+
+prediction_cache = get_prediction_cache()
+
+# Memoized predictions: Streamlit reruns the whole script on every widget interaction,
+# so results are kept per (upload hash, model, temperature[, tissue]) with bounded memory.
+# The leading underscore keeps the raw JSON (and keep_alive) out of Streamlit's argument hashing.
+# Live streaming calls the uncached run_* functions: a cached function can't write to the page.
+def run_tissue_step(upload_hash, _tumor_json, tissue_list_path, model, temperature, compact, constrained,
+                          embed_model=None, tissue_margin=None, _keep_alive=None, ensemble=None, quorum=None,
+                          early_stop=False, _on_text=None, fast_path=False):
+    details = {}
+    kwargs = dict(
+        tissue_list_path=tissue_list_path,
+        tumor_json=_tumor_json,
+        embed_model=embed_model,
+        tissue_margin=tissue_margin,
+        temperature=temperature,
+        cache=prediction_cache,
+        details=details,
+        fast_path=fast_path,
+        compaction=compact,
+        constrained=constrained,
+        client=ollama_pool,
+        keep_alive=_keep_alive,
+        early_stop=early_stop
+    )
+    if ensemble:
+        predicted = tools.ensemble_predict_tissue(list(ensemble), quorum=quorum, **kwargs)
+    else:
+        predicted = tools.predict_tissue_from_list(model=model, on_text=_on_text, **kwargs)
+    return predicted, details
+
+def run_name_step(upload_hash, _tumor_json, tissue_name, model, temperature, compact, constrained,
+                                 embed_model=None, top_k=None, _keep_alive=None, ensemble=None, quorum=None,
+                                 early_stop=False, _on_text=None, fast_path=False):
+    details = {}
+    kwargs = dict(
+        tissue_name=tissue_name,
+        tumor_json=_tumor_json,
+        embed_model=embed_model,
+        top_k=top_k,
+        temperature=temperature,
+        data_base_path="../data/oncotree_tissues",
+        cache=prediction_cache,
+        details=details,
+        fast_path=fast_path,
+        compaction=compact,
+        constrained=constrained,
+        client=ollama_pool,
+        keep_alive=_keep_alive,
+        early_stop=early_stop
+    )
+    if ensemble:
+        predicted = tools.ensemble_predict_oncotree_name(models=list(ensemble), quorum=quorum, **kwargs)
+    else:
+        predicted = tools.predict_oncotree_name_from_tissue(model=model, on_text=_on_text, **kwargs)
+    return predicted, details
+
+cached_predict_tissue = st.cache_data(max_entries=64, show_spinner=False)(run_tissue_step)
+cached_predict_oncotree_name = st.cache_data(max_entries=64, show_spinner=False)(run_name_step)
+
+def live_text(placeholder):
+    # on_text callback: render the partial reply while it streams (ensemble calls run off-thread, so not there)
+    if not stream_live or ensemble:
         return None
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(uploaded.getvalue())
-    tmp.close()
-    return tmp.name
+    return lambda text: placeholder.code(text + " ▌")
+
+def show_ensemble_vote(details):
+    vote = details.get("ensemble")
+    if vote:
+        answers = ", ".join(f"{m}: {a}" for m, a in vote["answers"].items())
+        stopped = f", quorum reached before {vote['models'] - vote['answered']} answered" if vote["short_circuit"] else ""
+        st.caption(f"Ensemble agreement {vote['votes']}/{vote['answered']} answers{stopped} "
+                   f"(confidence {tools.agreement_confidence(vote['agreement'])}/5) — {answers}")
+
+cache_stats = prediction_cache.stats()
+st.sidebar.caption(f"Prediction cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+if ollama_pool is not None:
+    healthy = sum(h["healthy"] for h in ollama_pool.stats())
+    st.sidebar.caption(f"Ollama hosts: {healthy}/{len(ollama_pool.stats())} healthy")
+
+# ------------------ Batch mode ------------------
+# Many reports at once: records are queued on a shared background thread pool and the
+# page only polls their futures, so the UI stays responsive while the queue drains.
+batch_mode = st.sidebar.toggle("Batch mode (multiple files / zip)", value=False)
+batch_tissue_list_path = "../data/tissue_types.txt"
+batch_oncotree_base = "../data/oncotree_tissues"
+
+@st.cache_resource
+def get_batch_executor():
+    hosts = len(ollama_pool.stats()) if ollama_pool is not None else 1
+    return ThreadPoolExecutor(max_workers=test_models.default_workers(hosts), thread_name_prefix="oncotree-batch")
+
+def read_batch_uploads(uploads):
+    """
+    (name, raw JSON) records from uploaded .json files, JSONL exports and zip archives;
+    names are made unique across uploads. An upload or archive member that can't be read
+    is reported with st.error and skipped; the rest of the batch still runs.
+    """
+    records, seen = [], set()
+    for upload in uploads:
+        data = upload.getvalue()
+        lower = upload.name.lower()
+        try:
+            if lower.endswith(".zip"):
+                items = ((f"{upload.name}/{n}", t) for n, t in record_sources.iter_zip(io.BytesIO(data)))
+            elif lower.endswith((".jsonl", ".ndjson")):
+                items = record_sources.iter_jsonl_stream(io.StringIO(data.decode("utf-8", errors="replace")), upload.name)
+            else:
+                items = [(upload.name, data.decode("utf-8", errors="replace"))]
+            for name, text in items:
+                if isinstance(text, record_sources.UnreadableRecord):
+                    st.error(f"Skipped {name}: could not read it ({text})")
+                    continue
+                unique, n = name, 1
+                while unique in seen:
+                    n += 1
+                    unique = f"{name}#{n}"
+                seen.add(unique)
+                records.append((unique, text))
+        except (zipfile.BadZipFile, *record_sources.READ_ERRORS) as e:
+            st.error(f"Skipped {upload.name}: not a readable archive ({type(e).__name__}: {e})")
+    return records
+
+def batch_settings():
+    # captured when the batch starts, so later sidebar changes don't affect queued records
+    return {
+        "model": model, "temperature": temperature, "cache": prediction_cache, "fast_path": fast_path,
+        "compaction": compact, "constrained": constrained, "client": ollama_pool, "keep_alive": keep_alive,
+        "embed_model": embed_model, "top_k": int(embed_top_k) if embed_model else None,
+        "tissue_margin": tissue_margin if embed_model else None,
+        "ensemble": list(ensemble) if ensemble else None, "quorum": int(quorum) if ensemble else None,
+        "early_stop": stream_live,
+    }
+
+def run_batch_record(name, text, settings):
+    details = {}
+    try:
+        res = test_models.process_record(name, text, batch_tissue_list_path, batch_oncotree_base,
+                                         details=details, **settings)
+    except Exception as e:
+        test_models.record_error(details, e)
+        res = {"oncotree_tissue": "", "oncotree_code": "", "oncotree_name": "", "test_order_id": None}
+    return res, details
+
+def run_batch_override(text, tissue, settings, previous):
+    """
+    Step 2 only, with a tissue chosen by the reviewer (the single-report override flow).
+    """
+    details = {"flags": [f"tissue overridden by reviewer: {tissue}"]}
+    reference = tools.load_reference(batch_tissue_list_path, batch_oncotree_base)
+    kwargs = dict(
+        tissue_name=tissue, tumor_json=text, temperature=settings["temperature"],
+        data_base_path=batch_oncotree_base, cache=settings["cache"], top_k=settings["top_k"], details=details,
+        fast_path=settings["fast_path"], tissue_list_path=batch_tissue_list_path, compaction=settings["compaction"],
+        constrained=settings["constrained"], client=settings["client"], keep_alive=settings["keep_alive"],
+        embed_model=settings["embed_model"], early_stop=settings["early_stop"])
+    try:
+        if settings["ensemble"]:
+            onco_name = tools.ensemble_predict_oncotree_name(models=settings["ensemble"], quorum=settings["quorum"],
+                                                             **kwargs).strip()
+        else:
+            onco_name = tools.predict_oncotree_name_from_tissue(model=settings["model"], **kwargs).strip()
+        onco_name = test_models.salvage(onco_name, reference.names(tissue), details, "name") or onco_name
+    except Exception as e:
+        test_models.record_error(details, e)
+        onco_name = "none"
+    details["tissue_path"], details["name_path"] = "reviewer", details.get("path", "llm")
+    res = dict(previous, oncotree_tissue=tissue, oncotree_name=onco_name or "none",
+               oncotree_code=reference.code(tissue, onco_name) or "none", rationale="; ".join(details["flags"]))
+    return res, details
+
+def batch_status(future):
+    if future.cancelled():
+        return "cancelled"
+    if not future.done():
+        return "running" if future.running() else "queued"
+    res, details = future.result()
+    if details.get("errors"):
+        return "failed"
+    if res.get("oncotree_tissue") in ("", "none"):
+        return "needs tissue"
+    if res.get("oncotree_code") in ("", "none"):
+        return "invalid name"
+    return "ok"
+
+def render_batch_progress():
+    job = st.session_state["batch_job"]
+    statuses = {name: batch_status(job["futures"][name]) for name in job["names"]}
+    finished = sum(s not in ("queued", "running") for s in statuses.values())
+    st.progress(finished / len(statuses), text=f"{finished}/{len(statuses)} records processed")
+    rows = []
+    for name in job["names"]:
+        row = {"record": name, "status": statuses[name]}
+        future = job["futures"][name]
+        if future.done() and not future.cancelled():
+            res, details = future.result()
+            row.update(tissue=res.get("oncotree_tissue"), name=res.get("oncotree_name"),
+                       code=res.get("oncotree_code"), path=f"{details.get('tissue_path', '-')} / {details.get('name_path', '-')}")
+        rows.append(row)
+    st.dataframe(rows, hide_index=True)
+    if finished == len(statuses) and not job.get("finished"):
+        job["finished"] = True
+        st.rerun()  # full rerun: show the review section and download
+
+if batch_mode:
+    st.header("Batch — predict many reports")
+    uploads = st.file_uploader("Upload tumor JSON files, JSONL exports or a zip of JSON files",
+                               type=["json", "jsonl", "ndjson", "zip"], accept_multiple_files=True)
+    if not uploads:
+        st.info("Provide one or more files to proceed.")
+        st.stop()
+    batch_key = hashlib.sha256(b"".join(hashlib.sha256(u.getvalue()).digest() for u in uploads)).hexdigest()
+    job = st.session_state.get("batch_job")
+    if job is None or job["key"] != batch_key:
+        batch_records = read_batch_uploads(uploads)
+        if st.button(f"Start batch ({len(batch_records)} records)", type="primary", disabled=not batch_records):
+            settings = batch_settings()
+            executor = get_batch_executor()
+            st.session_state["batch_job"] = {
+                "key": batch_key,
+                "names": [name for name, _ in batch_records],
+                "texts": dict(batch_records),
+                "settings": settings,
+                "futures": {name: executor.submit(run_batch_record, name, text, settings) for name, text in batch_records},
+            }
+            st.rerun()
+        st.stop()
+
+    st.fragment(render_batch_progress, run_every=None if job.get("finished") else 1.0)()
+    if not job.get("finished"):
+        if st.button("Cancel queued records"):
+            for future in job["futures"].values():
+                future.cancel()
+            st.rerun()
+        st.stop()
+
+    results = {name: job["futures"][name].result() for name in job["names"] if not job["futures"][name].cancelled()}
+    statuses = {name: batch_status(job["futures"][name]) for name in job["names"]}
+
+    # Only unknown / invalid predictions need a reviewer; everything else is accepted as is.
+    reference = tools.load_reference(batch_tissue_list_path, batch_oncotree_base)
+    needs_tissue = [name for name in job["names"] if statuses[name] == "needs tissue"]
+    if needs_tissue:
+        st.subheader(f"Review — {len(needs_tissue)} record(s) without an accepted tissue")
+        for name in needs_tissue:
+            with st.expander(name):
+                st.json(job["texts"][name], expanded=False)
+                chosen = st.selectbox("Tissue for step 2", options=list(reference.tissues), key=f"batch_tissue_{name}")
+                if st.button("Override and continue with selected tissue", key=f"batch_override_{name}"):
+                    job["futures"][name] = get_batch_executor().submit(
+                        run_batch_override, job["texts"][name], chosen, job["settings"], results[name][0])
+                    job["finished"] = False
+                    st.rerun()
+    for label, status in (("without a valid OncoTree name (manual review)", "invalid name"), ("that failed", "failed")):
+        flagged = [name for name in job["names"] if statuses[name] == status]
+        if flagged:
+            st.warning(f"{len(flagged)} record(s) {label}: " + ", ".join(flagged[:20]) + (" ..." if len(flagged) > 20 else ""))
+
+    st.download_button(
+        "Download results (JSONL)",
+        data="".join(json.dumps(results[name][0]) + "\n" for name in job["names"] if name in results),
+        file_name="oncotree_predictions.jsonl",
+        mime="application/x-ndjson",
+    )
+    if st.button("Start a new batch"):
+        del st.session_state["batch_job"]
+        st.rerun()
+    st.stop()
+# ------------------------------------------------------------
 
 # Tumor JSON (upload)
 uploaded_tumor = st.file_uploader("Upload tumor JSON", type=["json"])
 
-tumor_json_path = None
-if uploaded_tumor is not None:
-    tumor_json_path = _write_tmp(uploaded_tumor, ".json")
-
-if not tumor_json_path:
+if uploaded_tumor is None:
     st.info("Provide tumor JSON (upload) to proceed.")
     st.stop()
 
+# keep the upload in memory; its hash keys the memoized predictions
+upload_bytes = uploaded_tumor.getvalue()
+upload_hash = hashlib.sha256(upload_bytes).hexdigest()
+
 # ------------------ Preview (collapsible) ------------------
 # Try to parse the uploaded file and show a small preview inside an expander.
 try:
-    raw = uploaded_tumor.getvalue().decode("utf-8")
+    raw = upload_bytes.decode("utf-8")
 except Exception:
-    # fallback if bytes -> str already or decode fails
-    raw = uploaded_tumor.getvalue()
-    if isinstance(raw, bytes):
-        raw = raw.decode("utf-8", errors="replace")
+    # fallback if decode fails
+    raw = upload_bytes.decode("utf-8", errors="replace")
 
 try:
     parsed = json.loads(raw)
@@ -83,13 +436,14 @@ st.header("Step 1 — Predict tissue")
 tissue_list_path = "../data/tissue_types.txt"
 
 # call the function (very small — no extra validation)
+live_tissue = st.empty()
+on_text = live_text(live_tissue)
 with st.spinner("Predicting oncotree tissue..."):
-    predicted_tissue = tools.predict_tissue_from_list(
-        tissue_list_path=tissue_list_path,
-        tumor_json_path=tumor_json_path,
-        model=model,
-        temperature=temperature
-    )
+    predicted_tissue, tissue_details = (run_tissue_step if on_text else cached_predict_tissue)(upload_hash, raw, tissue_list_path, model, temperature, compact, constrained,
+                                                                  embed_model, tissue_margin if embed_model else None,
+                                                                  keep_alive, ensemble, quorum, stream_live,
+                                                                  on_text, fast_path=fast_path)
+live_tissue.empty()
 
 # Reset override flag if prediction changed since last run
 if st.session_state.get("last_predicted_tissue") != predicted_tissue:
@@ -98,17 +452,33 @@ st.session_state["last_predicted_tissue"] = predicted_tissue
 
 st.subheader("Predicted tissue")
 st.code(predicted_tissue or "(empty)")
+if tissue_details.get("path", "llm") == "embedding":
+    st.caption("Chosen by embedding similarity with a clear margin (no LLM call).")
+elif tissue_details.get("path", "llm") != "llm":
+    st.caption("Resolved directly from the report (no LLM call).")
+show_ensemble_vote(tissue_details)
+show_stage_metrics("Step 1 (tissue)", tissue_details)
 
 # let user accept or override
 # let user accept or override (dropdown)
-tissues = tools.parse_tissue_list(tissue_list_path)
+reference = tools.load_reference(tissue_list_path, "../data/oncotree_tissues")
+tissues = list(reference.tissues)
+
+# Salvage near-miss outputs (case, punctuation, truncation) instead of rejecting them outright
+tissue_salvage = tools.salvage_answer(predicted_tissue, tissues)
+if tissue_salvage["status"] in ("normalized", "fuzzy"):
+    st.info(f"Model output matched to canonical tissue **{tissue_salvage['match']}** (score {tissue_salvage['score']:.2f}).")
+    predicted_tissue = tissue_salvage["match"]
+elif tissue_salvage["status"] == "borderline":
+    st.info(f"Closest canonical tissue: **{tissue_salvage['match']}** (score {tissue_salvage['score']:.2f}) — please confirm below.")
+suggested_tissue = tissue_salvage["match"] if tissue_salvage["match"] in tissues else None
 
 # IMPORTANT: do NOT insert the bad prediction into the dropdown.
 # The selectbox options are strictly the read-in canonical tissues.
 chosen_tissue = st.selectbox(
     "*Optional: override tissue for step 2*",
     options=tissues,
-    index=tissues.index(predicted_tissue) if predicted_tissue in tissues else 0
+    index=tissues.index(suggested_tissue) if suggested_tissue else 0
 )
 
 # --- Validation / stopping logic (minimal changes per request) ---
@@ -150,26 +520,37 @@ st.header("Step 2 — Predict oncotree name and code")
 run = st.button("Run Step 2")
 
 if run:
+    live_name = st.empty()
+    on_text = live_text(live_name)
     with st.spinner("Predicting OncoTree name and code..."):
-        onco_pred = tools.predict_oncotree_name_from_tissue(
-            tissue_name=chosen_tissue,
-            tumor_json_path=tumor_json_path,
-            model=model,
-            temperature=temperature,
-            data_base_path="../data/oncotree_tissues"
-        ).strip()
+        onco_pred, name_details = (run_name_step if on_text else cached_predict_oncotree_name)(upload_hash, raw, chosen_tissue, model, temperature, compact,
+                                                              constrained, embed_model,
+                                                              int(embed_top_k) if embed_model else None, keep_alive,
+                                                              ensemble, quorum, stream_live, on_text,
+                                                              fast_path=fast_path)
+        onco_pred = onco_pred.strip()
+    live_name.empty()
     st.subheader("OncoTree name")
     st.code(onco_pred or "(empty)")
+    if name_details.get("path", "llm") != "llm":
+        st.caption("Resolved directly from the report (no LLM call).")
+    show_ensemble_vote(name_details)
+    show_stage_metrics("Step 2 (OncoTree name)", name_details)
 
     # Load canonical mapping for this tissue
-    oncotree_map = tools.load_oncotree_name_to_code(
-        tissue_name=chosen_tissue,
-        data_base_path="../data/oncotree_tissues"
-    )
+    oncotree_map = reference.name_to_code(chosen_tissue)
 
     # canonical oncotree names for validation
     canonical_names = list(oncotree_map.keys())
 
+    # Salvage near-miss names: accept high-confidence matches, surface borderline ones for review
+    name_salvage = tools.salvage_answer(onco_pred, canonical_names)
+    if name_salvage["status"] in ("normalized", "fuzzy"):
+        st.info(f"Model output matched to canonical name **{name_salvage['match']}** (score {name_salvage['score']:.2f}).")
+        onco_pred = name_salvage["match"]
+    elif name_salvage["status"] == "borderline":
+        st.warning(f"Closest canonical name: **{name_salvage['match']}** (score {name_salvage['score']:.2f}) — not accepted automatically.")
+
     # Validate model's name: if blank, "unknown", or not in canonical list -> show message and do NOT proceed
     onco_lower = (onco_pred or "").strip().lower()
     is_onco_blank = (onco_pred == "")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark: runs the test_models.py flow against a local stub
+Ollama server (stub_ollama_server.py) over a synthetic corpus, for several worker
+counts, and reports records/sec, record and per-stage latency, and memory.
+
+No GPU or real model is needed, so runs are reproducible and cheap enough to catch
+throughput regressions in the pipeline itself.
+
+With --hosts N, N stub servers are started and requests are balanced across them
+through oncotree_utils.OllamaPool, to show how throughput scales with hosts.
+
+Usage:
+    python benchmark.py --count 200 --workers 1,2,4,8 --parallel 8 --prefill-tps 2000 --gen-tps 40
+    python benchmark.py --count 200 --workers 4,8,16 --parallel 4 --hosts 4
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from pathlib import Path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(port, args):
+    """
+    Launch stub_ollama_server.py as a subprocess (keeps its memory out of our numbers)
+    and wait until it answers.
+    """
+    cmd = [sys.executable, str(Path(__file__).with_name("stub_ollama_server.py")),
+           "--port", str(port), "--prefill-tps", str(args.prefill_tps), "--gen-tps", str(args.gen_tps),
+           "--parallel", str(args.parallel), "--load-seconds", str(args.load_seconds), "--models", args.model]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/version", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("stub Ollama server did not start")
+
+
+def run_once(test_models, files, workers, args, client=None):
+    """
+    Process every file once with the given worker count; return the result row.
+    """
+    def run_one(f):
+        details = {}
+        started = time.perf_counter()
+        test_models.process_file(str(f), args.tissue_list, args.oncotree_base, args.model, 0.0,
+                                 details=details, fast_path=args.fast_path, mode=args.mode,
+                                 compaction=True if args.compact else None, client=client)
+        details["record_seconds"] = time.perf_counter() - started
+        return details
+
+    tools = test_models.tools
+    started = time.perf_counter()
+    per_record = [details for _, details in test_models.run_ordered(run_one, files, workers)]
+    elapsed = time.perf_counter() - started
+
+    # tracing slows every allocation, so peak memory comes from a separate, untimed pass
+    peak = None
+    if args.memory:
+        tracemalloc.start()
+        for _ in test_models.run_ordered(run_one, files, workers):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    row = {
+        "workers": workers,
+        "records": len(per_record),
+        "seconds": elapsed,
+        "records_per_sec": len(per_record) / elapsed if elapsed else 0.0,
+        "record_p50": tools.percentile([d["record_seconds"] for d in per_record], 50),
+        "record_p95": tools.percentile([d["record_seconds"] for d in per_record], 95),
+        "peak_traced_mb": peak / 1e6 if peak is not None else None,
+        "stages": {},
+    }
+    stage_names = sorted({name for d in per_record for name in d.get("stages", {})})
+    for name in stage_names:
+        stages = [d["stages"][name] for d in per_record if name in d.get("stages", {})]
+        row["stages"][name] = tools.summarize_llm_metrics([st.get("llm") for st in stages])
+    return row
+
+
+def print_table(rows):
+    print(f"{'workers':>7}  {'rec/s':>7}  {'p50 rec':>8}  {'p95 rec':>8}  {'peak MB':>8}  stage p50 (s)")
+    for row in rows:
+        stages = ", ".join(f"{name} {s['p50_seconds']:.3f}" for name, s in row["stages"].items())
+        peak = f"{row['peak_traced_mb']:>8.1f}" if row["peak_traced_mb"] is not None else f"{'-':>8}"
+        print(f"{row['workers']:>7}  {row['records_per_sec']:>7.2f}  {row['record_p50']:>7.3f}s  "
+              f"{row['record_p95']:>7.3f}s  {peak}  {stages}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the prediction pipeline against a stub Ollama server")
+    p.add_argument("--count", type=int, default=100, help="Synthetic records to generate (ignored with --corpus)")
+    p.add_argument("--corpus", default=None, help="Existing directory of .json tumor files to use instead")
+    p.add_argument("--workers", default="1,2,4,8", help="Comma-separated worker counts to try")
+    p.add_argument("--mode", choices=["two-stage", "joint"], default="two-stage")
+    p.add_argument("--fast-path", action="store_true", help="Enable the rule fast path (off to measure LLM flow)")
+    p.add_argument("--compact", action="store_true", help="Compact the tumor JSON in prompts")
+    p.add_argument("--model", default="stub:latest")
+    p.add_argument("--prefill-tps", type=float, default=2000.0, help="Stub prompt tokens/sec")
+    p.add_argument("--gen-tps", type=float, default=40.0, help="Stub generated tokens/sec")
+    p.add_argument("--parallel", type=int, default=8, help="Stub parallel request slots")
+    p.add_argument("--hosts", type=int, default=1, help="Number of stub servers to balance across (OllamaPool)")
+    p.add_argument("--load-seconds", type=float, default=0.0, help="Stub model load time on first request")
+    p.add_argument("--tissue-list", default="../data/tissue_types.txt")
+    p.add_argument("--oncotree-base", default="../data/oncotree_tissues")
+    p.add_argument("--no-memory", dest="memory", action="store_false",
+                   help="Skip the extra traced pass that measures peak Python memory")
+    p.add_argument("--json-out", default=None, help="Also write the results as JSON")
+    args = p.parse_args()
+
+    ports = [free_port() for _ in range(max(1, args.hosts))]
+    # the ollama module builds its default client from OLLAMA_HOST at import time,
+    # so point it at the stub before oncotree_utils / test_models are imported
+    os.environ["OLLAMA_HOST"] = f"127.0.0.1:{ports[0]}"
+    import make_synthetic_corpus
+    import test_models
+
+    stubs = [start_stub(port, args) for port in ports]
+    client = None
+    if len(ports) > 1:
+        client = test_models.tools.OllamaPool([f"127.0.0.1:{port}" for port in ports], max_per_host=args.parallel)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            if args.corpus:
+                files = sorted(Path(args.corpus).glob("*.json"))
+            else:
+                files = make_synthetic_corpus.write_corpus(tmp, args.count, tissue_list=args.tissue_list,
+                                                           oncotree_base=args.oncotree_base)
+            print(f"Benchmarking {len(files)} records, mode={args.mode}, stub prefill {args.prefill_tps:.0f} tok/s, "
+                  f"generation {args.gen_tps:.0f} tok/s, {args.parallel} slots x {len(stubs)} host(s)")
+            rows = [run_once(test_models, files, int(w), args, client) for w in args.workers.split(",") if w.strip()]
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+
+    print_table(rows)
+    if client is not None:
+        print("Requests per host:", ", ".join(f"{h['host']} {h['requests']}" for h in client.stats()))
+    print(f"Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
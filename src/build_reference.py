@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Build the OncoTree reference data from the per-tissue source exports in one pass.
+
+Each ../data/oncotree_tissues/{tissue}.json (concatenated OncoTree JSON objects, or a
+JSON array of them) is read once, hashed and parsed incrementally, and produces:
+  {tissue}_oncotree_names.txt   one oncotree_name per line, in source order
+  {tissue}_oncotree_map.json    {oncotree_name: oncotree_code}
+plus the compiled oncotree_reference.json that load_reference() reads at startup.
+
+Tissues whose source is unchanged since the last build (same size and mtime, or
+same SHA-256) are skipped, and output files are only rewritten when their content
+changes, so refreshing after an OncoTree release only touches what changed.
+Replaces extract_oncotree_names.py and create_mapping_dictionary.py.
+
+Usage:
+    python build_reference.py                 # all tissues in ../data/tissue_types.txt
+    python build_reference.py Breast Kidney   # just these
+    python build_reference.py --force         # re-parse every source
+"""
+import argparse
+import codecs
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+import oncotree_utils as tools
+
+BUILD_STATE_NAME = "oncotree_build_state.json"
+READ_SIZE = 1 << 20
+
+# whitespace and the commas/brackets of an enclosing array between top-level objects
+_SEPARATORS = re.compile(r"[\s,\[\]]*")
+
+
+def iter_json_objects(chunks):
+    """
+    Yield each top-level JSON object from an iterable of text chunks, decoding objects
+    as soon as they are complete (json.JSONDecoder.raw_decode) instead of counting braces.
+    Only the unparsed tail is kept between chunks; after a failed attempt the decode is
+    retried once the tail has doubled, so a large object costs linear time.
+    Raises ValueError if the input ends in the middle of an object.
+    """
+    decoder = json.JSONDecoder()
+    pending = []  # unparsed text, joined only when a decode is attempted
+    pending_chars = 0
+    retry_at = 0
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        if chunk:
+            pending.append(chunk)
+            pending_chars += len(chunk)
+        if pending_chars < retry_at and not final:
+            continue
+        buf = "".join(pending)
+        pos = 0
+        retry_at = 0
+        while True:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if final:
+                    raise ValueError(f"Truncated or invalid JSON: {e.msg}") from None
+                retry_at = 2 * (len(buf) - pos)
+                break
+            yield obj
+        pending = [buf[pos:]]
+        pending_chars = len(pending[0])
+
+
+def read_source(path):
+    """
+    Read a source export once: return (sha256 hex digest, names list, name -> code map).
+    """
+    digest = hashlib.sha256()
+    text = codecs.getincrementaldecoder("utf-8")()
+
+    def chunks():
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(READ_SIZE)
+                digest.update(data)
+                yield text.decode(data, final=not data)
+                if not data:
+                    return
+
+    names = []
+    oncotree_map = {}
+    for obj in iter_json_objects(chunks()):
+        if not isinstance(obj, dict) or "oncotree_name" not in obj:
+            continue
+        name = obj["oncotree_name"].strip()
+        names.append(name)
+        if "oncotree_code" in obj:
+            oncotree_map[name] = obj["oncotree_code"].strip()
+    return digest.hexdigest(), names, oncotree_map
+
+
+def write_if_changed(path, text):
+    """
+    Atomically replace `path` with `text` unless it already has exactly that content.
+    Returns True if the file was written.
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+def load_build_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_tissue(tissue, source_dir, output_dir, state, force = False):
+    """
+    Refresh one tissue's names list and map from its source export. Returns a status:
+    "missing" (no source), "unchanged" (skipped), "same" (re-parsed, outputs already
+    current) or "updated". `state` is this tissue's build-state entry, updated in place.
+    """
+    source = os.path.join(source_dir, f"{tissue}.json")
+    names_path = os.path.join(output_dir, f"{tissue}_oncotree_names.txt")
+    map_path = os.path.join(output_dir, f"{tissue}_oncotree_map.json")
+    if not os.path.exists(source):
+        return "missing"
+    stat = os.stat(source)
+    outputs_exist = os.path.exists(names_path) and os.path.exists(map_path)
+    if not force and outputs_exist and state.get("size") == stat.st_size and state.get("mtime_ns") == stat.st_mtime_ns:
+        return "unchanged"
+
+    digest, names, oncotree_map = read_source(source)
+    unchanged = not force and outputs_exist and state.get("sha256") == digest
+    state.update(sha256=digest, size=stat.st_size, mtime_ns=stat.st_mtime_ns, names=len(names))
+    if unchanged:
+        return "unchanged"
+    wrote = write_if_changed(names_path, "".join(name + "\n" for name in names))
+    wrote = write_if_changed(map_path, json.dumps(oncotree_map, indent=2)) or wrote
+    return "updated" if wrote else "same"
+
+
+def main():
+    p = argparse.ArgumentParser(description="Build OncoTree names lists, maps and the compiled reference in one pass")
+    p.add_argument("tissues", nargs="*", help="Only build these tissues (default: every tissue in --tissue-list)")
+    p.add_argument("--tissue-list", default="../data/tissue_types.txt", help="Path to tissue_types.txt")
+    p.add_argument("--source-dir", default="../data/oncotree_tissues", help="Directory holding the {tissue}.json exports")
+    p.add_argument("--output-dir", default=None, help="Where to write the outputs (default: --source-dir)")
+    p.add_argument("--force", action="store_true", help="Re-parse every source even if its hash is unchanged")
+    p.add_argument("--no-compiled", action="store_true", help=f"Don't write the compiled {tools.COMPILED_REFERENCE_NAME}")
+    args = p.parse_args()
+
+    output_dir = args.output_dir or args.source_dir
+    os.makedirs(output_dir, exist_ok=True)
+    all_tissues = tools.parse_tissue_list(args.tissue_list)
+    unknown = [t for t in args.tissues if t not in all_tissues]
+    if unknown:
+        print("Not in the tissue list:", ", ".join(unknown))
+        return
+
+    started = time.perf_counter()
+    state_path = os.path.join(output_dir, BUILD_STATE_NAME)
+    build_state = load_build_state(state_path)
+    counts = {}
+    for tissue in args.tissues or all_tissues:
+        try:
+            status = build_tissue(tissue, args.source_dir, output_dir, build_state.setdefault(tissue, {}), args.force)
+        except ValueError as e:
+            print(f"{tissue}: {e}")
+            build_state.pop(tissue, None)
+            status = "failed"
+        counts[status] = counts.get(status, 0) + 1
+        if status != "unchanged":
+            print(f"{tissue}: {status}" + (f" ({build_state[tissue]['names']} names)" if tissue in build_state and
+                                           "names" in build_state[tissue] else ""))
+    build_state = {t: entry for t, entry in build_state.items() if entry}
+    write_if_changed(state_path, json.dumps(build_state, indent=2, sort_keys=True))
+
+    compiled_path = os.path.join(output_dir, tools.COMPILED_REFERENCE_NAME)
+    if not args.no_compiled and (counts.get("updated") or
+                                 not tools._compiled_reference_is_fresh(compiled_path, args.tissue_list, output_dir)):
+        try:
+            reference = tools.OncoTreeReference(
+                all_tissues,
+                {t: tools.parse_oncotree_list(t, base_path=output_dir) for t in all_tissues},
+                {t: tools.load_oncotree_name_to_code(t, output_dir) for t in all_tissues},
+            )
+        except (OSError, ValueError) as e:
+            print("Compiled reference not written:", e)
+        else:
+            tools.save_reference(reference, compiled_path)
+            print(f"Wrote {compiled_path}")
+
+    print(", ".join(f"{n} {s}" for s, n in sorted(counts.items())) + f" in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
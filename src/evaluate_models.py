@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Model sweep: run a labeled tumor-JSON set through test_models.process_record() for
+every model x temperature and score accuracy and speed together, so the model we
+pick is the fastest one that meets the accuracy bar rather than the biggest one.
+
+Labels are JSONL lines {"test_order_id", "oncotree_tissue", "oncotree_name",
+"oncotree_code"} (the labels.jsonl make_synthetic_corpus.py writes, or a hand-labeled
+set). For each run the table reports tissue / name / code accuracy over the labeled
+records, records/sec, p50/p95 record latency, LLM tokens per record and the share of
+LLM calls served from --cache. Cached calls cost no tokens and almost no time, so
+speed numbers are only comparable between runs with similar hit rates; re-running
+with a warm cache is a cheap way to re-score after a prompt or salvage change.
+
+Usage:
+    python evaluate_models.py --input ../bench/corpus --models all --cache ../.cache/predictions.sqlite
+    python evaluate_models.py --input ../bench/corpus --models gemma3:1b,gemma3:4b,granite4:latest \
+        --temperatures 0,0.2 --min-accuracy 0.9 --output ../results/model_sweep.md
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from pathlib import Path
+import oncotree_utils as tools
+import record_sources
+import test_models
+
+LABEL_FIELDS = ("oncotree_tissue", "oncotree_name", "oncotree_code")
+TABLE_COLUMNS = ["model", "temperature", "records", "labeled", "tissue_acc", "name_acc", "code_acc",
+                 "records_per_sec", "p50_seconds", "p95_seconds", "tokens_per_record", "cache_hit_rate", "errors"]
+
+
+def load_labels(path):
+    """
+    Read a labels JSONL file into {test_order_id: {field: expected value}}.
+    """
+    labels = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            labels[str(row["test_order_id"])] = {k: row.get(k) for k in LABEL_FIELDS}
+    return labels
+
+
+def score(results, labels):
+    """
+    Accuracy of each output field over the records that have a label.
+    Returns ({field: accuracy}, number of labeled records).
+    """
+    # ids are compared as strings on both sides (labels may hold numbers, outputs strings or vice versa)
+    scored = [(res, labels[str(res.get("test_order_id"))]) for res in results
+              if str(res.get("test_order_id")) in labels]
+    if not scored:
+        return {field: None for field in LABEL_FIELDS}, 0
+    return {field: sum((res.get(field) or "") == (gold.get(field) or "") for res, gold in scored) / len(scored)
+            for field in LABEL_FIELDS}, len(scored)
+
+
+def llm_calls(details):
+    return [st["llm"] for st in details.get("stages", {}).values() if st.get("llm")]
+
+
+def run_sweep_entry(records, labels, model, temperature, args, settings, workers):
+    """
+    Predict every record with one model / temperature and return its table row.
+    """
+    def run_one(record):
+        name, tumor_json = record
+        details = {}
+        started = time.perf_counter()
+        try:
+            res = test_models.process_record(name, tumor_json, args.tissue_list, args.oncotree_base, model,
+                                             temperature, details=details, **settings)
+        except Exception as e:
+            test_models.record_error(details, e)
+            res = {"test_order_id": os.path.splitext(os.path.basename(name))[0]}
+        details["record_seconds"] = time.perf_counter() - started
+        return res, details
+
+    started = time.perf_counter()
+    outputs = [out for _, out in test_models.run_ordered(run_one, records, workers)]
+    elapsed = time.perf_counter() - started
+
+    results = [res for res, _ in outputs]
+    per_record = [details for _, details in outputs]
+    accuracy, labeled = score(results, labels)
+    seconds = [d["record_seconds"] for d in per_record]
+    calls = [m for d in per_record for m in llm_calls(d)]
+    tokens = sum(m.get("prompt_eval_count", 0) + m.get("eval_count", 0) for m in calls if not m.get("cached"))
+    return {
+        "model": model,
+        "temperature": temperature,
+        "records": len(results),
+        "labeled": labeled,
+        "tissue_acc": accuracy["oncotree_tissue"],
+        "name_acc": accuracy["oncotree_name"],
+        "code_acc": accuracy["oncotree_code"],
+        "records_per_sec": len(results) / elapsed if elapsed else 0.0,
+        "p50_seconds": tools.percentile(seconds, 50),
+        "p95_seconds": tools.percentile(seconds, 95),
+        "tokens_per_record": tokens / len(results) if results else 0.0,
+        "cache_hit_rate": sum(bool(m.get("cached")) for m in calls) / len(calls) if calls else 0.0,
+        "errors": sum(bool(d.get("errors")) for d in per_record),
+    }
+
+
+def pick_model(rows, min_accuracy, field = "code_acc"):
+    """
+    The fastest row (records/sec) whose `field` accuracy meets min_accuracy, or None.
+    """
+    passing = [r for r in rows if r[field] is not None and r[field] >= min_accuracy]
+    return max(passing, key=lambda r: r["records_per_sec"]) if passing else None
+
+
+def format_cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def print_table(rows):
+    widths = {c: max(len(c), *(len(format_cell(r[c])) for r in rows)) for c in TABLE_COLUMNS}
+    print("  ".join(c.rjust(widths[c]) for c in TABLE_COLUMNS))
+    for row in rows:
+        print("  ".join(format_cell(row[c]).rjust(widths[c]) for c in TABLE_COLUMNS))
+
+
+def write_table(rows, path):
+    """
+    Write the comparison table as Markdown (.md), JSON (.json) or CSV (anything else).
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".json"):
+            json.dump(rows, f, indent=2)
+        elif path.endswith(".md"):
+            f.write("| " + " | ".join(TABLE_COLUMNS) + " |\n")
+            f.write("|" + "---|" * len(TABLE_COLUMNS) + "\n")
+            for row in rows:
+                f.write("| " + " | ".join(format_cell(row[c]) for c in TABLE_COLUMNS) + " |\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Score models x temperatures on a labeled set for accuracy and speed")
+    p.add_argument("--input", required=True, help="Labeled records: directory, JSONL or archive (as test_models.py)")
+    p.add_argument("--labels", default=None, help="Labels JSONL (default: labels.jsonl next to / inside --input)")
+    p.add_argument("--models", default="all", help="Comma-separated models, or 'all' for every local Ollama model")
+    p.add_argument("--temperatures", default="0.0", help="Comma-separated temperatures to try")
+    p.add_argument("--min-accuracy", type=float, default=0.9,
+                   help="Code accuracy a model needs to be recommended (the fastest passing one is picked)")
+    p.add_argument("--output", default=None, help="Write the comparison table (.csv, .md or .json)")
+    p.add_argument("--tissue-list", default="../data/tissue_types.txt", help="Path to tissue_types.txt")
+    p.add_argument("--oncotree-base", default="../data/oncotree_tissues", help="Base dir for oncotree mappings")
+    p.add_argument("--ext", default=".json", help="File extension to look for (directories and archives)")
+    p.add_argument("--mode", choices=["two-stage", "joint"], default="two-stage")
+    p.add_argument("--prerank-top-k", type=int, default=None, help="Send only the top-K OncoTree names to the LLM")
+    p.add_argument("--fast-path", action="store_true",
+                   help="Skip the LLM when the report already pins an OncoTree name or code")
+    p.add_argument("--compact", action="store_true", help="Compact the tumor JSON before prompting")
+    p.add_argument("--constrained", action="store_true", help="Force answers into the candidate list")
+    p.add_argument("--early-stop", action="store_true", help="Stop reading replies once they name a canonical entry")
+    p.add_argument("--workers", type=int, default=None, help="Records in flight per run (default as test_models.py)")
+    p.add_argument("--hosts", default=os.environ.get("OLLAMA_HOSTS"),
+                   help="Comma-separated Ollama hosts to balance across (default $OLLAMA_HOSTS)")
+    p.add_argument("--per-host-concurrency", type=int, default=None,
+                   help="Max in-flight requests per host (default OLLAMA_NUM_PARALLEL or 4)")
+    p.add_argument("--keep-alive", default=os.environ.get("ONCOTREE_KEEP_ALIVE", "30m"),
+                   help="How long Ollama keeps each model loaded after its run")
+    p.add_argument("--no-warmup", action="store_true", help="Count model load time in each run's numbers")
+    p.add_argument("--cache", default=None, help="SQLite prediction cache path (reuses earlier predictions)")
+    args = p.parse_args()
+
+    labels_path = args.labels
+    if labels_path is None:
+        base = args.input if os.path.isdir(args.input) else os.path.dirname(args.input)
+        labels_path = os.path.join(base, "labels.jsonl")
+    try:
+        labels = load_labels(labels_path)
+        records = list(record_sources.iter_records(args.input, args.ext))
+    except (OSError, ValueError) as e:
+        print(e)
+        return
+    if not records:
+        print("No records found in", args.input)
+        return
+
+    hosts = tools.parse_hosts(args.hosts)
+    client = test_models.make_client(hosts, args.per_host_concurrency)
+    if args.models == "all":
+        models = tools.discover_local_ollama_models(client)
+    else:
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+    if not models:
+        print("No models to evaluate (is Ollama running?)")
+        return
+    temperatures = [float(t) for t in args.temperatures.split(",") if t.strip()]
+    if args.workers:
+        workers = args.workers
+    elif isinstance(client, tools.OllamaPool):
+        workers = client.max_per_host * len(client.stats())
+    else:
+        workers = test_models.default_workers(max(1, len(hosts)))
+
+    keep_alive = args.keep_alive
+    if keep_alive and keep_alive.lstrip("-").isdigit():
+        keep_alive = int(keep_alive)
+    cache = tools.PredictionCache(args.cache) if args.cache else None
+    settings = {
+        "cache": cache,
+        "top_k": args.prerank_top_k,
+        "fast_path": args.fast_path,
+        "mode": args.mode,
+        "compaction": True if args.compact else None,
+        "constrained": args.constrained,
+        "client": client,
+        "keep_alive": keep_alive,
+        "early_stop": args.early_stop,
+    }
+    tools.load_reference(args.tissue_list, args.oncotree_base)
+    print(f"Evaluating {len(models)} model(s) x {len(temperatures)} temperature(s) on {len(records)} records "
+          f"({len(labels)} labels), {workers} worker(s)")
+
+    rows = []
+    try:
+        for model in models:
+            if not args.no_warmup:
+                try:
+                    tools.warm_up_model(model, keep_alive=keep_alive, client=client)
+                except Exception as e:
+                    print(f"Warm-up of {model} failed:", e)
+            for temperature in temperatures:
+                row = run_sweep_entry(records, labels, model, temperature, args, settings, workers)
+                rows.append(row)
+                print(f"{model} @ {temperature}: code {format_cell(row['code_acc'])}, "
+                      f"{row['records_per_sec']:.2f} rec/s, p95 {row['p95_seconds']:.2f}s")
+    finally:
+        if cache is not None:
+            cache.close()
+
+    rows.sort(key=lambda r: (-(r["code_acc"] or 0), -r["records_per_sec"]))
+    print_table(rows)
+    best = pick_model(rows, args.min_accuracy)
+    if best is None:
+        print(f"No model reached code accuracy {args.min_accuracy:.2f}")
+    else:
+        print(f"Fastest model with code accuracy >= {args.min_accuracy:.2f}: {best['model']} "
+              f"@ temperature {best['temperature']} ({best['records_per_sec']:.2f} rec/s, "
+              f"code accuracy {best['code_acc']:.3f})")
+    if args.output:
+        write_table(rows, args.output)
+        print("Wrote:", args.output)
+
+
+if __name__ == "__main__":
+    main()
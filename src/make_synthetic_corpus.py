@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic tumor-JSON corpus for benchmarks, with gold labels.
+
+Each record draws a (tissue, OncoTree name, code) from the reference data and wraps
+it in report-like fields: free-text diagnosis, sample site, IDs, nulls, empty lists
+and padding notes, so prompt sizes resemble real exports. Writes one .json file per
+record plus labels.jsonl with the expected answers, or (--jsonl) a single JSONL
+export with one record per line, like the upstream bulk exports.
+
+Usage:
+    python make_synthetic_corpus.py --out-dir ../bench/corpus --count 500 --seed 7
+    python make_synthetic_corpus.py --out-dir ../bench --count 100000 --jsonl
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+import oncotree_utils as tools
+
+SITES = ["Left breast", "Right lung, upper lobe", "Liver", "Lymph node, axillary", "Bone marrow",
+         "Colon, sigmoid", "Brain, frontal lobe", "Skin, back", "Kidney", "Soft tissue, thigh"]
+
+PHRASES = [
+    "{name}",
+    "Consistent with {name}.",
+    "Findings most compatible with {name}; see comment.",
+    "Final diagnosis: {name_lower}",
+    "Morphology and IHC support a diagnosis of {name}.",
+]
+
+
+def make_record(index, tissue, name, code, rng, notes_chars):
+    """
+    One synthetic report; the diagnosis is phrased so the exact name isn't always present.
+    """
+    phrase = rng.choice(PHRASES)
+    return {
+        "test_order_id": f"SYN{index:07d}",
+        "patient_id": f"P{rng.randrange(10**6):06d}",
+        "accession_number": f"S{rng.randrange(10**8):08d}",
+        "sample_site": rng.choice(SITES),
+        "pathology_report": {
+            "clinical_history": "Mass identified on imaging." if rng.random() < 0.7 else None,
+            "final_diagnosis_text": phrase.format(name=name, name_lower=name.lower()),
+            "comment": "" if rng.random() < 0.5 else "Clinical correlation recommended.",
+        },
+        "icd10": None,
+        "biomarkers": [] if rng.random() < 0.5 else [{"gene": "TP53", "result": "positive"}],
+        "notes": ("Lorem ipsum dolor sit amet. " * (notes_chars // 28 + 1))[:notes_chars],
+    }
+
+
+def write_corpus(out_dir, count, seed = 0, notes_chars = 400,
+                 tissue_list = "../data/tissue_types.txt", oncotree_base = "../data/oncotree_tissues",
+                 jsonl = False):
+    """
+    Write `count` synthetic records as <test_order_id>.json plus labels.jsonl into out_dir.
+    Returns the list of record paths. With jsonl=True the records go to a single
+    out_dir/corpus.jsonl instead (one compact record per line) and [that path] is returned.
+    """
+    rng = random.Random(seed)
+    reference = tools.load_reference(tissue_list, oncotree_base)
+    entries = [(t, n, c) for t in reference.tissues for n, c in reference.name_to_code(t).items()]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    export = (out_dir / "corpus.jsonl").open("w", encoding="utf-8") if jsonl else None
+    with (out_dir / "labels.jsonl").open("w", encoding="utf-8") as labels:
+        for i in range(count):
+            tissue, name, code = rng.choice(entries)
+            record = make_record(i, tissue, name, code, rng, notes_chars)
+            if export is not None:
+                export.write(json.dumps(record) + "\n")
+            else:
+                path = out_dir / f"{record['test_order_id']}.json"
+                with path.open("w", encoding="utf-8") as f:
+                    json.dump(record, f, indent=2)
+                paths.append(path)
+            labels.write(json.dumps({
+                "test_order_id": record["test_order_id"],
+                "oncotree_tissue": tissue,
+                "oncotree_name": name,
+                "oncotree_code": code,
+            }) + "\n")
+    if export is not None:
+        export.close()
+        paths.append(out_dir / "corpus.jsonl")
+    return paths
+
+
+def main():
+    p = argparse.ArgumentParser(description="Generate a synthetic tumor JSON corpus with labels")
+    p.add_argument("--out-dir", required=True, help="Output directory")
+    p.add_argument("--count", type=int, default=200, help="Number of records")
+    p.add_argument("--seed", type=int, default=0, help="Random seed")
+    p.add_argument("--notes-chars", type=int, default=400, help="Length of the padding free-text field")
+    p.add_argument("--tissue-list", default="../data/tissue_types.txt", help="Path to tissue_types.txt")
+    p.add_argument("--oncotree-base", default="../data/oncotree_tissues", help="Base dir for oncotree mappings")
+    p.add_argument("--jsonl", action="store_true", help="Write one corpus.jsonl export instead of one file per record")
+    args = p.parse_args()
+
+    write_corpus(args.out_dir, args.count, args.seed, args.notes_chars, args.tissue_list, args.oncotree_base,
+                 jsonl=args.jsonl)
+    print(f"Wrote {args.count} synthetic records to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
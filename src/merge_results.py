@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Combine the outputs of sharded test_models.py runs (--shard i/N) into one JSONL
+sorted by test_order_id, dropping duplicates, and report records that are missing
+or failed.
+
+Duplicates (e.g. a shard that was re-run) are resolved per test_order_id: a
+successful prediction beats a failed one, otherwise the later row wins (outputs
+are read in the order given). A row counts as failed when its entry in the
+output's .manifest sidecar says so; rows no manifest covers are judged by their
+fields (empty, or "none" everywhere). With --input, the record names in the shards'
+.manifest sidecars are checked against the original source to list records that
+no shard completed.
+
+Usage:
+    python merge_results.py out/shard-*.jsonl --output out/all.jsonl --input ../data/export.jsonl
+"""
+import argparse
+import glob
+import json
+import os
+import record_sources
+
+
+ERROR_FIELDS = ("oncotree_tissue", "oncotree_name", "oncotree_code")
+
+
+def is_error_row(row):
+    # test_models.py writes empty fields when a record raised, and "none" everywhere when
+    # the LLM call failed inside prediction; only the manifest tells the latter from an "Unknown"
+    values = [row.get(k) for k in ERROR_FIELDS]
+    return values[0] == "" or all(v == "none" for v in values)
+
+
+def read_manifest_statuses(path):
+    """
+    Statuses from an output's .manifest sidecar, in row order (entry i belongs to row i),
+    or None when the output has no manifest.
+    """
+    manifest = path + ".manifest"
+    if not os.path.exists(manifest):
+        return None
+    statuses = []
+    with open(manifest, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                statuses.append(json.loads(line).get("status"))
+            except ValueError:
+                break  # torn last entry from a crash
+    return statuses
+
+
+def merge_rows(paths):
+    """
+    Return (rows sorted by test_order_id, stats). Rows without a test_order_id can't be
+    deduplicated; they are kept and sorted last.
+    """
+    by_id = {}  # test_order_id -> (row, failed)
+    no_id = []
+    stats = {"rows": 0, "duplicates": 0, "unparseable": 0, "errors": 0}
+    for path in paths:
+        statuses = read_manifest_statuses(path)
+        position = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    stats["unparseable"] += 1  # torn last line from a crash
+                    continue
+                stats["rows"] += 1
+                if statuses is not None and position < len(statuses):
+                    failed = statuses[position] != "ok"
+                else:
+                    failed = is_error_row(row)
+                position += 1
+                key = row.get("test_order_id")
+                if key is None:
+                    no_id.append(row)
+                    stats["errors"] += failed
+                    continue
+                previous = by_id.get(key)
+                if previous is not None:
+                    stats["duplicates"] += 1
+                    if failed and not previous[1]:
+                        continue
+                by_id[key] = (row, failed)
+    rows = [by_id[k][0] for k in sorted(by_id, key=str)]
+    rows.extend(sorted(no_id, key=lambda r: json.dumps(r, sort_keys=True)))
+    stats["no_id"] = len(no_id)
+    stats["errors"] += sum(failed for _, failed in by_id.values())
+    return rows, stats
+
+
+def manifest_status(paths):
+    """
+    {record name: status} from the .manifest sidecars of the given outputs ("ok" wins).
+    """
+    status = {}
+    for path in paths:
+        manifest = path + ".manifest"
+        if not os.path.exists(manifest):
+            continue
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if status.get(entry.get("file")) != "ok":
+                    status[entry.get("file")] = entry.get("status")
+    return status
+
+
+def list_record_names(source, ext):
+    """
+    Names of every record in a source without reading the records themselves
+    (JSONL lines still have to be scanned to count them).
+    """
+    names = []
+
+    def collect(name):
+        names.append(name)
+        return False  # skip: names only
+
+    for _ in record_sources.iter_records(source, ext, keep=collect):
+        pass
+    return names
+
+
+def write_jsonl(path, rows):
+    """
+    Write rows to a temp file next to `path`, then rename, so a crash never leaves half a file.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    os.replace(tmp, path)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Merge and dedupe sharded test_models.py outputs")
+    p.add_argument("outputs", nargs="+", help="Shard output JSONL files (globs are expanded)")
+    p.add_argument("--output", required=True, help="Merged JSONL file")
+    p.add_argument("--input", default=None,
+                   help="Original input given to the shards; records no shard completed are reported")
+    p.add_argument("--ext", default=".json", help="File extension used for directory / archive inputs")
+    p.add_argument("--missing-out", default=None, help="Also write the missing record names to this file")
+    args = p.parse_args()
+
+    paths = []
+    for pattern in args.outputs:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(m for m in matches if m != args.output and not m.endswith((".manifest", ".tmp")))
+    missing_files = [path for path in paths if not os.path.exists(path)]
+    if missing_files:
+        print("Output not found:", ", ".join(missing_files))
+        return
+
+    rows, stats = merge_rows(paths)
+    write_jsonl(args.output, rows)
+    print(f"Merged {stats['rows']} rows from {len(paths)} file(s) into {len(rows)} records: {args.output}")
+    print(f"Dropped {stats['duplicates']} duplicate(s); {stats['errors']} error row(s); "
+          f"{stats['no_id']} row(s) without test_order_id; {stats['unparseable']} unparseable line(s)")
+
+    if args.input:
+        status = manifest_status(paths)
+        names = list_record_names(args.input, args.ext)
+        missing = [n for n in names if n not in status]
+        failed = [n for n in names if status.get(n) not in (None, "ok")]
+        print(f"Input has {len(names)} records: {len(names) - len(missing) - len(failed)} ok, "
+              f"{len(failed)} failed, {len(missing)} missing")
+        for label, group in (("Missing", missing), ("Failed", failed)):
+            if group:
+                print(f"{label}: " + ", ".join(group[:20]) + (f" ... (+{len(group) - 20} more)" if len(group) > 20 else ""))
+        if args.missing_out:
+            with open(args.missing_out, "w", encoding="utf-8") as f:
+                for name in missing + failed:
+                    f.write(name + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,14 @@
+import difflib
+import hashlib
 import json
+import math
 import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import MappingProxyType
 from urllib import response
 import ollama
 
@@ -58,7 +67,139 @@ def load_oncotree_name_to_code(tissue_name, data_base_path):
         return json.load(f)
 
 
+# ---------- In-memory reference data ----------
+class OncoTreeReference:
+    """
+    Immutable, in-memory view of all OncoTree reference data: the tissue list plus every
+    tissue's names list and name -> code map. Lookups are dict-based (O(1)):
+      names(tissue)         -> tuple of names, in names-file order
+      name_to_code(tissue)  -> read-only {name: code}
+      code(tissue, name)    -> code or None
+      tissues_for(name)     -> tuple of tissues containing that name
+    Build it with load_reference() rather than directly.
+    """
+
+    __slots__ = ("tissues", "_names", "_maps", "_tissues_by_name")
+
+    def __init__(self, tissues, names_by_tissue, maps_by_tissue):
+        tissues_by_name = {}
+        for tissue in tissues:
+            for name in maps_by_tissue[tissue]:
+                tissues_by_name.setdefault(name, []).append(tissue)
+        object.__setattr__(self, "tissues", tuple(tissues))
+        object.__setattr__(self, "_names", MappingProxyType({t: tuple(names_by_tissue[t]) for t in tissues}))
+        object.__setattr__(self, "_maps", MappingProxyType({t: MappingProxyType(dict(maps_by_tissue[t])) for t in tissues}))
+        object.__setattr__(self, "_tissues_by_name", MappingProxyType({n: tuple(ts) for n, ts in tissues_by_name.items()}))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("OncoTreeReference is immutable")
+
+    def names(self, tissue_name):
+        try:
+            return self._names[tissue_name.strip()]
+        except KeyError:
+            raise KeyError(f"Unknown tissue: {tissue_name}") from None
+
+    def name_to_code(self, tissue_name):
+        try:
+            return self._maps[tissue_name.strip()]
+        except KeyError:
+            raise KeyError(f"Unknown tissue: {tissue_name}") from None
+
+    def code(self, tissue_name, oncotree_name):
+        mapping = self._maps.get(tissue_name.strip())
+        return mapping.get(oncotree_name) if mapping is not None else None
+
+    def tissues_for(self, oncotree_name):
+        return self._tissues_by_name.get(oncotree_name, ())
+
+    def to_dict(self):
+        return {
+            "tissues": list(self.tissues),
+            "names": {t: list(self._names[t]) for t in self.tissues},
+            "maps": {t: dict(self._maps[t]) for t in self.tissues},
+        }
+
+
+_reference_lock = threading.Lock()
+_references = {}
+
+
+COMPILED_REFERENCE_NAME = "oncotree_reference.json"
+
+
+def _read_compiled_reference(compiled_path, tissue_list_path, data_base_path):
+    """
+    The compiled file's data if it is at least as new as every source file it covers and
+    was built from the same tissue list, else None.
+    """
+    if not os.path.exists(compiled_path):
+        return None
+    built = os.path.getmtime(compiled_path)
+    tissues = parse_tissue_list(tissue_list_path)
+    sources = [tissue_list_path]
+    for tissue in tissues:
+        sources.append(os.path.join(data_base_path, f"{tissue}_oncotree_names.txt"))
+        sources.append(os.path.join(data_base_path, f"{tissue}_oncotree_map.json"))
+    if not all(os.path.exists(p) and os.path.getmtime(p) <= built for p in sources):
+        return None
+    try:
+        with open(compiled_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # a newer file can still come from another tissue list sharing this data directory
+    return data if data.get("tissues") == tissues else None
+
+
+def _compiled_reference_is_fresh(compiled_path, tissue_list_path, data_base_path):
+    return _read_compiled_reference(compiled_path, tissue_list_path, data_base_path) is not None
+
+
+def load_reference(tissue_list_path = "../data/tissue_types.txt",
+                   data_base_path = "../data/oncotree_tissues",
+                   compiled_path = None):
+    """
+    Load tissue_types.txt and every tissue's names list and map once per process and
+    return the shared OncoTreeReference. A compiled file written by save_reference()
+    (default: <data_base_path>/oncotree_reference.json) is read instead of the 60+
+    individual files when it is up to date and was built from the same tissue list.
+    """
+    key = (os.path.abspath(tissue_list_path), os.path.abspath(data_base_path))
+    with _reference_lock:
+        reference = _references.get(key)
+        if reference is not None:
+            return reference
+        if compiled_path is None:
+            compiled_path = os.path.join(data_base_path, COMPILED_REFERENCE_NAME)
+        data = _read_compiled_reference(compiled_path, tissue_list_path, data_base_path)
+        if data is not None:
+            reference = OncoTreeReference(data["tissues"], data["names"], data["maps"])
+        else:
+            tissues = parse_tissue_list(tissue_list_path)
+            names = {t: parse_oncotree_list(t, base_path=data_base_path) for t in tissues}
+            maps = {t: load_oncotree_name_to_code(tissue_name=t, data_base_path=data_base_path) for t in tissues}
+            reference = OncoTreeReference(tissues, names, maps)
+        _references[key] = reference
+        return reference
+
+
+def save_reference(reference, path):
+    """
+    Write the reference as one compact JSON file for fast startup (see load_reference).
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(reference.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
 # ---------- Prompt builders ----------
+# Part of every cache key (make_cache_key): bump it whenever a create_user_prompt_* layout
+# changes, so cached answers produced with the old layout stop being served.
+# 2: names prompt lists the candidates before the tumor JSON
+USER_PROMPT_VERSION = 2
+
 def create_system_prompt_for_names() -> str:
     return (
         """
@@ -85,11 +226,13 @@ High-Grade B-Cell Lymphoma, with MYC and BCL2 and/or BCL6 Rearrangements
     )
 
 def create_user_prompt_for_names(tumor_json, oncotree_names_list):
+    # the per-tissue name list goes first and the per-record JSON last, so consecutive
+    # records share the longest possible prompt prefix (Ollama reuses its cached prefix)
     return (
-        "Tumor Sample JSON:\n"
-        f"{tumor_json}\n\n"
         "Oncotree Names:\n"
-        f"{'$'.join(oncotree_names_list)}"
+        f"{'$'.join(oncotree_names_list)}\n\n"
+        "Tumor Sample JSON:\n"
+        f"{tumor_json}"
     )
 
 def create_system_prompt_for_tissues(tissues):
@@ -110,6 +253,33 @@ LIST OF TISSUES:
         {tissues}
         """)
 
+JOINT_SEPARATOR = " :: "
+
+
+def create_system_prompt_for_joint(candidates):
+    return (
+        f"""
+You are an expert pathologist familiar with the OncoTree classification system.
+
+I will give you a JSON object containing information from a sample pathology report.
+Your task is to pick the single entry from the list below that best matches the sample.
+Each entry has the form "<Tissue>{JOINT_SEPARATOR}<OncoTree name>" and entries are delimited by the "$" character.
+
+RULES:
+- If the path report indicates a tumor type or ICD/ICD-O codes indicate a primary tumor tissue, choose an entry in that primary tissue. Use sample_site only **only** if no other tissue is indicated.
+- You must output the FULL entry exactly as it appears in the list, including the tissue and the "{JOINT_SEPARATOR.strip()}".
+- Do not modify, shorten, or paraphrase the entry.
+- Output ONLY the selected entry.
+- Do **not** include explanations, reasoning, formatting, or additional text.
+- If no appropriate match exists, output: Unknown.
+
+EXAMPLE OF VALID OUTPUT:
+Lymphoid{JOINT_SEPARATOR}Chronic Lymphocytic Leukemia/Small Lymphocytic Lymphoma
+
+LIST OF ENTRIES:
+{'$'.join(candidates)}
+        """)
+
 # ---------Clean up LLM output ----------
 def clean_response(text):
     """
@@ -152,13 +322,13 @@ def clean_response(text):
 
 
 ### DIscover local models for UI
-def discover_local_ollama_models():
+def discover_local_ollama_models(client=None):
     """
-    Return a sorted list of model identifiers from ollama.list(),
-    e.g. ['gemma3:4b', 'gemma3:1b', 'granite4:latest', ...]
+    Return a sorted list of model identifiers from ollama.list() (or `client.list()`,
+    e.g. an OllamaPool), e.g. ['gemma3:4b', 'gemma3:1b', 'granite4:latest', ...]
     """
     try:
-        models = ollama.list()["models"]  # returns a list of Model(...) objects
+        models = (client or ollama).list()["models"]  # returns a list of Model(...) objects
     except Exception as e:
         # Ollama client not available / Ollama not running
         # Return empty list so UI can show an error and avoid crash
@@ -182,23 +352,178 @@ def discover_local_ollama_models():
 
 
 # ---------- LLM wrapper ----------
-def generate_response(model,temperature,system_prompt,user_prompt):
+OLLAMA_METRIC_FIELDS = ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration", "load_duration", "total_duration")
+
+
+def response_metrics(response):
+    """
+    Pull Ollama's token counts and durations (nanoseconds) out of a chat response.
+    Missing fields are left out.
+    """
+    metrics = {}
+    for field in OLLAMA_METRIC_FIELDS:
+        try:
+            value = response[field]
+        except (KeyError, TypeError):
+            value = None
+        if value is not None:
+            metrics[field] = value
+    return metrics
+
+
+def logprob_margin(logprobs):
+    """
+    Smallest gap (in nats) over the generated tokens between the chosen token's
+    log-probability and the best alternative's, from a response's `logprobs`
+    (requested with top_logprobs >= 2). A small margin means the model nearly said
+    something else. None when the server returned no logprobs.
+    """
+    margins = []
+    for entry in logprobs or ():
+        alternatives = [t["logprob"] for t in entry.get("top_logprobs") or () if t["token"] != entry["token"]]
+        if alternatives:
+            margins.append(entry["logprob"] - max(alternatives))
+    return min(margins) if margins else None
+
+
+def answer_schema(candidates):
+    """
+    JSON schema for constrained output: {"answer": <one of the candidates or "Unknown">}.
+    """
+    choices = list(dict.fromkeys(list(candidates) + ["Unknown"]))
+    return {
+        "type": "object",
+        "properties": {"answer": {"type": "string", "enum": choices}},
+        "required": ["answer"],
+    }
+
+
+def constrained_num_predict(candidates):
+    """
+    Generation cap for answer_schema() output: enough tokens for the longest candidate
+    wrapped in {"answer": "..."} (assuming >= 2 characters per token), plus slack.
+    """
+    longest = max((len(json.dumps(c, ensure_ascii=False)) for c in candidates), default=8)
+    return longest // 2 + 16
+
+
+def parse_constrained_answer(text):
+    """
+    Unwrap {"answer": "..."}; returns the text unchanged if it isn't that shape.
+    """
+    try:
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        return text
+    if isinstance(parsed, dict) and isinstance(parsed.get("answer"), str):
+        return parsed["answer"].strip()
+    return text
+
+
+class GenerationCancelled(Exception):
+    """
+    Raised by generate_response() when its `cancel` event is set mid-generation.
+    """
+
+
+def collect_stream(chunks, cancel=None, stop=None, on_text=None):
+    """
+    Join a streamed chat response into {"message": {"content": ...}, <final metrics>}.
+    If `cancel` (a threading.Event) gets set, the stream is closed, which makes Ollama
+    stop generating, and GenerationCancelled is raised.
+    `stop(text)` is called with the text so far after every chunk; once it returns an
+    answer the stream is closed early and response["early_stop"] holds that answer.
+    `on_text(text)` gets the growing text as it arrives (e.g. to render it live).
+    """
+    content = []
+    logprobs = []
+    final = None
+    early = None
+    try:
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                raise GenerationCancelled("generation cancelled")
+            content.append(chunk["message"]["content"] or "")
+            logprobs.extend(chunk.get("logprobs") or ())
+            if chunk.get("done"):
+                final = chunk
+            if stop is not None or on_text is not None:
+                text = "".join(content)
+                if on_text is not None:
+                    on_text(text)
+                early = stop(text) if stop is not None and final is None else None
+                if early is not None:
+                    break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    response = response_metrics(final) if final is not None else {}
+    response["message"] = {"content": "".join(content)}
+    response["logprobs"] = logprobs
+    if early is not None:
+        response["early_stop"] = early
+        response.setdefault("eval_count", len(content))  # one chunk per token; no final stats when cut short
+    return response
+
+
+def generate_response(model,temperature,system_prompt,user_prompt,metrics=None,format=None,num_predict=None,client=None,
+                      keep_alive=None,cancel=None,logprobs=False,stop_candidates=None,on_text=None):
     """
     Call ollama.chat and return the assistant content string.
     Raises RuntimeError if the response doesn't contain expected structure.
+    If a `metrics` dict is given it is filled with the wall time of the call and
+    Ollama's token counts/durations (see OLLAMA_METRIC_FIELDS).
+    `format` is passed to Ollama as a structured-output JSON schema (see answer_schema;
+    the "answer" field is unwrapped) and `num_predict` caps generated tokens.
+    `client` (an ollama.Client or OllamaPool) replaces the module-level default host.
+    `keep_alive` (e.g. "30m", -1 for forever) keeps the model loaded after the call.
+    With a `cancel` threading.Event the response is streamed so the call can be abandoned
+    part-way (raises GenerationCancelled; see collect_stream).
+    logprobs=True asks for token log-probabilities and records metrics["logprob_margin"].
+    With `stop_candidates` the reply is streamed and closed as soon as it has completely
+    and unambiguously named one of them (see match_streamed_answer), which is returned;
+    metrics["early_stop"] is then True. `on_text(text)` receives the partial reply live.
     """
     options = {"temperature": float(temperature)}
+    if num_predict:
+        options["num_predict"] = int(num_predict)
+    if cancel is not None and cancel.is_set():
+        raise GenerationCancelled("generation cancelled")
+    extra = {"logprobs": True, "top_logprobs": 2} if logprobs else {}
+    started = time.perf_counter()
     # Ollama client usage assumed available in environment
-    response = ollama.chat(
+    streamed = cancel is not None or stop_candidates is not None or on_text is not None
+    response = (client or ollama).chat(
         model=model,
-        stream=False,
+        stream=streamed,
         options=options,
+        format=format,
         think=False,
+        keep_alive=keep_alive,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
+        **extra,
     )
+    if streamed:
+        stop = None
+        if stop_candidates is not None:
+            trie = build_candidate_trie(stop_candidates)
+            stop = lambda text: match_streamed_answer(text, trie)
+        response = collect_stream(response, cancel, stop, on_text)
+    if metrics is not None:
+        metrics["wall_seconds"] = time.perf_counter() - started
+        metrics.update(response_metrics(response))
+        if getattr(client, "last_host", None):
+            metrics["host"] = client.last_host
+        if logprobs:
+            metrics["logprob_margin"] = logprob_margin(response.get("logprobs"))
+        if stop_candidates is not None:
+            metrics["early_stop"] = "early_stop" in response
+    if stop_candidates is not None and "early_stop" in response:
+        return response["early_stop"]
     # Expected structure: {'message': {'content': '...'}}
     try:
         raw=response['message']['content']
@@ -206,36 +531,1529 @@ def generate_response(model,temperature,system_prompt,user_prompt):
         raise RuntimeError(f"Unexpected response structure: {response}")
     
     # Clean raw output
+    if format is not None:
+        return clean_response(parse_constrained_answer(raw))
     return clean_response(raw)
 
 
+# ---------- Streamed early termination ----------
+_TRIE_END = "\0"
+_trie_lock = threading.Lock()
+_tries = {}
+
+# what models put before the answer itself: whitespace, quotes / markdown, a JSON {"answer": wrapper
+_ANSWER_LEAD = re.compile(r'\s*(?:\{\s*"answer"\s*:\s*)?["\'`*\s]*')
+
+
+def build_candidate_trie(candidates):
+    """
+    Character trie (lower-cased) of the candidates plus "Unknown"; the key _TRIE_END marks
+    the end of a canonical entry and holds it. Cached per candidate list.
+    """
+    key = tuple(candidates)
+    with _trie_lock:
+        trie = _tries.get(key)
+        if trie is None:
+            trie = {}
+            for candidate in key + ("Unknown",):
+                node = trie
+                for ch in candidate.lower():
+                    node = node.setdefault(ch, {})
+                node.setdefault(_TRIE_END, candidate)
+            _tries[key] = trie
+        return trie
+
+
+def match_streamed_answer(text, trie):
+    """
+    The canonical entry a partial model reply has finished naming, or None to keep reading.
+    The reply (after any leading quotes / JSON wrapper) is walked through the trie; it is
+    finished when it ends exactly on an entry that no longer entry extends, or when an
+    entry is followed by a character that can't continue any entry (newline, period,
+    closing quote, ...). Only the first len(longest entry) characters are ever looked at.
+    """
+    node = trie
+    for ch in text[_ANSWER_LEAD.match(text).end():].lower():
+        next_node = node.get(ch)
+        if next_node is None:
+            return node.get(_TRIE_END)
+        node = next_node
+    if len(node) == 1 and _TRIE_END in node:
+        return node[_TRIE_END]
+    return None
+
+
+# ---------- Model warm-up ----------
+COLD_LOAD_SECONDS = 0.25   # a call whose load_duration exceeds this paid a model load
+
+
+def warm_up_model(model, keep_alive=None, client=None):
+    """
+    Load `model` into memory ahead of the first prediction (an empty generate request,
+    which only loads the model) and keep it loaded for `keep_alive`. With an OllamaPool
+    every healthy host is warmed. Returns {"wall_seconds", "load_seconds", "hosts"}.
+    """
+    started = time.perf_counter()
+    if isinstance(client, OllamaPool):
+        targets = [h["client"] for h in client.health_check()]
+    else:
+        targets = [client or ollama]
+    load_seconds = 0.0
+    for target in targets:
+        response = target.generate(model=model, prompt="", keep_alive=keep_alive)
+        load_seconds = max(load_seconds, (response_metrics(response).get("load_duration") or 0) / 1e9)
+    return {"wall_seconds": time.perf_counter() - started, "load_seconds": load_seconds, "hosts": len(targets)}
+
+
+def summarize_warm_cold(metrics_list):
+    """
+    Split generate_response() metrics into cold calls (paid a model load, see
+    COLD_LOAD_SECONDS) and warm calls, with the count and p50 wall time of each.
+    """
+    calls = [m for m in metrics_list if m and not m.get("cached") and "wall_seconds" in m]
+    cold = [m["wall_seconds"] for m in calls if (m.get("load_duration") or 0) / 1e9 > COLD_LOAD_SECONDS]
+    warm = [m["wall_seconds"] for m in calls if (m.get("load_duration") or 0) / 1e9 <= COLD_LOAD_SECONDS]
+    return {
+        "cold_calls": len(cold),
+        "cold_p50_seconds": percentile(cold, 50),
+        "warm_calls": len(warm),
+        "warm_p50_seconds": percentile(warm, 50),
+    }
+
+
+# ---------- Ollama host pool ----------
+def parse_hosts(text):
+    """
+    Split a comma/whitespace-separated host list (e.g. $OLLAMA_HOSTS) into a list.
+    """
+    return [h for h in re.split(r"[,\s]+", text or "") if h]
+
+
+def is_host_failure(exc):
+    """
+    True for errors that mean the host is down or broken (connection errors, timeouts,
+    5xx), False for request errors every host would repeat (4xx such as an unknown model).
+    """
+    if isinstance(exc, ollama.ResponseError):
+        return not 400 <= exc.status_code < 500
+    return not isinstance(exc, ollama.RequestError)
+
+
+class OllamaPool:
+    """
+    Several Ollama endpoints behind the same chat()/generate()/list()/ps() calls as
+    ollama.Client, so it can be passed anywhere a `client` is accepted.
+
+    One ollama.Client per host keeps HTTP connections alive. Each request goes to the
+    healthy host with the fewest outstanding requests, at most max_per_host at a time
+    per host (callers wait when every host is full). A request that fails because of its
+    host (see is_host_failure) marks the host unhealthy and is retried on another host;
+    4xx errors are raised straight away. Unhealthy hosts get traffic again after
+    health_interval seconds or after a successful health_check().
+    """
+
+    def __init__(self, hosts, max_per_host = 4, health_interval = 30.0, timeout = None):
+        if not hosts:
+            raise ValueError("OllamaPool needs at least one host")
+        self.max_per_host = max_per_host
+        self.health_interval = health_interval
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._hosts = [
+            {"host": h, "client": ollama.Client(host=h, timeout=timeout), "outstanding": 0,
+             "healthy": True, "checked_at": 0.0, "requests": 0, "failures": 0}
+            for h in hosts
+        ]
+
+    def _acquire(self, tried):
+        with self._cond:
+            while True:
+                now = time.time()
+                for h in self._hosts:
+                    if not h["healthy"] and now - h["checked_at"] >= self.health_interval:
+                        h["healthy"] = True  # the next real request is the probe
+                usable = [h for h in self._hosts if h["healthy"] and h["host"] not in tried]
+                if not usable:
+                    return None
+                free = [h for h in usable if h["outstanding"] < self.max_per_host]
+                if free:
+                    best = min(free, key=lambda h: (h["outstanding"], h["requests"]))
+                    best["outstanding"] += 1
+                    best["requests"] += 1
+                    return best
+                self._cond.wait(timeout=1.0)
+
+    def _release(self, entry, ok):
+        with self._cond:
+            entry["outstanding"] -= 1
+            if not ok:
+                entry["failures"] += 1
+                entry["healthy"] = False
+                entry["checked_at"] = time.time()
+            self._cond.notify_all()
+
+    def _call(self, method, *args, **kwargs):
+        tried = set()
+        last_error = None
+        while True:
+            entry = self._acquire(tried)
+            if entry is None:
+                raise last_error or ConnectionError("No healthy Ollama host available")
+            tried.add(entry["host"])
+            try:
+                result = getattr(entry["client"], method)(*args, **kwargs)
+            except Exception as e:
+                self._release(entry, ok=not is_host_failure(e))
+                if not is_host_failure(e):
+                    raise
+                last_error = e
+                continue
+            self._release(entry, ok=True)
+            self._local.host = entry["host"]
+            return result
+
+    @property
+    def last_host(self):
+        """
+        Host that served this thread's most recent successful request.
+        """
+        return getattr(self._local, "host", None)
+
+    def _stream(self, method, *args, **kwargs):
+        # streamed calls hold their host slot until the stream is consumed or closed;
+        # failover only happens before the first chunk arrives
+        tried = set()
+        last_error = None
+        while True:
+            entry = self._acquire(tried)
+            if entry is None:
+                raise last_error or ConnectionError("No healthy Ollama host available")
+            tried.add(entry["host"])
+            started = False
+            ok = True
+            try:
+                for chunk in getattr(entry["client"], method)(*args, **kwargs):
+                    started = True
+                    yield chunk
+                self._local.host = entry["host"]
+                return
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                ok = not is_host_failure(e)
+                if started or ok:
+                    raise
+                last_error = e
+            finally:
+                self._release(entry, ok=ok)
+
+    def chat(self, *args, **kwargs):
+        if kwargs.get("stream"):
+            return self._stream("chat", *args, **kwargs)
+        return self._call("chat", *args, **kwargs)
+
+    def generate(self, *args, **kwargs):
+        return self._call("generate", *args, **kwargs)
+
+    def embed(self, *args, **kwargs):
+        return self._call("embed", *args, **kwargs)
+
+    def list(self):
+        """
+        Models available on the healthy hosts (merged by name).
+        """
+        merged = {}
+        for h in self.health_check():
+            for m in h["client"].list()["models"]:
+                merged.setdefault(getattr(m, "model", None) or str(m), m)
+        return {"models": list(merged.values())}
+
+    def ps(self):
+        """
+        Loaded models per healthy host: {host: ps() response}.
+        """
+        return {h["host"]: h["client"].ps() for h in self.health_check()}
+
+    def health_check(self):
+        """
+        Probe every host with list(), update the health flags and return the healthy entries.
+        """
+        healthy = []
+        for h in self._hosts:
+            try:
+                h["client"].list()
+                ok = True
+            except Exception:
+                ok = False
+            with self._cond:
+                h["healthy"] = ok
+                h["checked_at"] = time.time()
+                self._cond.notify_all()
+            if ok:
+                healthy.append(h)
+        return healthy
+
+    def stats(self):
+        with self._cond:
+            return [{k: h[k] for k in ("host", "healthy", "outstanding", "requests", "failures")}
+                    for h in self._hosts]
+
+
+# ---------- Prediction cache ----------
+def normalize_tumor_json(tumor_json):
+    """
+    Canonical form of a tumor JSON string for hashing: key order and whitespace
+    don't change the key. Falls back to the stripped raw text if it isn't valid JSON.
+    """
+    try:
+        return json.dumps(json.loads(tumor_json), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except (TypeError, ValueError):
+        return (tumor_json or "").strip()
+
+
+def make_cache_key(tumor_json, model, temperature, system_prompt, candidates, variant=None):
+    """
+    Content hash of everything that determines an LLM answer: the normalized tumor JSON,
+    model, temperature, system prompt and user-prompt layout (USER_PROMPT_VERSION) and
+    candidate list, plus any generation `variant` (e.g. constrained output settings).
+    """
+    fields = {
+        "tumor": normalize_tumor_json(tumor_json),
+        "model": model,
+        "temperature": float(temperature),
+        "prompt": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        "user_prompt_version": USER_PROMPT_VERSION,
+        "candidates": list(candidates),
+    }
+    if variant is not None:
+        fields["variant"] = variant
+    payload = json.dumps(
+        fields,
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """
+    Persistent on-disk (SQLite) cache of model answers keyed by make_cache_key().
+    Entries older than max_age_days are dropped, and the least recently used entries
+    are evicted once the cache holds more than max_entries. Safe to share across threads.
+    """
+
+    def __init__(self, path, max_entries=100_000, max_age_days=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """
+        Return the cached answer for key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE predictions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        if value is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            prune = self._puts % 1000 == 0
+        if prune:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones beyond max_entries.
+        """
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute("DELETE FROM predictions WHERE created_at < ?", (cutoff,))
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM predictions WHERE key NOT IN "
+                    "(SELECT key FROM predictions ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _expired(self, created_at, now):
+        return bool(self.max_age_days) and created_at < now - self.max_age_days * 86400
+
+
+def cached_generate(cache, model, temperature, system_prompt, user_prompt, tumor_json, candidates, metrics=None,
+                    constrained=False, client=None, keep_alive=None, cancel=None, logprobs=False, early_stop=False,
+                    on_text=None):
+    """
+    generate_response() behind the prediction cache (no-op wrapper when cache is None).
+    `metrics` is passed through; on a cache hit it only gets {"cached": True}.
+    With constrained=True the model is restricted to the candidates (plus "Unknown")
+    via a structured-output schema and a tight num_predict cap.
+    With logprobs=True the logprob margin is cached with the answer and restored on a hit.
+    early_stop=True streams the reply and stops it once it names a candidate (see
+    match_streamed_answer); `on_text` gets the partial reply (or a cached answer) live.
+    """
+    generate_options = {"client": client, "keep_alive": keep_alive, "cancel": cancel, "logprobs": logprobs,
+                        "stop_candidates": candidates if early_stop else None, "on_text": on_text}
+    if constrained:
+        generate_options.update(format=answer_schema(candidates), num_predict=constrained_num_predict(candidates))
+    if cache is None:
+        return generate_response(model=model, temperature=temperature, system_prompt=system_prompt,
+                                 user_prompt=user_prompt, metrics=metrics, **generate_options)
+    variant = "+".join(v for v, on in (("constrained", constrained), ("logprobs", logprobs),
+                                       ("early_stop", early_stop)) if on) or None
+    key = make_cache_key(tumor_json, model, temperature, system_prompt, candidates, variant=variant)
+    cached = cache.get(key)
+    if cached is not None:
+        if logprobs:
+            cached = json.loads(cached)
+        if metrics is not None:
+            metrics["cached"] = True
+            if logprobs:
+                metrics["logprob_margin"] = cached["logprob_margin"]
+        answer = cached["answer"] if logprobs else cached
+        if on_text is not None:
+            on_text(answer)
+        return answer
+    if logprobs and metrics is None:
+        metrics = {}
+    answer = generate_response(model=model, temperature=temperature, system_prompt=system_prompt,
+                               user_prompt=user_prompt, metrics=metrics, **generate_options)
+    if logprobs:
+        cache.put(key, json.dumps({"answer": answer, "logprob_margin": metrics.get("logprob_margin")}))
+    else:
+        cache.put(key, answer)
+    return answer
+
+
+# ---------- Tumor JSON compaction ----------
+# Keys that identify the record rather than describe the tumor (matched case-insensitively;
+# any key ending in "_id" or "_uuid" is dropped too).
+DEFAULT_DROP_KEYS = (
+    "id", "uuid", "mrn", "patient_id", "patient_name", "dob", "date_of_birth",
+    "accession", "accession_number", "test_order_id", "order_id", "specimen_id",
+    "created_at", "updated_at", "report_date", "collection_date", "received_date",
+    "physician", "ordering_physician", "provider", "lab_name", "address", "phone",
+)
+
+
+def estimate_tokens(text):
+    """
+    Rough prompt-token estimate (~4 characters per token) for before/after reporting.
+    """
+    return (len(text or "") + 3) // 4
+
+
+def _is_dropped_key(key, drop_keys):
+    k = str(key).lower()
+    return k in drop_keys or k.endswith("_id") or k.endswith("_uuid")
+
+
+def _compact_value(value, drop_keys, max_text_chars):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if _is_dropped_key(k, drop_keys):
+                continue
+            v = _compact_value(v, drop_keys, max_text_chars)
+            if v is not None:
+                out[k] = v
+        return out or None
+    if isinstance(value, list):
+        out = [v for v in (_compact_value(v, drop_keys, max_text_chars) for v in value) if v is not None]
+        return out or None
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        if not value:
+            return None
+        if max_text_chars and len(value) > max_text_chars:
+            value = value[:max_text_chars].rstrip() + "…"
+        return value
+    return value
+
+
+def compact_tumor_json(tumor_json, keep_keys = None, drop_keys = DEFAULT_DROP_KEYS, max_text_chars = 2000):
+    """
+    Shrink a tumor JSON string before it goes into a prompt:
+      - keep only top-level keys in keep_keys (if given),
+      - drop identifier/administrative keys (drop_keys, "*_id", "*_uuid"),
+      - drop null, empty-string, empty-list and empty-object values,
+      - collapse whitespace and truncate free text longer than max_text_chars,
+      - minify.
+    Returns the raw text stripped if it isn't valid JSON.
+    """
+    try:
+        parsed = json.loads(tumor_json)
+    except (TypeError, ValueError):
+        return (tumor_json or "").strip()
+    if keep_keys and isinstance(parsed, dict):
+        wanted = {k.lower() for k in keep_keys}
+        parsed = {k: v for k, v in parsed.items() if str(k).lower() in wanted}
+    drop = {k.lower() for k in (drop_keys or ())}
+    compacted = _compact_value(parsed, drop, max_text_chars)
+    if compacted is None:
+        compacted = {}
+    return json.dumps(compacted, ensure_ascii=False, separators=(",", ":"))
+
+
+def prompt_tumor_json(tumor_json, compaction, details = None):
+    """
+    The tumor JSON text to put in a prompt: compacted when `compaction` is a dict of
+    compact_tumor_json() options (or True for defaults), unchanged when it is None/False.
+    Records estimated tokens before/after in `details`.
+    """
+    if not compaction:
+        return tumor_json
+    options = compaction if isinstance(compaction, dict) else {}
+    compacted = compact_tumor_json(tumor_json, **options)
+    if details is not None:
+        details["json_tokens_before"] = estimate_tokens(tumor_json)
+        details["json_tokens_after"] = estimate_tokens(compacted)
+    return compacted
+
+
+# ---------- Lexical candidate pre-ranking (BM25) ----------
+_STOPWORDS = {"a", "an", "and", "as", "at", "by", "for", "in", "is", "of", "on", "or", "the", "to", "with", "nos", "type"}
+
+
+def tokenize(text):
+    """
+    Lowercase alphanumeric tokens with common stopwords removed.
+    """
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in _STOPWORDS]
+
+
+def tumor_json_text(tumor_json):
+    """
+    Concatenate the string/number values of a tumor JSON (keys and punctuation are noise
+    for ranking). Falls back to the raw text if it isn't valid JSON.
+    """
+    try:
+        parsed = json.loads(tumor_json)
+    except (TypeError, ValueError):
+        return tumor_json or ""
+    values = []
+    stack = [parsed]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, (str, int, float)) and not isinstance(node, bool):
+            values.append(str(node))
+    return " ".join(values)
+
+
+def build_bm25_index(names):
+    """
+    Build a BM25 index over a list of candidate names (each name is one document).
+    """
+    docs = [tokenize(n) for n in names]
+    df = {}
+    for doc in docs:
+        for term in set(doc):
+            df[term] = df.get(term, 0) + 1
+    avgdl = (sum(len(d) for d in docs) / len(docs)) if docs else 0.0
+    return {"names": list(names), "docs": docs, "df": df, "avgdl": avgdl}
+
+
+_bm25_lock = threading.Lock()
+_bm25_memory = {}
+
+
+def load_bm25_index(tissue_name, names, index_dir = "../.cache/bm25"):
+    """
+    Return the BM25 index for a tissue's names list. Built once, persisted as JSON under
+    index_dir and keyed on a hash of the names, then kept in memory for the process.
+    """
+    digest = hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+    with _bm25_lock:
+        cached = _bm25_memory.get(tissue_name)
+        if cached is not None and cached["hash"] == digest:
+            return cached
+
+        index = None
+        path = os.path.join(index_dir, f"{tissue_name.strip()}_bm25.json") if index_dir else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = None
+            if index is not None and index.get("hash") != digest:
+                index = None
+
+        if index is None:
+            index = build_bm25_index(names)
+            index["hash"] = digest
+            if path:
+                os.makedirs(index_dir, exist_ok=True)
+                tmp = path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(index, f)
+                os.replace(tmp, path)
+
+        _bm25_memory[tissue_name] = index
+        return index
+
+
+def bm25_scores(index, query_text, k1 = 1.5, b = 0.75):
+    """
+    Score every name in the index against the query text. Returns a list of
+    (name, score) sorted best first (ties keep the original list order).
+    """
+    query = set(tokenize(query_text))
+    n_docs = len(index["docs"])
+    scored = []
+    for pos, (name, doc) in enumerate(zip(index["names"], index["docs"])):
+        score = 0.0
+        dl = len(doc)
+        for term in query:
+            tf = doc.count(term)
+            if not tf:
+                continue
+            df = index["df"].get(term, 0)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * dl / index["avgdl"]) if index["avgdl"] else k1
+            score += idf * tf * (k1 + 1) / (tf + norm)
+        scored.append((pos, name, score))
+    scored.sort(key=lambda x: (-x[2], x[0]))
+    return [(name, score) for _, name, score in scored]
+
+
+def preselect_oncotree_names(tumor_json, tissue_name, oncotree_names, top_k,
+                             index_dir = "../.cache/bm25",
+                             ambiguity_ratio = 0.8):
+    """
+    Return the top_k names for the tissue ranked by BM25 against the tumor JSON text,
+    or the full list when the ranking is ambiguous: nothing matched, or the first
+    candidate left out scores within ambiguity_ratio of the best one.
+    """
+    index = load_bm25_index(tissue_name, oncotree_names, index_dir=index_dir)
+    names = index["names"]
+    if not top_k or top_k >= len(names):
+        return list(names)
+    ranked = bm25_scores(index, tumor_json_text(tumor_json))
+    best = ranked[0][1]
+    if best <= 0 or ranked[top_k][1] >= ambiguity_ratio * best:
+        return list(names)
+    return [name for name, _ in ranked[:top_k]]
+
+
+# ---------- Embedding candidate retrieval ----------
+# Optional alternative to BM25: names are embedded once with a local Ollama embedding
+# model (e.g. nomic-embed-text) and stored per tissue as a memory-mapped .npy matrix.
+# Needs numpy, which is only imported when this path is used.
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Embedding retrieval needs numpy: pip install numpy")
+    return numpy
+
+
+def embed_texts(texts, embed_model, client = None, batch_size = 64):
+    """
+    Embed a list of texts with an Ollama embedding model. Returns an L2-normalized
+    float32 matrix (one row per text), so a dot product is the cosine similarity.
+    """
+    np = _numpy()
+    rows = []
+    for i in range(0, len(texts), batch_size):
+        response = (client or ollama).embed(model=embed_model, input=list(texts[i:i + batch_size]))
+        rows.extend(response["embeddings"])
+    matrix = np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+_embedding_lock = threading.Lock()
+_embedding_memory = {}
+
+
+def load_embedding_index(tissue_name, names, embed_model, index_dir = "../.cache/embeddings", client = None):
+    """
+    Return {"names", "vectors", "hash"} for a tissue's names list. Vectors are computed once,
+    saved as <index_dir>/<tissue>.<model>.npy (memory-mapped on load) next to a .json with
+    the content hash (names + model), and rebuilt when the hash no longer matches.
+    """
+    np = _numpy()
+    digest = hashlib.sha256((embed_model + "\n" + "\n".join(names)).encode("utf-8")).hexdigest()
+    key = (tissue_name, embed_model)
+    with _embedding_lock:
+        cached = _embedding_memory.get(key)
+        if cached is not None and cached["hash"] == digest:
+            return cached
+
+    base = os.path.join(index_dir, f"{tissue_name.strip()}.{re.sub(r'[^A-Za-z0-9_.-]+', '_', embed_model)}")
+    vectors = None
+    try:
+        with open(base + ".json", "r", encoding="utf-8") as f:
+            if json.load(f).get("hash") == digest:
+                vectors = np.load(base + ".npy", mmap_mode="r")
+    except (OSError, ValueError):
+        vectors = None
+    if vectors is None or vectors.shape[0] != len(names):
+        # embedding happens outside the lock; a concurrent duplicate build is harmless
+        vectors = embed_texts(list(names), embed_model, client=client)
+        os.makedirs(index_dir, exist_ok=True)
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, vectors)
+        os.replace(base + ".npy.tmp", base + ".npy")
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"hash": digest, "model": embed_model, "names": list(names)}, f)
+        os.replace(base + ".json.tmp", base + ".json")
+
+    index = {"names": list(names), "vectors": vectors, "hash": digest}
+    with _embedding_lock:
+        _embedding_memory[key] = index
+    return index
+
+
+_query_lock = threading.Lock()
+_query_memory = {}
+
+
+def embed_tumor_summary(tumor_json, embed_model, client = None, max_chars = 4000):
+    """
+    Embedding of the tumor JSON's values (compacted, IDs dropped, truncated to max_chars).
+    Memoized per text, so the tissue and name stages of one record embed it only once.
+    """
+    text = tumor_json_text(compact_tumor_json(tumor_json))[:max_chars] or " "
+    key = (embed_model, hashlib.sha256(text.encode("utf-8")).hexdigest())
+    with _query_lock:
+        if key in _query_memory:
+            return _query_memory[key]
+    vector = embed_texts([text], embed_model, client=client)[0]
+    with _query_lock:
+        if len(_query_memory) >= 1024:
+            _query_memory.clear()
+        _query_memory[key] = vector
+    return vector
+
+
+def embedding_scores(index, query_vector):
+    """
+    Cosine similarity of the query against every name in the index (one matrix-vector
+    product). Returns a list of (name, score) sorted best first.
+    """
+    np = _numpy()
+    scores = np.asarray(index["vectors"]) @ query_vector
+    order = np.argsort(-scores, kind="stable")
+    return [(index["names"][i], float(scores[i])) for i in order]
+
+
+def retrieve_oncotree_names(tumor_json, tissue_name, oncotree_names, top_k, embed_model, client = None,
+                            index_dir = "../.cache/embeddings", ambiguity_ratio = 0.8):
+    """
+    Return the top_k names for the tissue by cosine similarity to the tumor summary,
+    or the full list when the ranking is ambiguous (as preselect_oncotree_names):
+    nothing is similar, or the first candidate left out scores within
+    ambiguity_ratio of the best one.
+    """
+    if not top_k or top_k >= len(oncotree_names):
+        return list(oncotree_names)
+    index = load_embedding_index(tissue_name, oncotree_names, embed_model, index_dir=index_dir, client=client)
+    query = embed_tumor_summary(tumor_json, embed_model, client=client)
+    ranked = embedding_scores(index, query)
+    best = ranked[0][1]
+    if best <= 0 or ranked[top_k][1] >= ambiguity_ratio * best:
+        return list(oncotree_names)
+    return [name for name, _ in ranked[:top_k]]
+
+
+def rank_tissues_by_embedding(tumor_json, reference, embed_model, client = None,
+                              index_dir = "../.cache/embeddings"):
+    """
+    Rank tissues by their best-matching OncoTree name (max cosine similarity over the
+    tissue's names). Returns a list of (tissue, score) sorted best first.
+    """
+    query = embed_tumor_summary(tumor_json, embed_model, client=client)
+    ranked = []
+    for tissue in reference.tissues:
+        names = reference.names(tissue)
+        if not names:
+            continue
+        index = load_embedding_index(tissue, names, embed_model, index_dir=index_dir, client=client)
+        ranked.append((tissue, embedding_scores(index, query)[0][1]))
+    ranked.sort(key=lambda x: -x[1])
+    return ranked
+
+
+def decisive_tissue(ranked, margin):
+    """
+    The top tissue if it beats the runner-up by at least `margin` cosine similarity, else None.
+    """
+    if not ranked or not margin:
+        return None
+    if len(ranked) == 1 or ranked[0][1] - ranked[1][1] >= margin:
+        return ranked[0][0]
+    return None
+
+
+# ---------- Deterministic fast path ----------
+# Report fields that may carry an explicit diagnosis or code (matched as substrings of the key).
+DIAGNOSIS_KEY_HINTS = ("diagnosis", "oncotree", "tumor_type", "tumour_type", "histology", "cancer_type", "icd")
+
+# Spelling variants folded together before matching.
+_ALIASES = (("tumour", "tumor"), ("oesophag", "esophag"), ("haem", "hem"), ("&", " and "))
+
+
+def normalize_name(text):
+    """
+    Casefold, fold spelling variants, drop punctuation and a trailing "NOS",
+    and collapse whitespace, so near-identical diagnosis strings compare equal.
+    """
+    s = (text or "").casefold()
+    for old, new in _ALIASES:
+        s = s.replace(old, new)
+    s = re.sub(r"[^a-z0-9]+", " ", s).strip()
+    if s.endswith(" nos"):
+        s = s[:-4].rstrip()
+    return s
+
+
+_reverse_index_lock = threading.Lock()
+_reverse_indexes = {}
+
+
+def load_reverse_index(tissue_list_path = "../data/tissue_types.txt",
+                       data_base_path = "../data/oncotree_tissues"):
+    """
+    Precomputed reverse index over every tissue's name -> code map:
+      exact:      name -> [(tissue, name), ...]
+      normalized: normalize_name(name) -> [(tissue, name), ...]
+      code:       oncotree code -> [(tissue, name), ...]
+    Built once per (tissue list, data dir) from the shared OncoTreeReference.
+    """
+    reference = load_reference(tissue_list_path, data_base_path)
+    with _reverse_index_lock:
+        index = _reverse_indexes.get(id(reference))
+        if index is not None:
+            return index
+        index = {"exact": {}, "normalized": {}, "code": {}}
+        for tissue in reference.tissues:
+            for name, code in reference.name_to_code(tissue).items():
+                entry = (tissue, name)
+                index["exact"].setdefault(name, []).append(entry)
+                index["normalized"].setdefault(normalize_name(name), []).append(entry)
+                if code:
+                    index["code"].setdefault(code.upper(), []).append(entry)
+        _reverse_indexes[id(reference)] = index
+        return index
+
+
+def _diagnosis_values(tumor_json):
+    """
+    Yield (key, string value) pairs from diagnosis-like fields of the tumor JSON.
+    """
+    try:
+        parsed = json.loads(tumor_json)
+    except (TypeError, ValueError):
+        return
+    stack = [parsed]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if isinstance(v, (dict, list)):
+                    stack.append(v)
+                elif isinstance(v, str) and v.strip() and any(h in str(k).lower() for h in DIAGNOSIS_KEY_HINTS):
+                    yield str(k), v.strip()
+        elif isinstance(node, list):
+            stack.extend(node)
+
+
+def match_report_to_oncotree(tumor_json, index, tissue_name = None):
+    """
+    Try to resolve the report to a single (tissue, name) without the LLM.
+    Diagnosis-like fields are matched against the reverse index by exact name,
+    OncoTree code, then normalized/alias name. If tissue_name is given only
+    entries in that tissue count. Returns {"tissue", "name", "match"} when the
+    report pins exactly one entry, else None.
+    """
+    found = {}
+    for _, value in _diagnosis_values(tumor_json):
+        for how, table, probe in (
+            ("exact", index["exact"], value),
+            ("code", index["code"], value.upper()),
+            ("normalized", index["normalized"], normalize_name(value)),
+        ):
+            for entry in table.get(probe, ()):
+                if tissue_name is None or entry[0] == tissue_name:
+                    found.setdefault(entry, how)
+    if len(found) != 1:
+        return None
+    (tissue, name), how = next(iter(found.items()))
+    return {"tissue": tissue, "name": name, "match": how}
+
+
+# ---------- Instrumentation ----------
+def _start_llm_metrics(details, prompt_started):
+    """
+    Record prompt-building time in `details` and return the dict generate_response()
+    should fill as details["llm"] (None when no details are collected).
+    """
+    if details is None:
+        return None
+    details["prompt_seconds"] = time.perf_counter() - prompt_started
+    details["llm"] = {}
+    return details["llm"]
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile (pct in 0-100) of a list of numbers; 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_llm_metrics(metrics_list):
+    """
+    Aggregate a list of generate_response() metrics dicts (cache hits are skipped) into
+    call count, p50/p95/p99 wall time, token totals and prefill/generation tokens/sec.
+    """
+    calls = [m for m in metrics_list if m and not m.get("cached") and "wall_seconds" in m]
+    walls = [m["wall_seconds"] for m in calls]
+    prompt_tokens = sum(m.get("prompt_eval_count", 0) for m in calls)
+    gen_tokens = sum(m.get("eval_count", 0) for m in calls)
+    prompt_ns = sum(m.get("prompt_eval_duration", 0) for m in calls)
+    gen_ns = sum(m.get("eval_duration", 0) for m in calls)
+    return {
+        "calls": len(calls),
+        "p50_seconds": percentile(walls, 50),
+        "p95_seconds": percentile(walls, 95),
+        "p99_seconds": percentile(walls, 99),
+        "prompt_tokens": prompt_tokens,
+        "generated_tokens": gen_tokens,
+        "prefill_tokens_per_sec": prompt_tokens / (prompt_ns / 1e9) if prompt_ns else 0.0,
+        "generation_tokens_per_sec": gen_tokens / (gen_ns / 1e9) if gen_ns else 0.0,
+        "load_seconds": sum(m.get("load_duration", 0) for m in calls) / 1e9,
+    }
+
+
+# ---------- Salvage near-miss model outputs ----------
+SALVAGE_ACCEPT_SCORE = 0.92   # accept without review at or above this score
+SALVAGE_REVIEW_SCORE = 0.80   # flag as borderline between this and the accept score
+SALVAGE_MIN_MARGIN = 0.03     # best match must beat the runner-up by this much to be accepted
+
+_salvage_lock = threading.Lock()
+_salvage_indexes = {}
+
+
+def load_salvage_index(candidates):
+    """
+    Precomputed lookup tables for a canonical list: normalized key -> candidates, and each
+    candidate's normalized and token-sorted forms for fuzzy scoring. Cached per list.
+    """
+    key = tuple(candidates)
+    with _salvage_lock:
+        index = _salvage_indexes.get(key)
+        if index is None:
+            normalized = {}
+            forms = []
+            for c in key:
+                n = normalize_name(c)
+                normalized.setdefault(n, []).append(c)
+                forms.append((c, n, " ".join(sorted(n.split()))))
+            index = {"candidates": set(key), "normalized": normalized, "forms": forms}
+            _salvage_indexes[key] = index
+        return index
+
+
+def _fuzzy_score(answer_norm, answer_sorted, cand_norm, cand_sorted):
+    """
+    Best of character-level and token-set similarity (0-1); token sorting makes
+    reordered words score high, SequenceMatcher handles typos and truncation.
+    """
+    best = 0.0
+    for a, b in ((answer_norm, cand_norm), (answer_sorted, cand_sorted)):
+        matcher = difflib.SequenceMatcher(None, a, b)
+        if matcher.real_quick_ratio() <= best or matcher.quick_ratio() <= best:
+            continue
+        best = max(best, matcher.ratio())
+    return best
+
+
+def salvage_answer(answer, candidates):
+    """
+    Map a model answer onto the canonical candidates without another LLM call.
+    Returns {"match", "score", "status"} where status is:
+      "exact"       answer is already canonical
+      "normalized"  equal after case/punctuation/alias normalization
+      "fuzzy"       high-confidence edit-distance/token-set or truncated-prefix match (accepted)
+      "borderline"  plausible match that needs human review (match is a suggestion)
+      "unknown"     the model answered Unknown / nothing
+      "none"        nothing close enough
+    """
+    text = (answer or "").strip()
+    if not text or text.lower() == "unknown":
+        return {"match": None, "score": 0.0, "status": "unknown"}
+    index = load_salvage_index(candidates)
+    if text in index["candidates"]:
+        return {"match": text, "score": 1.0, "status": "exact"}
+    norm = normalize_name(text)
+    same = index["normalized"].get(norm, ())
+    if len(same) == 1:
+        return {"match": same[0], "score": 1.0, "status": "normalized"}
+
+    # truncated output: a long-enough prefix of exactly one candidate
+    prefixed = [(c, n) for c, n, _ in index["forms"] if n.startswith(norm)] if norm else []
+    if len(prefixed) == 1 and len(norm.split()) >= 2 and len(norm) >= 0.6 * len(prefixed[0][1]):
+        return {"match": prefixed[0][0], "score": 0.9 + 0.1 * len(norm) / len(prefixed[0][1]), "status": "fuzzy"}
+
+    norm_sorted = " ".join(sorted(norm.split()))
+    scored = sorted(
+        ((_fuzzy_score(norm, norm_sorted, n, ns), c) for c, n, ns in index["forms"]),
+        key=lambda x: -x[0],
+    )
+    if not scored:
+        return {"match": None, "score": 0.0, "status": "none"}
+    best_score, best = scored[0]
+    runner_up = scored[1][0] if len(scored) > 1 else 0.0
+    if best_score >= SALVAGE_ACCEPT_SCORE and best_score - runner_up >= SALVAGE_MIN_MARGIN:
+        return {"match": best, "score": best_score, "status": "fuzzy"}
+    if best_score >= SALVAGE_REVIEW_SCORE:
+        return {"match": best, "score": best_score, "status": "borderline"}
+    return {"match": None, "score": best_score, "status": "none"}
+
+
+# ---------- Joint tissue + name prediction ----------
+def create_joint_candidates(tissue_list_path = "../data/tissue_types.txt",
+                            data_base_path = "../data/oncotree_tissues"):
+    """
+    Combined candidate list "<Tissue> :: <OncoTree name>" over every tissue in tissue_types.txt.
+    """
+    reference = load_reference(tissue_list_path, data_base_path)
+    return [f"{tissue}{JOINT_SEPARATOR}{name}" for tissue in reference.tissues for name in reference.names(tissue)]
+
+
+def parse_joint_response(text, index):
+    """
+    Validate a joint answer against the OncoTree maps (via the reverse index).
+    Accepts "<Tissue> :: <name>", or a bare name when it belongs to exactly one tissue.
+    Returns (tissue, name), or (None, None) when the answer isn't a valid entry.
+    """
+    text = (text or "").strip()
+    if JOINT_SEPARATOR.strip() in text:
+        tissue, _, name = text.partition(JOINT_SEPARATOR.strip())
+        tissue, name = tissue.strip(), name.strip()
+        if (tissue, name) in index["exact"].get(name, ()):
+            return tissue, name
+        return None, None
+    entries = index["exact"].get(text, ())
+    if len(entries) == 1:
+        return entries[0]
+    return None, None
+
+
+def predict_tissue_and_name(tissue_list_path = "../data/tissue_types.txt",
+                            tumor_json_path = None,
+                            model = "granite4:latest",
+                            temperature = 0.0,
+                            data_base_path = "../data/oncotree_tissues",
+                            cache = None,
+                            tumor_json = None,
+                            details = None,
+                            fast_path = False,
+                            compaction = None,
+                            constrained = False,
+                            client = None,
+                            keep_alive = None,
+                            early_stop = False):
+    """
+    Predict tissue and OncoTree name with a single LLM call over the combined candidate list.
+    Near-miss answers are salvaged (see salvage_answer; result in details["salvage"]).
+    Returns (tissue, name); both are "Unknown" when the model answer isn't a valid map entry.
+    `compaction` (see prompt_tumor_json) shrinks the tumor JSON sent to the model.
+    constrained=True restricts the output to the candidate list (see cached_generate).
+    `client` (ollama.Client or OllamaPool) overrides the default Ollama host;
+    `keep_alive` is passed to Ollama (see warm_up_model).
+    early_stop=True stops reading the reply once it names a candidate (see cached_generate).
+    """
+    started = time.perf_counter()
+    if tumor_json is None:
+        tumor_json = get_tumor_json(tumor_json_path)
+        if details is not None:
+            details["read_seconds"] = time.perf_counter() - started
+    index = load_reverse_index(tissue_list_path, data_base_path)
+    if fast_path:
+        hit = match_report_to_oncotree(tumor_json, index)
+        if hit is not None:
+            if details is not None:
+                details["path"] = f"rule:{hit['match']}"
+            return hit["tissue"], hit["name"]
+    if details is not None:
+        details["path"] = "llm"
+    prompt_started = time.perf_counter()
+    candidates = create_joint_candidates(tissue_list_path, data_base_path)
+    sys_prompt = create_system_prompt_for_joint(candidates)
+    prompt_json = prompt_tumor_json(tumor_json, compaction, details)
+    metrics = _start_llm_metrics(details, prompt_started)
+    raw = cached_generate(cache, model, temperature, sys_prompt, prompt_json, prompt_json, candidates, metrics=metrics,
+                          constrained=constrained, client=client, keep_alive=keep_alive, early_stop=early_stop)
+    validate_started = time.perf_counter()
+    tissue, name = parse_joint_response(raw, index)
+    if tissue is None and raw and raw.strip().lower() != "unknown":
+        # near-miss entry: salvage against the combined list instead of giving up
+        salvaged = salvage_answer(raw, candidates)
+        if details is not None:
+            details["salvage"] = salvaged
+        if salvaged["status"] in ("normalized", "fuzzy"):
+            tissue, name = parse_joint_response(salvaged["match"], index)
+    if details is not None:
+        details["raw"] = raw
+        details["validate_seconds"] = time.perf_counter() - validate_started
+    if tissue is None:
+        return "Unknown", "Unknown"
+    return tissue, name
+
+
 # ---------- Convenience / combined flows ----------
 def predict_oncotree_name_from_tissue(tissue_name,
-                                      tumor_json_path,
+                                      tumor_json_path = None,
                                       model = "granite4:latest",
                                       temperature = 0.0,
-                                      data_base_path = "../data/oncotree_tissues"):
+                                      data_base_path = "../data/oncotree_tissues",
+                                      cache = None,
+                                      tumor_json = None,
+                                      top_k = None,
+                                      details = None,
+                                      fast_path = False,
+                                      tissue_list_path = "../data/tissue_types.txt",
+                                      compaction = None,
+                                      constrained = False,
+                                      client = None,
+                                      keep_alive = None,
+                                      embed_model = None,
+                                      cancel = None,
+                                      logprobs = False,
+                                      early_stop = False,
+                                      on_text = None):
     """
     Load oncotree names for a given tissue and tumor json, call LLM, return predicted oncotree name.
+    Pass `tumor_json` (raw string) instead of `tumor_json_path` to skip the file read.
+    If a PredictionCache is given it is checked before calling the model.
+    If top_k is set, only the BM25 top_k names are sent (full list when ranking is ambiguous),
+    or the embedding top_k when an Ollama `embed_model` is given (see retrieve_oncotree_names).
+    If a `details` dict is given it is filled with diagnostics about the call.
+    With fast_path=True a report that already pins a name in this tissue skips the LLM
+    (details["path"] records "rule:<match>" or "llm").
+    `compaction` (see prompt_tumor_json) shrinks the tumor JSON sent to the model.
+    constrained=True restricts the output to the candidate list (see cached_generate).
+    `client` (ollama.Client or OllamaPool) overrides the default Ollama host;
+    `keep_alive` is passed to Ollama (see warm_up_model).
+    Setting the `cancel` threading.Event abandons the LLM call (see ensemble_vote).
+    logprobs=True records the answer's details["llm"]["logprob_margin"] (see cascade_predict).
+    early_stop=True stops reading the reply once it names a candidate; `on_text` gets the
+    partial reply as it streams (see cached_generate).
     """
-    oncotree_names = parse_oncotree_list(tissue_name, base_path=data_base_path)
-    tumor_json = get_tumor_json(tumor_json_path)
+    started = time.perf_counter()
+    if tumor_json is None:
+        tumor_json = get_tumor_json(tumor_json_path)
+        if details is not None:
+            details["read_seconds"] = time.perf_counter() - started
+    if fast_path:
+        index = load_reverse_index(tissue_list_path, data_base_path)
+        hit = match_report_to_oncotree(tumor_json, index, tissue_name=tissue_name.strip())
+        if hit is not None:
+            if details is not None:
+                details["path"] = f"rule:{hit['match']}"
+            return hit["name"]
+    if details is not None:
+        details["path"] = "llm"
+    prompt_started = time.perf_counter()
+    oncotree_names = list(load_reference(tissue_list_path, data_base_path).names(tissue_name))
+    if top_k and embed_model:
+        oncotree_names = retrieve_oncotree_names(tumor_json, tissue_name, oncotree_names, top_k, embed_model,
+                                                 client=client)
+    elif top_k:
+        oncotree_names = preselect_oncotree_names(tumor_json, tissue_name, oncotree_names, top_k)
+    if details is not None:
+        details["candidates_sent"] = len(oncotree_names)
+    prompt_json = prompt_tumor_json(tumor_json, compaction, details)
     sys_prompt = create_system_prompt_for_names()
-    user_prompt = create_user_prompt_for_names(tumor_json, oncotree_names)
-    return generate_response(model=model, temperature=temperature, system_prompt=sys_prompt, user_prompt=user_prompt)
+    user_prompt = create_user_prompt_for_names(prompt_json, oncotree_names)
+    if details is not None:
+        details["prompt_chars"] = len(sys_prompt) + len(user_prompt)
+    metrics = _start_llm_metrics(details, prompt_started)
+    return cached_generate(cache, model, temperature, sys_prompt, user_prompt, prompt_json, oncotree_names, metrics=metrics,
+                           constrained=constrained, client=client, keep_alive=keep_alive, cancel=cancel,
+                           logprobs=logprobs, early_stop=early_stop, on_text=on_text)
 
 
 def predict_tissue_from_list(tissue_list_path,
-                             tumor_json_path,
+                             tumor_json_path = None,
                              model = "granite4:latest",
-                             temperature = 0.0):
+                             temperature = 0.0,
+                             cache = None,
+                             tumor_json = None,
+                             details = None,
+                             fast_path = False,
+                             data_base_path = "../data/oncotree_tissues",
+                             compaction = None,
+                             constrained = False,
+                             client = None,
+                             keep_alive = None,
+                             embed_model = None,
+                             tissue_margin = None,
+                             cancel = None,
+                             logprobs = False,
+                             early_stop = False,
+                             on_text = None):
     """
     Load tissue list and tumor json, call LLM, return predicted tissue.
+    Pass `tumor_json` (raw string) instead of `tumor_json_path` to skip the file read.
+    If a PredictionCache is given it is checked before calling the model.
+    With fast_path=True a report that already pins a single OncoTree entry skips the LLM
+    (details["path"] records "rule:<match>" or "llm").
+    `compaction` (see prompt_tumor_json) shrinks the tumor JSON sent to the model.
+    constrained=True restricts the output to the candidate list (see cached_generate).
+    `client` (ollama.Client or OllamaPool) overrides the default Ollama host;
+    `keep_alive` is passed to Ollama (see warm_up_model).
+    With an `embed_model` and `tissue_margin`, tissues are ranked by embedding similarity
+    and a top tissue that leads the runner-up by tissue_margin skips the LLM
+    (details["path"] is then "embedding", the top ranks are in details["tissue_ranking"]).
+    Setting the `cancel` threading.Event abandons the LLM call (see ensemble_vote).
+    logprobs=True records the answer's details["llm"]["logprob_margin"] (see cascade_predict).
+    early_stop=True stops reading the reply once it names a candidate; `on_text` gets the
+    partial reply as it streams (see cached_generate).
     """
-    tissues = parse_tissue_list(tissue_list_path)
-    tumor_json = get_tumor_json(tumor_json_path)
+    reference = load_reference(tissue_list_path, data_base_path)
+    tissues = list(reference.tissues)
+    started = time.perf_counter()
+    if tumor_json is None:
+        tumor_json = get_tumor_json(tumor_json_path)
+        if details is not None:
+            details["read_seconds"] = time.perf_counter() - started
+    if fast_path:
+        hit = match_report_to_oncotree(tumor_json, load_reverse_index(tissue_list_path, data_base_path))
+        if hit is not None:
+            if details is not None:
+                details["path"] = f"rule:{hit['match']}"
+            return hit["tissue"]
+    if embed_model and tissue_margin:
+        ranked = rank_tissues_by_embedding(tumor_json, reference, embed_model, client=client)
+        decided = decisive_tissue(ranked, tissue_margin)
+        if details is not None:
+            details["tissue_ranking"] = ranked[:3]
+        if decided is not None:
+            if details is not None:
+                details["path"] = "embedding"
+            return decided
+    if details is not None:
+        details["path"] = "llm"
+    prompt_started = time.perf_counter()
     sys_prompt = create_system_prompt_for_tissues(tissues)
-    return generate_response(model=model, temperature=temperature, system_prompt=sys_prompt, user_prompt=tumor_json)
+    prompt_json = prompt_tumor_json(tumor_json, compaction, details)
+    metrics = _start_llm_metrics(details, prompt_started)
+    return cached_generate(cache, model, temperature, sys_prompt, prompt_json, prompt_json, tissues, metrics=metrics,
+                           constrained=constrained, client=client, keep_alive=keep_alive, cancel=cancel,
+                           logprobs=logprobs, early_stop=early_stop, on_text=on_text)
+
 
+# ---------- Multi-model ensemble ----------
+VALID_SALVAGE = ("exact", "normalized", "fuzzy")
+
+
+def ensemble_vote(predict, models, candidates, quorum = None):
+    """
+    Call predict(model, cancel) for every model concurrently and majority-vote on the
+    answers once they are validated against `candidates` (see salvage_answer; invalid
+    answers and "Unknown" get no vote). As soon as one answer has `quorum` votes
+    (default: a majority of the models) `cancel` is set and the slower calls are dropped.
+    Without a quorum the plurality answer wins (ties go to the first to arrive).
+    Returns {"answer", "votes", "models", "answered", "agreement", "answers", "short_circuit"}
+    where answered is the number of models that finished (errors included) and answers
+    maps each of them to its {"raw", "answer"} (or {"error"}). agreement = votes / answered:
+    models dropped by the quorum never disagreed, so they don't lower it.
+    """
+    models = list(dict.fromkeys(models))
+    quorum = min(quorum or len(models) // 2 + 1, len(models))
+    cancel = threading.Event()
+    answers = {}
+    votes = {}
+    winner = None
+    executor = ThreadPoolExecutor(max_workers=len(models))
+    futures = {executor.submit(predict, model, cancel): model for model in models}
+    try:
+        for future in as_completed(futures):
+            model = futures[future]
+            try:
+                raw = future.result()
+            except Exception as e:
+                answers[model] = {"error": f"{type(e).__name__}: {e}"}
+                continue
+            result = salvage_answer(raw, candidates)
+            answer = result["match"] if result["status"] in VALID_SALVAGE else None
+            answers[model] = {"raw": raw, "answer": answer}
+            if answer is not None:
+                votes[answer] = votes.get(answer, 0) + 1
+                if votes[answer] >= quorum:
+                    winner = answer
+                    break
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    if winner is None and votes:
+        winner = max(votes, key=votes.get)
+    count = votes.get(winner, 0)
+    return {
+        "answer": winner or "Unknown",
+        "votes": count,
+        "models": len(models),
+        "answered": len(answers),
+        "agreement": count / len(answers) if answers else 0.0,
+        "answers": answers,
+        "short_circuit": len(answers) < len(models),
+    }
+
+
+def agreement_confidence(agreement):
+    """
+    Map an ensemble agreement (0-1) onto the 1-5 confidence scale of the output records.
+    """
+    return 1 + round(4 * agreement)
+
+
+def _combine_model_details(details, per_model, models, started):
+    """
+    Fill a stage's `details` from several models' calls (ensemble or cascade):
+    details["models"] holds each model's own details and details["llm"] the wall time
+    since `started` with the summed token counts of the listed (finished) models.
+    Only those are copied: cancelled ensemble workers may still be adding to `per_model`.
+    """
+    details["models"] = {m: per_model[m] for m in models if m in per_model}
+    finished = list(details["models"].values())
+    paths = {d.get("path") for d in finished}
+    details["path"] = paths.pop() if len(paths) == 1 and None not in paths else "llm"
+    for d in finished:
+        for key in ("read_seconds", "candidates_sent", "json_tokens_before", "json_tokens_after", "prompt_chars",
+                    "tissue_ranking"):
+            if key in d and key not in details:
+                details[key] = d[key]
+    calls = [d["llm"] for d in finished if d.get("llm")]
+    if calls and all(m.get("cached") for m in calls):
+        details["llm"] = {"cached": True}
+    elif calls:
+        llm = {"wall_seconds": time.perf_counter() - started}
+        for metrics in calls:
+            for field in OLLAMA_METRIC_FIELDS:
+                if field in metrics:
+                    llm[field] = llm.get(field, 0) + metrics[field]
+        if any(metrics.get("early_stop") for metrics in calls):
+            llm["early_stop"] = True
+        details["llm"] = llm
+
+
+def _ensemble_details(details, vote, per_model, started):
+    """
+    Fill a stage's `details` from an ensemble vote; details["ensemble"] summarizes the vote.
+    """
+    if details is None:
+        return
+    details["ensemble"] = {key: vote[key] for key in ("votes", "models", "answered", "agreement", "short_circuit")}
+    details["ensemble"]["answers"] = {m: a.get("answer") or a.get("error") or "Unknown"
+                                      for m, a in vote["answers"].items()}
+    _combine_model_details(details, per_model, vote["answers"], started)
+
+
+def ensemble_predict_tissue(models, quorum = None, details = None, **kwargs):
+    """
+    predict_tissue_from_list() voted across several models (see ensemble_vote).
+    Other keyword arguments are passed to predict_tissue_from_list for every model.
+    Returns the winning tissue or "Unknown".
+    """
+    tissue_list_path = kwargs.pop("tissue_list_path", "../data/tissue_types.txt")
+    reference = load_reference(tissue_list_path, kwargs.get("data_base_path", "../data/oncotree_tissues"))
+    if kwargs.get("tumor_json") is None:
+        kwargs["tumor_json"] = get_tumor_json(kwargs.pop("tumor_json_path"))
+    started = time.perf_counter()
+    per_model = {}
+
+    def predict(model, cancel):
+        per_model[model] = {}
+        return predict_tissue_from_list(tissue_list_path, model=model, details=per_model[model], cancel=cancel,
+                                        **kwargs)
+
+    vote = ensemble_vote(predict, models, reference.tissues, quorum)
+    _ensemble_details(details, vote, per_model, started)
+    return vote["answer"]
+
+
+def ensemble_predict_oncotree_name(tissue_name, models, quorum = None, details = None, **kwargs):
+    """
+    predict_oncotree_name_from_tissue() voted across several models (see ensemble_vote).
+    Other keyword arguments are passed to predict_oncotree_name_from_tissue for every model.
+    Returns the winning OncoTree name or "Unknown".
+    """
+    reference = load_reference(kwargs.get("tissue_list_path", "../data/tissue_types.txt"),
+                               kwargs.get("data_base_path", "../data/oncotree_tissues"))
+    if kwargs.get("tumor_json") is None:
+        kwargs["tumor_json"] = get_tumor_json(kwargs.pop("tumor_json_path"))
+    started = time.perf_counter()
+    per_model = {}
+
+    def predict(model, cancel):
+        per_model[model] = {}
+        return predict_oncotree_name_from_tissue(tissue_name, model=model, details=per_model[model], cancel=cancel,
+                                                 **kwargs)
+
+    vote = ensemble_vote(predict, models, reference.names(tissue_name), quorum)
+    _ensemble_details(details, vote, per_model, started)
+    return vote["answer"]
+
+
+# ---------- Small-model-first cascade ----------
+def escalation_reason(answer, candidates, details = None, min_margin = None):
+    """
+    Why a model's answer should be passed on to a larger model, or None to accept it:
+    "unknown", "invalid" (not salvageable onto `candidates`) or "low margin" (its
+    details["llm"]["logprob_margin"] is below min_margin; answers without logprobs,
+    e.g. from the rule fast path or an older server, pass).
+    """
+    status = salvage_answer(answer, candidates)["status"]
+    if status == "unknown":
+        return "unknown"
+    if status not in VALID_SALVAGE:
+        return "invalid"
+    margin = ((details or {}).get("llm") or {}).get("logprob_margin")
+    if min_margin is not None and margin is not None and margin < min_margin:
+        return "low margin"
+    return None
+
+
+def cascade_predict(predict, models, candidates, min_margin = None):
+    """
+    Ask `models` in order, smallest / fastest first, and stop at the first answer that
+    needs no escalation (see escalation_reason); the last model's answer is taken as-is.
+    predict(model, details) returns the raw answer and fills that model's details.
+    Returns {"answer", "model", "tried"} where tried lists {"model", "answer", "reason"}
+    for every model asked (reason is None for the one whose answer was kept).
+    """
+    tried = []
+    answer = None
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        details = {}
+        try:
+            answer = predict(model, details)
+        except Exception as e:
+            if last:
+                raise
+            tried.append({"model": model, "answer": None, "reason": f"error: {type(e).__name__}"})
+            continue
+        reason = None if last else escalation_reason(answer, candidates, details, min_margin)
+        tried.append({"model": model, "answer": answer, "reason": reason})
+        if reason is None:
+            return {"answer": answer, "model": model, "tried": tried}
+    return {"answer": answer, "model": models[-1], "tried": tried}
+
+
+def _cascade_details(details, result, per_model, started):
+    """
+    Fill a stage's `details` from a cascade; details["cascade"] records who answered and why
+    earlier models were passed over.
+    """
+    if details is None:
+        return
+    details["cascade"] = {
+        "answered_by": result["model"],
+        "escalations": len(result["tried"]) - 1,
+        "reasons": [t["reason"] for t in result["tried"] if t["reason"]],
+    }
+    _combine_model_details(details, per_model, [t["model"] for t in result["tried"]], started)
+
+
+def cascade_predict_tissue(models, min_margin = None, details = None, **kwargs):
+    """
+    predict_tissue_from_list() with a small-model-first cascade (see cascade_predict).
+    Other keyword arguments are passed to predict_tissue_from_list for every model asked.
+    """
+    tissue_list_path = kwargs.pop("tissue_list_path", "../data/tissue_types.txt")
+    reference = load_reference(tissue_list_path, kwargs.get("data_base_path", "../data/oncotree_tissues"))
+    if kwargs.get("tumor_json") is None:
+        kwargs["tumor_json"] = get_tumor_json(kwargs.pop("tumor_json_path"))
+    started = time.perf_counter()
+    per_model = {}
+
+    def predict(model, model_details):
+        per_model[model] = model_details
+        return predict_tissue_from_list(tissue_list_path, model=model, details=model_details,
+                                        logprobs=min_margin is not None, **kwargs)
+
+    result = cascade_predict(predict, models, reference.tissues, min_margin)
+    _cascade_details(details, result, per_model, started)
+    return result["answer"]
+
+
+def cascade_predict_oncotree_name(tissue_name, models, min_margin = None, details = None, **kwargs):
+    """
+    predict_oncotree_name_from_tissue() with a small-model-first cascade (see cascade_predict).
+    Other keyword arguments are passed to predict_oncotree_name_from_tissue for every model asked.
+    """
+    reference = load_reference(kwargs.get("tissue_list_path", "../data/tissue_types.txt"),
+                               kwargs.get("data_base_path", "../data/oncotree_tissues"))
+    if kwargs.get("tumor_json") is None:
+        kwargs["tumor_json"] = get_tumor_json(kwargs.pop("tumor_json_path"))
+    started = time.perf_counter()
+    per_model = {}
 
+    def predict(model, model_details):
+        per_model[model] = model_details
+        return predict_oncotree_name_from_tissue(tissue_name, model=model, details=model_details,
+                                                 logprobs=min_margin is not None, **kwargs)
 
+    result = cascade_predict(predict, models, reference.names(tissue_name), min_margin)
+    _cascade_details(details, result, per_model, started)
+    return result["answer"]
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Long-running local HTTP service around the OncoTree prediction pipeline.
+
+Reference data, the prediction cache and the (pooled) Ollama client are set up once
+and stay warm, so upstream jobs can submit reports continuously instead of staging
+directories for test_models.py.
+
+Endpoints:
+    POST /predict   body: one tumor JSON report -> the output record test_models.py
+                    writes ({"oncotree_tissue", "oncotree_code", "oncotree_name", ...});
+                    ?details=1 adds timings / paths. X-Client-Id identifies the caller
+                    (default: its IP) and X-Record-Name names the report in logs.
+    GET  /health    200 when at least one Ollama host is healthy, else 503
+    GET  /metrics   request / batch / latency counters, per-host and cache stats
+
+Requests are coalesced into micro-batches: the dispatcher collects whatever arrives
+within --batch-window-ms (up to --max-batch), merges identical reports (also with ones
+already in flight, so concurrent callers share one prediction) and hands the batch to
+the worker pool together, which keeps Ollama's parallel slots full. Each client may
+have at most --per-client requests outstanding, and at most --max-queue reports wait
+for a worker; beyond either limit the service answers 429 with Retry-After.
+
+Usage:
+    python prediction_service.py --model granite4:latest --port 8765 --cache ../.cache/predictions.sqlite
+    curl -s -X POST --data-binary @report.json http://127.0.0.1:8765/predict
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import oncotree_utils as tools
+import test_models
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests",
+                500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+async def read_request(reader, max_body):
+    """
+    Read one HTTP/1.1 request. Returns (method, path, query, headers, body), or None
+    when the client closed the connection between requests.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Chunked request bodies are not supported; send Content-Length")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HttpError(413, f"Request body larger than {max_body} bytes")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), headers, body
+
+
+async def write_response(writer, status, payload, headers = None, keep_alive = True):
+    body = json.dumps(payload).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+             "Content-Type: application/json",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+class PredictionService:
+    """
+    Micro-batching front end for test_models.process_record(). `settings` are the keyword
+    arguments every prediction runs with (model, cache, client, ...); `workers` bounds the
+    predictions running at once (one thread each).
+    """
+
+    def __init__(self, settings, tissue_list, oncotree_base, workers, max_batch = 16, batch_window = 0.01,
+                 max_queue = 256, per_client = 8, max_body = 5 << 20):
+        self.settings = settings
+        self.tissue_list = tissue_list
+        self.oncotree_base = oncotree_base
+        self.workers = workers
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="oncotree-service")
+        self.queue = None  # created on the event loop in start()
+        self.slots = None
+        self.in_flight = {}  # report key -> asyncio.Future shared by every caller of that report
+        self.outstanding = {}  # client id -> requests not yet answered
+        self.tasks = set()
+        self.started_at = time.time()
+        self.counters = {"requests": 0, "completed": 0, "failed": 0, "rejected_client": 0, "rejected_queue": 0,
+                         "coalesced": 0, "batches": 0, "predictions": 0}
+        self.latencies = deque(maxlen=10_000)
+        self.batch_sizes = deque(maxlen=10_000)
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.max_queue)
+        self.slots = asyncio.Semaphore(self.workers)
+        self._spawn(self.dispatch())
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # ---------- Request admission ----------
+    async def submit(self, client_id, name, text):
+        """
+        Queue one report (or join an identical one already queued / running) and wait for
+        its (output record, details). Raises HttpError(429) when the client or the queue is full.
+        """
+        self.counters["requests"] += 1
+        if self.outstanding.get(client_id, 0) >= self.per_client:
+            self.counters["rejected_client"] += 1
+            raise HttpError(429, f"More than {self.per_client} requests outstanding for client {client_id}",
+                            {"Retry-After": "1"})
+        key = hashlib.sha256(tools.normalize_tumor_json(text).encode("utf-8")).hexdigest()
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+        else:
+            if self.queue.full():
+                self.counters["rejected_queue"] += 1
+                raise HttpError(429, "Prediction queue is full", {"Retry-After": "2"})
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            self.queue.put_nowait((key, name, text, future))
+        self.outstanding[client_id] = self.outstanding.get(client_id, 0) + 1
+        started = time.perf_counter()
+        try:
+            # shielded: a caller that disconnects must not cancel work other callers share
+            return await asyncio.shield(future)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+            self.outstanding[client_id] -= 1
+            if not self.outstanding[client_id]:
+                del self.outstanding[client_id]
+
+    # ---------- Micro-batching ----------
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.counters["batches"] += 1
+            self.batch_sizes.append(len(batch))
+            for item in batch:
+                await self.slots.acquire()  # backpressure: the queue fills while every worker is busy
+                self._spawn(self.run(*item))
+
+    async def run(self, key, name, text, future):
+        self.counters["predictions"] += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.predict, name, text)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self.in_flight.pop(key, None)
+            self.slots.release()
+
+    def predict(self, name, text):
+        details = {}
+        started = time.perf_counter()
+        res = test_models.process_record(name, text, self.tissue_list, self.oncotree_base, details=details,
+                                         **self.settings)
+        details["record_seconds"] = time.perf_counter() - started
+        return res, details
+
+    # ---------- HTTP ----------
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body)
+                    if request is None:
+                        break
+                    method, path, query, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload, extra = await self.route(method, path, query, headers, body, peer)
+                except HttpError as e:
+                    keep_alive = e.status < 500 and e.status not in (400, 411, 413)
+                    status, payload, extra = e.status, {"error": str(e)}, e.headers
+                await write_response(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, query, headers, body, peer):
+        if path == "/predict":
+            if method != "POST":
+                raise HttpError(405, "Use POST /predict")
+            return await self.handle_predict(query, headers, body, peer)
+        if path == "/health":
+            return self.handle_health()
+        if path == "/metrics":
+            return 200, self.metrics(), {}
+        raise HttpError(404, f"No route for {path}")
+
+    async def handle_predict(self, query, headers, body, peer):
+        text = body.decode("utf-8", errors="replace")
+        try:
+            parsed = json.loads(text)
+        except ValueError:
+            raise HttpError(400, "Body must be a tumor JSON report")
+        if not isinstance(parsed, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        client_id = headers.get("x-client-id") or (peer[0] if peer else "unknown")
+        name = headers.get("x-record-name") or f"{client_id}:{parsed.get('test_order_id', 'report')}"
+        try:
+            res, details = await self.submit(client_id, name, text)
+        except HttpError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            raise HttpError(500, f"Prediction failed: {e!r}")
+        payload = dict(res)
+        if query.get("details", ["0"])[0] not in ("0", "false", ""):
+            payload["details"] = details
+        if details.get("errors"):
+            self.counters["failed"] += 1
+            return 502, dict(payload, errors=details["errors"]), {}
+        self.counters["completed"] += 1
+        return 200, payload, {}
+
+    def handle_health(self):
+        client = self.settings.get("client")
+        hosts = client.stats() if client is not None else []
+        healthy = any(h["healthy"] for h in hosts) if hosts else True
+        payload = {"status": "ok" if healthy else "unavailable", "hosts": hosts,
+                   "queued": self.queue.qsize(), "running": self.workers - self.slots._value}
+        return (200 if healthy else 503), payload, {}
+
+    def metrics(self):
+        latencies = list(self.latencies)
+        sizes = list(self.batch_sizes)
+        metrics = dict(self.counters)
+        metrics.update({
+            "uptime_seconds": time.time() - self.started_at,
+            "queued": self.queue.qsize(),
+            "running": self.workers - self.slots._value,
+            "workers": self.workers,
+            "clients": dict(self.outstanding),
+            "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "latency_p50_seconds": tools.percentile(latencies, 50),
+            "latency_p95_seconds": tools.percentile(latencies, 95),
+            "latency_p99_seconds": tools.percentile(latencies, 99),
+        })
+        client = self.settings.get("client")
+        if client is not None:
+            metrics["hosts"] = client.stats()
+        if self.settings.get("cache") is not None:
+            metrics["cache"] = self.settings["cache"].stats()
+        return metrics
+
+
+async def serve(service, host, port):
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"OncoTree prediction service on http://{host}:{server.sockets[0].getsockname()[1]} "
+          f"({service.workers} workers, batches of up to {service.max_batch})")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Local HTTP prediction service with micro-batching")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--tissue-list", default="../data/tissue_types.txt", help="Path to tissue_types.txt")
+    p.add_argument("--oncotree-base", default="../data/oncotree_tissues", help="Base dir for oncotree mappings")
+    p.add_argument("--model", default="granite4:latest", help="Model name")
+    p.add_argument("--temperature", type=float, default=0.0, help="Model temperature")
+    p.add_argument("--mode", choices=["two-stage", "joint"], default="two-stage")
+    p.add_argument("--prerank-top-k", type=int, default=None, help="Send only the top-K OncoTree names to the LLM")
+    p.add_argument("--embed-model", default=None, help="Ollama embedding model for candidate retrieval")
+    p.add_argument("--tissue-margin", type=float, default=None,
+                   help="With --embed-model, skip the tissue LLM call at this similarity margin")
+    p.add_argument("--fast-path", action="store_true",
+                   help="Skip the LLM when the report already pins an OncoTree name or code")
+    p.add_argument("--compact", action="store_true", help="Compact the tumor JSON before prompting")
+    p.add_argument("--constrained", action="store_true", help="Force answers into the candidate list")
+    p.add_argument("--early-stop", action="store_true", help="Stop reading replies once they name a canonical entry")
+    p.add_argument("--hosts", default=os.environ.get("OLLAMA_HOSTS"),
+                   help="Comma-separated Ollama hosts (default $OLLAMA_HOSTS, else OLLAMA_HOST)")
+    p.add_argument("--per-host-concurrency", type=int, default=None,
+                   help="Max in-flight requests per host (default OLLAMA_NUM_PARALLEL or 4)")
+    p.add_argument("--keep-alive", default=os.environ.get("ONCOTREE_KEEP_ALIVE", "-1"),
+                   help="How long Ollama keeps the model loaded (default: forever while the service runs)")
+    p.add_argument("--cache", default=None, help="SQLite prediction cache path (disabled if omitted)")
+    p.add_argument("--workers", type=int, default=None, help="Predictions running at once (default: pool capacity)")
+    p.add_argument("--max-batch", type=int, default=16, help="Most reports dispatched together")
+    p.add_argument("--batch-window-ms", type=float, default=10.0, help="How long to collect a micro-batch")
+    p.add_argument("--max-queue", type=int, default=256, help="Reports allowed to wait for a worker before 429s")
+    p.add_argument("--per-client", type=int, default=8, help="Outstanding requests allowed per client before 429s")
+    p.add_argument("--max-body-mb", type=float, default=5.0, help="Largest accepted report")
+    args = p.parse_args()
+
+    hosts = tools.parse_hosts(args.hosts) or [os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")]
+    per_host = args.per_host_concurrency or int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4)
+    client = tools.OllamaPool(hosts, max_per_host=per_host)
+    if not client.health_check():
+        print("Warning: no Ollama host answered the health check:", ", ".join(hosts))
+
+    keep_alive = args.keep_alive
+    if keep_alive and keep_alive.lstrip("-").isdigit():
+        keep_alive = int(keep_alive)
+    reference = tools.load_reference(args.tissue_list, args.oncotree_base)
+    if args.fast_path:
+        tools.load_reverse_index(args.tissue_list, args.oncotree_base)
+    if args.embed_model:
+        for tissue in reference.tissues:
+            tools.load_embedding_index(tissue, reference.names(tissue), args.embed_model, client=client)
+    try:
+        warm = tools.warm_up_model(args.model, keep_alive=keep_alive, client=client)
+        print(f"Warm-up: {args.model} ready in {warm['wall_seconds']:.2f}s "
+              f"(load {warm['load_seconds']:.2f}s, {warm['hosts']} host(s)), keep_alive={keep_alive}")
+    except Exception as e:
+        print(f"Warm-up of {args.model} failed:", e)
+
+    settings = {
+        "model": args.model,
+        "temperature": args.temperature,
+        "cache": tools.PredictionCache(args.cache) if args.cache else None,
+        "top_k": args.prerank_top_k,
+        "fast_path": args.fast_path,
+        "mode": args.mode,
+        "compaction": True if args.compact else None,
+        "constrained": args.constrained,
+        "client": client,
+        "keep_alive": keep_alive,
+        "embed_model": args.embed_model,
+        "tissue_margin": args.tissue_margin,
+        "early_stop": args.early_stop,
+    }
+    service = PredictionService(settings, args.tissue_list, args.oncotree_base,
+                                workers=args.workers or per_host * len(hosts), max_batch=args.max_batch,
+                                batch_window=args.batch_window_ms / 1000, max_queue=args.max_queue,
+                                per_client=args.per_client, max_body=int(args.max_body_mb * (1 << 20)))
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.executor.shutdown(wait=False, cancel_futures=True)
+        if settings["cache"] is not None:
+            settings["cache"].close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Lazy readers for tumor JSON inputs: a directory of .json files, a JSONL export
+(optionally gzipped), a .tar / .tar.gz / .tgz or .zip archive, or "-" for JSONL on stdin.
+
+Every reader yields (name, text) pairs one record at a time, where `name` identifies
+the record within the source (file name, "<export>.jsonl:<line>" or the archive
+member path) and `text` is the record's raw JSON. Nothing is extracted to disk and
+only the current record is held in memory.
+
+Readers take an optional `keep(name)` predicate (e.g. shard_filter) that is checked
+before a record's content is read, so skipped files and archive members cost nothing.
+
+A record that can't be read or isn't valid UTF-8 doesn't stop the source: its `text`
+is an UnreadableRecord (an exception, not a str) and the reader moves on, so callers
+can report that one record as failed.
+"""
+import gzip
+import hashlib
+import os
+import sys
+import tarfile
+import zipfile
+import zlib
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson", ".jsonl.gz", ".ndjson.gz")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+# per-record read failures: I/O, decoding, and corrupt compressed members
+READ_ERRORS = (OSError, UnicodeDecodeError, EOFError, zipfile.BadZipFile, zlib.error)
+
+
+class UnreadableRecord(Exception):
+    """
+    Yielded in place of a record's text when it couldn't be read or decoded.
+    """
+
+
+def read_text(name, read):
+    """
+    read() decoded as UTF-8, or an UnreadableRecord describing why it failed.
+    """
+    try:
+        return read().decode("utf-8")
+    except READ_ERRORS as e:
+        return UnreadableRecord(f"{name}: {type(e).__name__}: {e}")
+
+
+def iter_directory(path, ext = ".json", keep = None):
+    """
+    Files with the given extension in a directory, in name order. Only the names are
+    listed up front; each file is read when its record is requested.
+    """
+    names = sorted(e.name for e in os.scandir(path) if e.is_file() and e.name.lower().endswith(ext.lower()))
+    for name in names:
+        if keep is not None and not keep(name):
+            continue
+        yield name, read_text(name, lambda: _read_bytes(os.path.join(path, name)))
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_file(path, keep = None):
+    name = os.path.basename(path)
+    if keep is not None and not keep(name):
+        return
+    yield name, read_text(name, lambda: _read_bytes(path))
+
+
+def iter_jsonl_stream(stream, label, keep = None):
+    """
+    One record per non-blank line of a text or binary stream; named "<label>:<line number>".
+    Binary lines are decoded one at a time, so a bad line only affects its own record.
+    If the stream itself breaks (e.g. a truncated .gz), that line's record is unreadable
+    and the stream ends there.
+    """
+    lineno = 0
+    lines = iter(stream)
+    while True:
+        lineno += 1
+        name = f"{label}:{lineno}"
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        except READ_ERRORS as e:
+            yield name, UnreadableRecord(f"{name}: {type(e).__name__}: {e}")
+            return
+        if keep is not None and not keep(name):
+            continue
+        if isinstance(line, bytes):
+            line = read_text(name, lambda: line)
+            if isinstance(line, UnreadableRecord):
+                yield name, line
+                continue
+        line = line.strip()
+        if line:
+            yield name, line
+
+
+def iter_jsonl(path, keep = None):
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rb") as f:
+        yield from iter_jsonl_stream(f, os.path.basename(path), keep)
+
+
+def iter_tar(path, ext = ".json", keep = None):
+    """
+    Members with the given extension from a (compressed) tar archive, read in stream
+    mode in archive order; other members (labels, manifests) are skipped.
+    """
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(ext.lower()):
+                continue
+            if keep is not None and not keep(member.name):
+                continue
+            with archive.extractfile(member) as f:
+                yield member.name, read_text(member.name, f.read)
+
+
+def iter_zip(source, ext = ".json", keep = None):
+    """
+    Members with the given extension from a zip archive (a path or binary file object),
+    in archive order; directories and other members are skipped.
+    """
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(ext.lower()):
+                continue
+            if keep is not None and not keep(info.filename):
+                continue
+            yield info.filename, read_text(info.filename, lambda: _read_member(archive, info))
+
+
+def _read_member(archive, info):
+    with archive.open(info) as f:
+        return f.read()
+
+
+def parse_shard(text):
+    """
+    Parse "i/N" (0 <= i < N) into (i, N); raises ValueError otherwise.
+    """
+    try:
+        index, count = (int(x) for x in text.split("/"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Shard must look like i/N, e.g. 0/4: {text!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..N-1: {text!r}")
+    return index, count
+
+
+def shard_of(name, count):
+    """
+    Stable shard number for a record name (the same on every machine and process, unlike hash()).
+    """
+    digest = hashlib.sha1(name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_filter(index, count):
+    """
+    `keep` predicate for shard `index` of `count`. Records are assigned by name (file name,
+    "<export>.jsonl:<line>" or archive member), so independent processes over the same
+    source split it between them with no coordination.
+    """
+    return lambda name: shard_of(name, count) == index
+
+
+def iter_records(source, ext = ".json", keep = None):
+    """
+    Pick the reader for `source` (directory, JSONL, tar or zip archive, or "-" for stdin).
+    Raises FileNotFoundError for a missing path and ValueError for an unknown file type.
+    """
+    if source == "-":
+        return iter_jsonl_stream(sys.stdin.buffer, "stdin", keep)
+    if os.path.isdir(source):
+        return iter_directory(source, ext, keep)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Input not found: {source}")
+    lower = source.lower()
+    if lower.endswith(JSONL_SUFFIXES):
+        return iter_jsonl(source, keep)
+    if lower.endswith(TAR_SUFFIXES):
+        return iter_tar(source, ext, keep)
+    if lower.endswith(".zip"):
+        return iter_zip(source, ext, keep)
+    if lower.endswith(ext.lower()):
+        return iter_file(source, keep)
+    raise ValueError(f"Unsupported input (expected a directory, .jsonl[.gz], .tar[.gz], .zip or '-'): {source}")
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Ollama HTTP API, for offline benchmarking of the pipeline.
+
+Serves /api/chat (streaming and non-streaming, honours `format`), /api/generate,
+/api/embed, /api/tags, /api/ps and /api/version. Latency is simulated from
+configurable prefill/generation tokens-per-second, a parallel-slot limit
+(like OLLAMA_NUM_PARALLEL) and a model load time that is paid again once a
+model's keep-alive window has expired. Answers are drawn from the candidate list in the
+prompt: a candidate that appears verbatim in the tumor JSON wins, otherwise
+one is picked deterministically from a hash of the prompt. "Weak" models guess
+(hash-chosen answer, low token logprob margin) on a fraction of prompts, and
+per-model latency multipliers make some models slower, for cascade experiments.
+
+Usage:
+    python stub_ollama_server.py --port 11435 --prefill-tps 2000 --gen-tps 40 --parallel 4
+    OLLAMA_HOST=127.0.0.1:11435 python test_models.py ...
+"""
+import argparse
+import ast
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def estimate_tokens(text):
+    return max(1, (len(text or "") + 3) // 4)
+
+
+def extract_candidates(system_prompt, user_prompt):
+    """
+    Recover the candidate list from one of the pipeline's prompts
+    (names, tissues or joint), or [] if none is recognised.
+    """
+    if "Oncotree Names:\n" in user_prompt:
+        names = user_prompt.split("Oncotree Names:\n", 1)[1].split("\n\nTumor Sample JSON:", 1)[0]
+        return [n.strip() for n in names.split("$") if n.strip()]
+    if "LIST OF ENTRIES:" in system_prompt:
+        entries = system_prompt.split("LIST OF ENTRIES:", 1)[1]
+        return [e.strip() for e in entries.split("$") if e.strip()]
+    if "LIST OF TISSUES:" in system_prompt:
+        listing = system_prompt.split("LIST OF TISSUES:", 1)[1].strip()
+        try:
+            return [str(t) for t in ast.literal_eval(listing)]
+        except (ValueError, SyntaxError):
+            return [t.strip(" '\"[]") for t in listing.split(",") if t.strip(" '\"[]")]
+    return []
+
+
+def pick_answer(candidates, system_prompt, user_prompt):
+    """
+    Deterministic canned answer: the longest candidate (or the name part of a joint
+    "Tissue :: Name" entry) that appears in the prompt text, else a hash-chosen one.
+    """
+    if not candidates:
+        return "Unknown"
+    tumor_text = user_prompt.split("Tumor Sample JSON:", 1)[-1].lower()
+    hits = [c for c in candidates if c.split(" :: ")[-1].lower() in tumor_text]
+    if hits:
+        return max(hits, key=len)
+    digest = hashlib.sha256((system_prompt + user_prompt).encode("utf-8")).digest()
+    return candidates[int.from_bytes(digest[:4], "big") % len(candidates)]
+
+
+def prompt_fraction(system_prompt, user_prompt, salt = ""):
+    """
+    Deterministic pseudo-random number in [0, 1) for a prompt.
+    """
+    digest = hashlib.sha256((salt + system_prompt + user_prompt).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def fake_logprobs(pieces, margin):
+    """
+    Ollama-style per-token logprobs with top_logprobs=2; the first token's runner-up is
+    `margin` nats behind, the rest are near-certain.
+    """
+    entries = []
+    for i, piece in enumerate(pieces):
+        gap = margin if i == 0 else 8.0
+        entries.append({"token": piece, "logprob": -0.01,
+                        "top_logprobs": [{"token": piece, "logprob": -0.01}, {"token": "~", "logprob": -0.01 - gap}]})
+    return entries
+
+
+def fake_embedding(text, dim):
+    """
+    Cheap deterministic bag-of-words embedding so similar texts get similar vectors.
+    """
+    vec = [0.0] * dim
+    for token in text.lower().split():
+        h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "big")
+        vec[h % dim] += 1.0
+    return vec
+
+
+def parse_keep_alive(value, default):
+    """
+    Seconds for an Ollama keep_alive value ("30m", "1h", "10s", 300, -1 = forever), or default.
+    """
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    text = str(value).strip()
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    for suffix in ("ms", "s", "m", "h"):
+        if text.endswith(suffix):
+            number = float(text[:-len(suffix)])
+            return float("inf") if number < 0 else number * units[suffix]
+    number = float(text)
+    return float("inf") if number < 0 else number
+
+
+class StubState:
+    """
+    Server-wide settings, the parallel-slot semaphore and request counters.
+    """
+
+    def __init__(self, prefill_tps, gen_tps, parallel, load_seconds, chatter_tokens, models, embed_dim,
+                 keep_alive_seconds = 300.0, model_scale = None, weak_models = (), weak_rate = 0.0):
+        self.prefill_tps = prefill_tps
+        self.gen_tps = gen_tps
+        self.load_seconds = load_seconds
+        self.chatter_tokens = chatter_tokens
+        self.models = models
+        self.embed_dim = embed_dim
+        self.keep_alive_seconds = keep_alive_seconds
+        self.model_scale = dict(model_scale or {})
+        self.weak_models = set(weak_models)
+        self.weak_rate = weak_rate
+        self.slots = threading.Semaphore(parallel)
+        self.lock = threading.Lock()
+        self.loaded = {}  # model -> unload time
+        self.requests = 0
+
+    def load_model(self, model, keep_alive = None):
+        """
+        Seconds of simulated load time: paid when the model isn't loaded, i.e. on first
+        use or after its keep-alive window (request keep_alive, else the server default) ran out.
+        """
+        now = time.time()
+        with self.lock:
+            self.requests += 1
+            cold = self.loaded.get(model, 0.0) <= now
+            self.loaded[model] = now + parse_keep_alive(keep_alive, self.keep_alive_seconds)
+        return self.load_seconds if cold else 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # set by make_server()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m, "size": 0, "digest": "stub"} for m in self.state.models]})
+        elif self.path == "/api/ps":
+            now = time.time()
+            loaded = sorted(m for m, until in self.state.loaded.items() if until > now)
+            self._send_json({"models": [{"name": m, "model": m} for m in loaded]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "stub"})
+        elif self.path == "/":
+            self._send_json({"status": "Ollama is running"})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json({"error": "invalid JSON"}, status=400)
+            return
+        if self.path in ("/api/chat", "/api/generate") and body.get("model") not in self.state.models:
+            # like Ollama: an unknown model is a 404 from a healthy server
+            self._send_json({"error": f"model '{body.get('model')}' not found"}, status=404)
+            return
+        if self.path == "/api/chat":
+            self._chat(body)
+        elif self.path == "/api/generate":
+            self._generate(body)
+        elif self.path in ("/api/embed", "/api/embeddings"):
+            self._embed(body)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, body):
+        # used by warm-up calls: load the model, generate nothing
+        load = self.state.load_model(body.get("model", ""), body.get("keep_alive"))
+        time.sleep(load)
+        self._send_json({
+            "model": body.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": "",
+            "done": True,
+            "done_reason": "load",
+            "load_duration": int(load * 1e9),
+            "total_duration": int(load * 1e9),
+        })
+
+    def _embed(self, body):
+        inputs = body.get("input", body.get("prompt", ""))
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(sum(estimate_tokens(t) for t in inputs) / self.state.prefill_tps)
+        vectors = [fake_embedding(t, self.state.embed_dim) for t in inputs]
+        self._send_json({"model": body.get("model", ""), "embeddings": vectors})
+
+    def _chat(self, body):
+        model = body.get("model", "")
+        messages = body.get("messages") or []
+        system_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+        candidates = extract_candidates(system_prompt, user_prompt)
+        answer = pick_answer(candidates, system_prompt, user_prompt)
+        margin = 4.0
+        if model in self.state.weak_models and prompt_fraction(system_prompt, user_prompt, model) < self.state.weak_rate:
+            answer = pick_answer(candidates, system_prompt, "")  # a guess
+            margin = 0.1
+        if body.get("format"):
+            answer = json.dumps({"answer": answer})
+        elif self.state.chatter_tokens:
+            answer += "\n\nExplanation:" + " because" * self.state.chatter_tokens
+        num_predict = (body.get("options") or {}).get("num_predict")
+
+        prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        pieces = [answer[i:i + 4] for i in range(0, len(answer), 4)] or [""]
+        if num_predict:
+            pieces = pieces[:int(num_predict)]
+        logprobs = fake_logprobs(pieces, margin) if body.get("logprobs") else None
+        scale = self.state.model_scale.get(model, 1.0)
+
+        with self.state.slots:
+            load = self.state.load_model(model, body.get("keep_alive"))
+            prefill = prompt_tokens / self.state.prefill_tps * scale
+            time.sleep(load + prefill)
+            if body.get("stream", True):
+                self._stream_chat(model, pieces, prompt_tokens, load, prefill, scale, logprobs)
+                return
+            gen = len(pieces) / self.state.gen_tps * scale
+            time.sleep(gen)
+        final = self._final(model, "".join(pieces), prompt_tokens, len(pieces), load, prefill, gen)
+        if logprobs is not None:
+            final["logprobs"] = logprobs
+        self._send_json(final)
+
+    def _stream_chat(self, model, pieces, prompt_tokens, load, prefill, scale = 1.0, logprobs = None):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.perf_counter()
+        try:
+            for i, piece in enumerate(pieces):
+                time.sleep(scale / self.state.gen_tps)
+                chunk = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                         "message": {"role": "assistant", "content": piece}, "done": False}
+                if logprobs is not None:
+                    chunk["logprobs"] = logprobs[i:i + 1]
+                self._chunk(chunk)
+            gen = time.perf_counter() - started
+            self._chunk(self._final(model, "", prompt_tokens, len(pieces), load, prefill, gen))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # client closed the stream early
+            self.close_connection = True
+
+    def _chunk(self, obj):
+        data = json.dumps(obj).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def _final(model, content, prompt_tokens, gen_tokens, load, prefill, gen):
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((load + prefill + gen) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": gen_tokens,
+            "eval_duration": int(gen * 1e9),
+        }
+
+
+def make_server(host = "127.0.0.1", port = 11435, prefill_tps = 2000.0, gen_tps = 40.0, parallel = 4,
+                load_seconds = 0.0, chatter_tokens = 0, models = ("stub:latest",), embed_dim = 64,
+                keep_alive_seconds = 300.0, model_scale = None, weak_models = (), weak_rate = 0.0):
+    """
+    Build (but don't start) a stub server. Use port=0 for a free port (see server.server_address).
+    """
+    state = StubState(prefill_tps, gen_tps, parallel, load_seconds, chatter_tokens, list(models), embed_dim,
+                      keep_alive_seconds, model_scale, weak_models, weak_rate)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(**kwargs):
+    """
+    Start a stub server on a daemon thread and return it; its address is "host:port".
+    """
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    server.address = f"{host}:{port}"
+    return server
+
+
+def main():
+    p = argparse.ArgumentParser(description="Stub Ollama server for offline benchmarks")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11435)
+    p.add_argument("--prefill-tps", type=float, default=2000.0, help="Simulated prompt tokens/sec")
+    p.add_argument("--gen-tps", type=float, default=40.0, help="Simulated generated tokens/sec")
+    p.add_argument("--parallel", type=int, default=4, help="Concurrent request slots (like OLLAMA_NUM_PARALLEL)")
+    p.add_argument("--load-seconds", type=float, default=0.0, help="Simulated model load time on first use")
+    p.add_argument("--chatter-tokens", type=int, default=0, help="Append this many tokens of rambling after the answer")
+    p.add_argument("--models", default="stub:latest", help="Comma-separated model names to advertise")
+    p.add_argument("--keep-alive", type=float, default=300.0,
+                   help="Default seconds a model stays loaded after a request (like OLLAMA_KEEP_ALIVE)")
+    p.add_argument("--model-scale", default="",
+                   help="Comma-separated model=factor latency multipliers, e.g. big:latest=4 (a slower, larger model)")
+    p.add_argument("--weak-models", default="", help="Comma-separated models that sometimes guess with low confidence")
+    p.add_argument("--weak-rate", type=float, default=0.2, help="Fraction of prompts a weak model guesses on")
+    args = p.parse_args()
+
+    model_scale = {}
+    for item in args.model_scale.split(","):
+        if "=" in item:
+            name, factor = item.rsplit("=", 1)
+            model_scale[name.strip()] = float(factor)
+    server = make_server(args.host, args.port, args.prefill_tps, args.gen_tps, args.parallel,
+                         args.load_seconds, args.chatter_tokens, [m.strip() for m in args.models.split(",") if m.strip()],
+                         keep_alive_seconds=args.keep_alive, model_scale=model_scale,
+                         weak_models=[m.strip() for m in args.weak_models.split(",") if m.strip()],
+                         weak_rate=args.weak_rate)
+    print(f"Stub Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
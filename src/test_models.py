@@ -2,102 +2,850 @@
 import argparse
 import json
 import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import ollama
 import oncotree_utils as tools
+import record_sources
 
 def get_test_order_id(parsed, filename):
     return parsed.get("test_order_id") 
 
-def process_file(path, tissue_list, oncotree_base, model, temperature):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            parsed = json.load(f)
-    except Exception:
-        parsed = {}
+def record_error(details, exc):
+    """
+    Note a prediction failure (as opposed to a model "Unknown") so --resume retries the record.
+    """
+    if details is not None:
+        details.setdefault("errors", []).append(repr(exc))
+
 
-    test_order_id = get_test_order_id(parsed, path)
+def salvage(answer, candidates, details, stage):
+    """
+    Map a near-miss answer onto the canonical list (oncotree_utils.salvage_answer).
+    Returns the canonical match if accepted, else None; the result and any
+    non-exact match are recorded in `details` for the rationale and run summary.
+    """
+    result = tools.salvage_answer(answer, candidates)
+    if details is not None:
+        details.setdefault("salvage", {})[stage] = dict(result, raw=answer)
+        if result["status"] in ("normalized", "fuzzy"):
+            details.setdefault("flags", []).append(
+                f"{stage} salvaged from model output {answer!r} (score {result['score']:.2f})")
+        elif result["status"] == "borderline":
+            details.setdefault("flags", []).append(
+                f"borderline {stage} match {result['match']!r} for model output {answer!r} "
+                f"(score {result['score']:.2f}); needs review")
+    if result["status"] in ("exact", "normalized", "fuzzy"):
+        return result["match"]
+    return None
 
+
+def predict_two_stage(tumor_json, tissue_list, oncotree_base, model, temperature, cache=None, top_k=None, details=None,
+                      fast_path=False, compaction=None, constrained=False, client=None, keep_alive=None,
+                      embed_model=None, tissue_margin=None, ensemble=None, quorum=None, cascade=None,
+                      min_margin=None, early_stop=False):
+    """
+    Tissue first, then OncoTree name within that tissue (two LLM calls) for a raw tumor JSON string.
+    With a list of `ensemble` models each stage is voted across them instead of asking `model`
+    (see tools.ensemble_vote; the vote is in the stage's details["ensemble"]).
+    With a `cascade` list (smallest model first) each stage escalates to the next model only
+    when needed (see tools.cascade_predict; recorded in the stage's details["cascade"]).
+    """
     # predict tissue
+    tissue_details = {}
+    tissue_kwargs = dict(
+        tissue_list_path=tissue_list,
+        tumor_json=tumor_json,
+        temperature=temperature,
+        cache=cache,
+        details=tissue_details,
+        fast_path=fast_path,
+        data_base_path=oncotree_base,
+        compaction=compaction,
+        constrained=constrained,
+        client=client,
+        keep_alive=keep_alive,
+        embed_model=embed_model,
+        tissue_margin=tissue_margin,
+        early_stop=early_stop,
+    )
     try:
-        tissue = tools.predict_tissue_from_list(
-            tissue_list_path=tissue_list,
-            tumor_json_path=path,
-            model=model,
-            temperature=temperature,
-        ).strip()
-    except Exception:
+        if ensemble:
+            tissue = tools.ensemble_predict_tissue(ensemble, quorum=quorum, **tissue_kwargs).strip()
+        elif cascade:
+            tissue = tools.cascade_predict_tissue(cascade, min_margin=min_margin, **tissue_kwargs).strip()
+        else:
+            tissue = tools.predict_tissue_from_list(model=model, **tissue_kwargs).strip()
+    except Exception as e:
         tissue = "none"
+        record_error(details, e)
     if not tissue or tissue.lower() == "unknown":
         tissue = "none"
+    reference = tools.load_reference(tissue_list, oncotree_base)
+    if tissue != "none":
+        tissue = salvage(tissue, reference.tissues, details, "tissue") or "none"
 
-    # predict oncotree name
+    # predict oncotree name (nothing to ask without a tissue)
+    name_details = {}
+    name_start = time.perf_counter()
     try:
-        onco_name = tools.predict_oncotree_name_from_tissue(
+        if tissue == "none":
+            raise LookupError("no tissue")
+        name_kwargs = dict(
             tissue_name=tissue,
-            tumor_json_path=path,
-            model=model,
+            tumor_json=tumor_json,
             temperature=temperature,
             data_base_path=oncotree_base,
-        ).strip()
-    except Exception:
+            cache=cache,
+            top_k=top_k,
+            details=name_details,
+            fast_path=fast_path,
+            tissue_list_path=tissue_list,
+            compaction=compaction,
+            constrained=constrained,
+            client=client,
+            keep_alive=keep_alive,
+            embed_model=embed_model,
+            early_stop=early_stop,
+        )
+        if ensemble:
+            onco_name = tools.ensemble_predict_oncotree_name(models=ensemble, quorum=quorum, **name_kwargs).strip()
+        elif cascade:
+            onco_name = tools.cascade_predict_oncotree_name(models=cascade, min_margin=min_margin,
+                                                            **name_kwargs).strip()
+        else:
+            onco_name = tools.predict_oncotree_name_from_tissue(model=model, **name_kwargs).strip()
+    except LookupError:
         onco_name = "none"
+    except Exception as e:
+        onco_name = "none"
+        record_error(details, e)
+    if tissue != "none" and onco_name and onco_name.lower() not in ("none", "unknown"):
+        # keep the raw answer when it can't be salvaged (it then maps to code "none")
+        onco_name = salvage(onco_name, reference.names(tissue), details, "name") or onco_name
+    if details is not None:
+        details["tissue"] = tissue
+        details["name_seconds"] = time.perf_counter() - name_start
+        details.update(name_details)
+        for key in ("json_tokens_before", "json_tokens_after"):
+            if key in tissue_details:
+                details.setdefault(key, tissue_details[key])
+        details["tissue_path"] = tissue_details.get("path", "llm")
+        details["name_path"] = name_details.get("path", "llm")
+        details.setdefault("stages", {}).update({"tissue": tissue_details, "name": name_details})
+    return tissue, onco_name
+
+
+def predict_joint(tumor_json, tissue_list, oncotree_base, model, temperature, cache=None, details=None, fast_path=False,
+                  compaction=None, constrained=False, client=None, keep_alive=None, early_stop=False):
+    """
+    Tissue and OncoTree name from a single LLM call for a raw tumor JSON string.
+    """
+    joint_details = {}
+    try:
+        tissue, onco_name = tools.predict_tissue_and_name(
+            tissue_list_path=tissue_list,
+            tumor_json=tumor_json,
+            model=model,
+            temperature=temperature,
+            data_base_path=oncotree_base,
+            cache=cache,
+            details=joint_details,
+            fast_path=fast_path,
+            compaction=compaction,
+            constrained=constrained,
+            client=client,
+            keep_alive=keep_alive,
+            early_stop=early_stop,
+        )
+    except Exception as e:
+        tissue, onco_name = "none", "none"
+        record_error(details, e)
+    if tissue.lower() == "unknown":
+        tissue, onco_name = "none", "none"
+    if details is not None:
+        details["tissue"] = tissue
+        details["tissue_path"] = details["name_path"] = joint_details.get("path", "llm")
+        details.setdefault("stages", {})["joint"] = joint_details
+        if "salvage" in joint_details:
+            details.setdefault("salvage", {})["joint"] = joint_details["salvage"]
+            if joint_details["salvage"]["status"] in ("normalized", "fuzzy"):
+                details.setdefault("flags", []).append(
+                    f"joint answer salvaged from model output {joint_details['raw']!r} "
+                    f"(score {joint_details['salvage']['score']:.2f})")
+        for key in ("json_tokens_before", "json_tokens_after"):
+            if key in joint_details:
+                details[key] = joint_details[key]
+    return tissue, onco_name
+
+
+def process_file(path, *args, **kwargs):
+    """
+    Predict one tumor JSON file and return the output record (see process_record).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        tumor_json = f.read()
+    return process_record(os.path.basename(path), tumor_json, *args, **kwargs)
+
+
+def process_record(name, tumor_json, tissue_list, oncotree_base, model, temperature, cache=None, top_k=None,
+                   details=None, fast_path=False, mode="two-stage", compaction=None, constrained=False, client=None,
+                   keep_alive=None, embed_model=None, tissue_margin=None, ensemble=None, quorum=None, cascade=None,
+                   min_margin=None, early_stop=False):
+    """
+    Predict one tumor record (raw JSON text; `name` identifies it in its source) and return
+    the output record. The text is parsed once here and passed on as-is, never re-read.
+    A record the source couldn't read (record_sources.UnreadableRecord) is raised here,
+    so the caller writes its usual failure row.
+    mode is "two-stage", "joint", or "compare" (both; the two-stage answer is written and
+    the joint answer plus timings are recorded in `details` for the run summary).
+    `client` (ollama.Client / OllamaPool) overrides the default Ollama host and
+    `keep_alive` is passed to Ollama with every request.
+    `embed_model` / `tissue_margin` enable embedding retrieval in the two-stage flow
+    (see predict_tissue_from_list and predict_oncotree_name_from_tissue).
+    `ensemble` (list of models) / `quorum` vote each two-stage step across several models;
+    the output's confidence is then their agreement (see record_confidence).
+    `cascade` (list of models, smallest first) / `min_margin` run each step small-model-first.
+    early_stop=True stops reading each reply once it names a canonical entry.
+    """
+    if isinstance(tumor_json, record_sources.UnreadableRecord):
+        raise tumor_json
+    try:
+        parsed = json.loads(tumor_json)
+    except ValueError:
+        parsed = {}
+    if not isinstance(parsed, dict):
+        parsed = {}
+
+    test_order_id = get_test_order_id(parsed, name)
+
+    if details is None:
+        details = {}
+    if mode == "joint":
+        tissue, onco_name = predict_joint(tumor_json, tissue_list, oncotree_base, model, temperature,
+                                          cache=cache, details=details, fast_path=fast_path, compaction=compaction,
+                                          constrained=constrained, client=client, keep_alive=keep_alive,
+                                          early_stop=early_stop)
+    else:
+        stage_start = time.perf_counter()
+        tissue, onco_name = predict_two_stage(tumor_json, tissue_list, oncotree_base, model, temperature,
+                                              cache=cache, top_k=top_k, details=details, fast_path=fast_path,
+                                              compaction=compaction, constrained=constrained, client=client,
+                                              keep_alive=keep_alive, embed_model=embed_model,
+                                              tissue_margin=tissue_margin, ensemble=ensemble, quorum=quorum,
+                                              cascade=cascade, min_margin=min_margin, early_stop=early_stop)
+        if mode == "compare":
+            details["two_stage_seconds"] = time.perf_counter() - stage_start
+            joint_start = time.perf_counter()
+            joint_tissue, joint_name = predict_joint(tumor_json, tissue_list, oncotree_base, model, temperature,
+                                                     cache=cache, details={}, fast_path=fast_path,
+                                                     compaction=compaction, constrained=constrained, client=client,
+                                                     keep_alive=keep_alive, early_stop=early_stop)
+            details["joint_seconds"] = time.perf_counter() - joint_start
+            details["joint_tissue"], details["joint_name"] = joint_tissue, joint_name
     if not onco_name:
         onco_name = "none"
+    details["name"] = onco_name
 
     # map name -> code
+    validate_started = time.perf_counter()
     onco_code = "none"
     if tissue and onco_name:
         try:
-            mapping = tools.load_oncotree_name_to_code(tissue_name=tissue, data_base_path=oncotree_base)
-            onco_code = mapping.get(onco_name, "none") or "none"
+            reference = tools.load_reference(tissue_list, oncotree_base)
+            onco_code = reference.code(tissue, onco_name) or "none"
         except Exception:
             onco_code = "none"
+    details["validate_seconds"] = time.perf_counter() - validate_started
 
     return {
         "oncotree_tissue": tissue,
         "oncotree_code": onco_code,
         "oncotree_name": onco_name,
         "test_order_id": test_order_id,
-        "confidence": 5, # placeholder confidence
-        "rationale": "" # placeholder rationale
+        "confidence": record_confidence(details),
+        "rationale": "; ".join(details.get("flags", [])) # salvage / review notes
 
     }
 
+
+def record_confidence(details):
+    """
+    1-5 confidence for an output record: the ensemble agreement of its least agreed-on
+    stage (see tools.agreement_confidence), or 5 when no ensemble voted.
+    """
+    agreements = [stage["ensemble"]["agreement"] for stage in details.get("stages", {}).values()
+                  if "ensemble" in stage]
+    return tools.agreement_confidence(min(agreements)) if agreements else 5
+
+def default_workers(hosts=1):
+    """
+    Default worker count: the server's parallel-slot limit (OLLAMA_NUM_PARALLEL) if set, else 1,
+    times the number of hosts. Requests beyond the servers' slots just queue inside Ollama,
+    so going higher buys nothing.
+    """
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "1"))) * max(1, hosts)
+    except ValueError:
+        return max(1, hosts)
+
+
+def make_client(hosts, per_host_concurrency = None):
+    """
+    Ollama client for the --hosts list: an OllamaPool balancing several hosts (or one host
+    with a --per-host-concurrency cap), a plain ollama.Client for a single host, and None
+    (the default client, OLLAMA_HOST) when no host is given.
+    """
+    if len(hosts) > 1 or per_host_concurrency:
+        per_host = per_host_concurrency or int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4)
+        return tools.OllamaPool(hosts or [os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")], max_per_host=per_host)
+    if hosts:
+        return ollama.Client(host=hosts[0])
+    return None
+
+def run_ordered(fn, items, workers):
+    """
+    Apply fn to each item on a thread pool and yield (item, result) in input order.
+    At most `workers` items are in flight at any time, so a large input never
+    piles up thousands of pending requests against the Ollama server.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(fn, item)))
+            if len(pending) >= workers:
+                head, fut = pending.popleft()
+                yield head, fut.result()
+        while pending:
+            head, fut = pending.popleft()
+            yield head, fut.result()
+
+
+SUMMARY_SAMPLE_SIZE = 20_000
+
+
+def sample_record(sample, details, seen, rng, size=SUMMARY_SAMPLE_SIZE):
+    """
+    Reservoir-sample per-record details for the run summary, so memory stays bounded
+    however large the input is (every record is kept while seen <= size).
+    """
+    if len(sample) < size:
+        sample.append(details)
+    else:
+        slot = rng.randrange(seen)
+        if slot < size:
+            sample[slot] = details
+
+
+def summarize_prerank(per_record, tissue_list, oncotree_base):
+    """
+    Print, per tissue, how many names were sent vs. the full list, the approximate
+    prompt-token saving of the candidate list and the mean name-prediction latency.
+    """
+    by_tissue = {}
+    for d in per_record:
+        if "candidates_sent" in d:
+            by_tissue.setdefault(d["tissue"], []).append(d)
+    if not by_tissue:
+        return
+    print("Tissue                      records  names sent/full  ~prompt tokens  mean name latency")
+    for tissue in sorted(by_tissue):
+        rows = by_tissue[tissue]
+        full = len(tools.load_reference(tissue_list, oncotree_base).names(tissue))
+        sent = sum(d["candidates_sent"] for d in rows) / len(rows)
+        tokens = sum(d["prompt_chars"] for d in rows) / len(rows) / 4
+        latency = sum(d["name_seconds"] for d in rows) / len(rows)
+        print(f"{tissue:<28}{len(rows):>7}  {sent:>7.1f}/{full:<7}  {tokens:>14.0f}  {latency:>16.2f}s")
+
+
+def summarize_paths(per_record):
+    """
+    Print how many tissue/name predictions skipped the LLM (rule fast path or a decisive
+    embedding tissue ranking).
+    """
+    calls = sum(1 for d in per_record for k in ("tissue_path", "name_path") if k in d)
+    if not calls:
+        return
+    avoided = sum(1 for d in per_record for k in ("tissue_path", "name_path") if d.get(k, "llm") != "llm")
+    embedding = sum(1 for d in per_record if d.get("tissue_path") == "embedding")
+    print(f"Fast path: {avoided}/{calls} LLM calls avoided ({avoided / calls:.0%})"
+          + (f", {embedding} tissue(s) by embedding margin" if embedding else ""))
+
+
+def summarize_ensemble(per_record):
+    """
+    Print mean ensemble agreement per stage (over the answers received) and how often a
+    quorum cut the vote short.
+    """
+    for name in ("tissue", "name"):
+        votes = [d["stages"][name]["ensemble"] for d in per_record if "ensemble" in d.get("stages", {}).get(name, {})]
+        if not votes:
+            continue
+        agreement = sum(v["agreement"] for v in votes) / len(votes)
+        unanimous = sum(1 for v in votes if v["votes"] == v["answered"])
+        short = sum(1 for v in votes if v["short_circuit"])
+        print(f"Ensemble {name:<6}: mean agreement {agreement:.0%} over {len(votes)} votes, "
+              f"{unanimous} unanimous among the models that answered, "
+              f"{short} short-circuited by quorum ({short / len(votes):.0%})")
+
+
+def summarize_cascade(per_record, models):
+    """
+    Print per-stage escalation rates and the cascade's LLM time against an estimate of
+    sending every call to the last (largest) model, from that model's mean call time.
+    """
+    stages = [d["stages"][name] for d in per_record for name in ("tissue", "name")
+              if "cascade" in d.get("stages", {}).get(name, {})]
+    if not stages:
+        return
+    for name in ("tissue", "name"):
+        rows = [d["stages"][name]["cascade"] for d in per_record if "cascade" in d.get("stages", {}).get(name, {})]
+        if not rows:
+            continue
+        escalated = sum(1 for c in rows if c["escalations"])
+        answered = {}
+        reasons = {}
+        for c in rows:
+            answered[c["answered_by"]] = answered.get(c["answered_by"], 0) + 1
+            for reason in c["reasons"]:
+                reasons[reason] = reasons.get(reason, 0) + 1
+        print(f"Cascade {name:<6}: {escalated}/{len(rows)} escalated ({escalated / len(rows):.0%}); answered by "
+              + ", ".join(f"{m} {answered.get(m, 0)}" for m in models)
+              + (" | " + ", ".join(f"{r} {n}" for r, n in sorted(reasons.items())) if reasons else ""))
+    llm_stages = [st for st in stages if any((m.get("llm") or {}).get("wall_seconds") for m in st["models"].values())]
+    spent = sum(m["llm"]["wall_seconds"] for st in llm_stages for m in st["models"].values()
+                if (m.get("llm") or {}).get("wall_seconds"))
+    largest = [st["models"][models[-1]]["llm"]["wall_seconds"] for st in llm_stages
+               if (st["models"].get(models[-1], {}).get("llm") or {}).get("wall_seconds")]
+    if not largest or not spent:
+        print(f"Cascade: no uncached {models[-1]} calls to compare against; run with --model {models[-1]} for a baseline")
+        return
+    baseline = sum(largest) / len(largest) * len(llm_stages)
+    print(f"Cascade LLM time: {spent:.1f}s vs ~{baseline:.1f}s if {models[-1]} answered all {len(llm_stages)} calls "
+          f"({baseline / spent:.1f}x throughput)")
+
+
+def summarize_compaction(per_record):
+    """
+    Print estimated tumor-JSON prompt tokens before and after compaction.
+    """
+    rows = [d for d in per_record if "json_tokens_before" in d]
+    if not rows:
+        return
+    before = sum(d["json_tokens_before"] for d in rows)
+    after = sum(d["json_tokens_after"] for d in rows)
+    saved = 1 - after / before if before else 0.0
+    print(f"Compaction: ~{before / len(rows):.0f} -> ~{after / len(rows):.0f} tumor JSON tokens per prompt ({saved:.0%} fewer)")
+
+
+def summarize_latency(per_record):
+    """
+    Print record latency percentiles and, per stage, LLM call latency and token throughput.
+    """
+    seconds = [d["record_seconds"] for d in per_record if "record_seconds" in d]
+    if not seconds:
+        return
+    print(f"Record latency: p50 {tools.percentile(seconds, 50):.2f}s, p95 {tools.percentile(seconds, 95):.2f}s, "
+          f"p99 {tools.percentile(seconds, 99):.2f}s")
+    stage_names = sorted({name for d in per_record for name in d.get("stages", {})})
+    for name in stage_names:
+        stages = [d["stages"][name] for d in per_record if name in d.get("stages", {})]
+        summary = tools.summarize_llm_metrics([st.get("llm") for st in stages])
+        if not summary["calls"]:
+            continue
+        prompt_s = sum(st.get("prompt_seconds", 0.0) for st in stages) / len(stages)
+        print(f"  {name:<7} {summary['calls']} LLM calls: p50 {summary['p50_seconds']:.2f}s, "
+              f"p95 {summary['p95_seconds']:.2f}s, p99 {summary['p99_seconds']:.2f}s | "
+              f"{summary['prompt_tokens'] / summary['calls']:.0f} prompt + "
+              f"{summary['generated_tokens'] / summary['calls']:.0f} generated tokens/call | "
+              f"prefill {summary['prefill_tokens_per_sec']:.0f} tok/s, "
+              f"generation {summary['generation_tokens_per_sec']:.0f} tok/s | "
+              f"load {summary['load_seconds']:.1f}s total | prompt build {prompt_s * 1000:.1f}ms")
+    all_calls = [st.get("llm") for d in per_record for st in d.get("stages", {}).values()]
+    early = sum(1 for m in all_calls if m and m.get("early_stop"))
+    if early:
+        print(f"  early   {early} replies cut short once they named a canonical entry")
+    warm_cold = tools.summarize_warm_cold(all_calls)
+    if warm_cold["cold_calls"]:
+        warm = f" vs warm p50 {warm_cold['warm_p50_seconds']:.2f}s ({warm_cold['warm_calls']} calls)" if warm_cold["warm_calls"] else ""
+        print(f"  cold    {warm_cold['cold_calls']} calls paid a model load: p50 {warm_cold['cold_p50_seconds']:.2f}s{warm}")
+    elif warm_cold["warm_calls"]:
+        print(f"  warm    all {warm_cold['warm_calls']} LLM calls hit a loaded model")
+
+
+def summarize_salvage(per_record):
+    """
+    Print how many answers were salvaged or flagged as borderline instead of rejected.
+    """
+    counts = {}
+    for d in per_record:
+        for result in d.get("salvage", {}).values():
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+    salvaged = counts.get("normalized", 0) + counts.get("fuzzy", 0)
+    if salvaged or counts.get("borderline"):
+        print(f"Salvage: {salvaged} near-miss answers recovered "
+              f"({counts.get('normalized', 0)} normalized, {counts.get('fuzzy', 0)} fuzzy), "
+              f"{counts.get('borderline', 0)} borderline flagged for review, {counts.get('none', 0)} unmatched")
+
+
+def summarize_compare(per_record):
+    """
+    Print two-stage vs. joint throughput and agreement for --mode compare.
+    """
+    rows = [d for d in per_record if "joint_seconds" in d]
+    if not rows:
+        return
+    two_stage = sum(d["two_stage_seconds"] for d in rows)
+    joint = sum(d["joint_seconds"] for d in rows)
+    tissue_agree = sum(1 for d in rows if d["tissue"] == d["joint_tissue"])
+    both_agree = sum(1 for d in rows if d["tissue"] == d["joint_tissue"] and d["name"] == d["joint_name"])
+    print(f"Two-stage: {len(rows) / two_stage if two_stage else 0.0:.2f} records/sec (serial)")
+    print(f"Joint:     {len(rows) / joint if joint else 0.0:.2f} records/sec (serial)")
+    print(f"Agreement: tissue {tissue_agree / len(rows):.0%}, tissue+name {both_agree / len(rows):.0%} over {len(rows)} records")
+
+
+def manifest_path(out_path):
+    """
+    Sidecar checkpoint next to the output: one {"file", "test_order_id", "status"} line per
+    output row, in the same order (write_batch appends both together).
+    """
+    return out_path.with_name(out_path.name + ".manifest")
+
+
+def read_jsonl_rows(path):
+    """
+    Parsed lines of a JSONL file, in order. A torn last line (from a crash) is dropped;
+    an unreadable line anywhere else raises ValueError.
+    """
+    rows = []
+    if not path.exists():
+        return rows
+    with path.open("r", encoding="utf-8") as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        try:
+            row = json.loads(line)
+        except ValueError:
+            if i == len(lines) - 1:
+                break
+            raise ValueError(f"{path}: line {i + 1} is not valid JSON")
+        if not isinstance(row, dict):
+            raise ValueError(f"{path}: line {i + 1} is not a JSON object")
+        rows.append(row)
+    return rows
+
+
+def rewrite_jsonl(path, rows):
+    """
+    Atomically replace a JSONL file with the given rows (write to a temp file, then rename).
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def prepare_resume(out_path):
+    """
+    Work out what an interrupted run already finished. Returns (done record names, done
+    test_order_ids); a record is skipped if either matches.
+
+    With a manifest, output rows are matched to records by position (row i belongs to
+    manifest entry i). Only the last entry of each record is kept, and only if it is "ok",
+    so failed or half-written records are re-run without leaving duplicates behind.
+    Without a manifest (output written before checkpoints existed) no row is dropped:
+    the rows' test_order_ids become the done set and a manifest is written for them.
+    Raises ValueError when the output can't be matched to its records.
+    """
+    mpath = manifest_path(out_path)
+    rows = read_jsonl_rows(out_path)
+    if not mpath.exists():
+        if not rows:
+            return set(), set()
+        ids = [row.get("test_order_id") for row in rows]
+        if any(i is None for i in ids):
+            raise ValueError(f"{out_path} has rows without a test_order_id and no manifest; "
+                             "can't tell which records are done (write to a new --output instead)")
+        rewrite_jsonl(mpath, [{"file": None, "test_order_id": i, "status": "ok"} for i in ids])
+        return set(), set(ids)
+
+    entries = read_jsonl_rows(mpath)
+    if len(rows) < len(entries) or any("file" not in e for e in entries):
+        raise ValueError(f"{out_path} doesn't match {mpath.name} ({len(rows)} rows, {len(entries)} entries); "
+                         "refusing to resume (write to a new --output instead)")
+    last = {e["file"]: i for i, e in enumerate(entries) if e["file"] is not None}
+    keep = [i for i, e in enumerate(entries)
+            if e.get("status") == "ok" and (e["file"] is None or last[e["file"]] == i)]
+    # rows past the manifest were written but never checkpointed: their records run again
+    rewrite_jsonl(out_path, [rows[i] for i in keep])
+    rewrite_jsonl(mpath, [entries[i] for i in keep])
+    names = {entries[i]["file"] for i in keep if entries[i]["file"] is not None}
+    ids = {entries[i]["test_order_id"] for i in keep if entries[i]["file"] is None}
+    return names, ids
+
+
+def is_done(record, done_names, done_ids):
+    name, tumor_json = record
+    if name in done_names:
+        return True
+    if not done_ids:
+        return False
+    try:
+        parsed = json.loads(tumor_json)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(parsed, dict) and get_test_order_id(parsed, name) in done_ids
+
+
+def write_batch(out, manifest, lines, manifest_lines):
+    """
+    Append a batch of output rows, then their manifest entries, each as a single write + fsync.
+    """
+    if not lines:
+        return
+    for f, chunk in ((out, lines), (manifest, manifest_lines)):
+        f.write("".join(chunk))
+        f.flush()
+        os.fsync(f.fileno())
+    lines.clear()
+    manifest_lines.clear()
+
+
 def main():
     p = argparse.ArgumentParser(description="Batch run OncoTree predictions and write JSONL")
-    p.add_argument("--input-dir", required=True, help="Directory with .json tumor files")
+    p.add_argument("--input", "--input-dir", dest="input", required=True,
+                   help="Tumor records: a directory of .json files, a .jsonl[.gz] export, a .tar[.gz] or .zip archive, "
+                        "or - for JSONL on stdin (read lazily, one record at a time)")
     p.add_argument("--output", required=True, help="Output JSONL file")
     p.add_argument("--tissue-list", default="../data/tissue_types.txt", help="Path to tissue_types.txt")
     p.add_argument("--oncotree-base", default="../data/oncotree_tissues", help="Base dir for oncotree mappings")
     p.add_argument("--model", default="granite4:latest", help="Model name")
     p.add_argument("--temperature", type=float, default=0.0, help="Model temperature")
-    p.add_argument("--ext", default=".json", help="File extension to look for")
+    p.add_argument("--ext", default=".json", help="File extension to look for (directories and archives)")
+    p.add_argument("--shard", default=None,
+                   help="Process only shard i of N (e.g. 0/4), assigned by a stable hash of the record name, "
+                        "so separate processes or machines split one input with no coordination; "
+                        "combine the outputs with merge_results.py")
+    p.add_argument("--workers", type=int, default=None,
+                   help="Concurrent in-flight Ollama requests (default: $OLLAMA_NUM_PARALLEL or 1, per host)")
+    p.add_argument("--prerank-top-k", type=int, default=None,
+                   help="Send only the BM25 top-K OncoTree names to the LLM (full list when ranking is ambiguous)")
+    p.add_argument("--embed-model", default=None,
+                   help="Ollama embedding model (e.g. nomic-embed-text): --prerank-top-k then uses embedding "
+                        "similarity instead of BM25 (needs numpy)")
+    p.add_argument("--tissue-margin", type=float, default=None,
+                   help="With --embed-model, skip the tissue LLM call when the top tissue's similarity "
+                        "leads the runner-up by this much (e.g. 0.1)")
+    p.add_argument("--mode", choices=["two-stage", "joint", "compare"], default="two-stage",
+                   help="two-stage (tissue then name), joint (one LLM call), or compare (run both, write two-stage)")
+    p.add_argument("--ensemble", default=None,
+                   help="Comma-separated models to query concurrently and majority-vote (two-stage mode); "
+                        "their agreement becomes the output confidence")
+    p.add_argument("--quorum", type=int, default=None,
+                   help="With --ensemble, stop waiting once this many models agree (default: a majority)")
+    p.add_argument("--cascade", default=None,
+                   help="Comma-separated models, smallest first: each step escalates to the next model only when "
+                        "the answer is invalid, Unknown or below --min-margin (two-stage mode)")
+    p.add_argument("--min-margin", type=float, default=None,
+                   help="With --cascade, also escalate when the answer's token logprob margin (nats) is below this "
+                        "(e.g. 1.0; needs an Ollama server that returns logprobs)")
+    p.add_argument("--fast-path", action="store_true",
+                   help="Skip the LLM when the report already pins an OncoTree name or code "
+                        "(off by default, so every record is predicted by the model)")
+    p.add_argument("--compact", action="store_true",
+                   help="Minify the tumor JSON and drop empty/ID/administrative fields before prompting")
+    p.add_argument("--compact-keep", default=None,
+                   help="Comma-separated allow-list of top-level tumor JSON keys to send (implies --compact)")
+    p.add_argument("--compact-drop", default=None,
+                   help="Comma-separated extra keys to drop, on top of the default deny-list (implies --compact)")
+    p.add_argument("--compact-max-chars", type=int, default=2000,
+                   help="Truncate free-text values longer than this when compacting")
+    p.add_argument("--constrained", action="store_true",
+                   help="Force answers into the candidate list via an Ollama JSON-schema enum with a tight num_predict cap")
+    p.add_argument("--early-stop", action="store_true",
+                   help="Stream replies and stop reading as soon as the text names a canonical entry "
+                        "(cuts tail latency on models that keep talking after the answer)")
+    p.add_argument("--metrics-out", default=None,
+                   help="Write per-record stage timings and Ollama token counts to this JSONL file")
+    p.add_argument("--resume", action="store_true",
+                   help="Skip records already completed in the output's .manifest and retry only failures "
+                        "(an output without a manifest is kept and its test_order_ids are skipped)")
+    p.add_argument("--flush-every", type=int, default=50, help="Write and fsync output in batches of this many records")
+    p.add_argument("--hosts", default=os.environ.get("OLLAMA_HOSTS"),
+                   help="Comma-separated Ollama hosts to balance across (default $OLLAMA_HOSTS, else OLLAMA_HOST)")
+    p.add_argument("--per-host-concurrency", type=int, default=None,
+                   help="Max in-flight requests per host (default OLLAMA_NUM_PARALLEL or 4)")
+    p.add_argument("--keep-alive", default=os.environ.get("ONCOTREE_KEEP_ALIVE", "30m"),
+                   help="How long Ollama keeps the model loaded between requests, e.g. 30m, 1h, -1 (forever)")
+    p.add_argument("--no-warmup", action="store_true",
+                   help="Don't preload the model before the first record")
+    p.add_argument("--cache", default=None, help="SQLite prediction cache path (disabled if omitted)")
+    p.add_argument("--cache-max-entries", type=int, default=100_000, help="Evict least recently used entries beyond this")
+    p.add_argument("--cache-max-age-days", type=float, default=30, help="Drop cache entries older than this")
     args = p.parse_args()
+    ensemble = [m.strip() for m in args.ensemble.split(",") if m.strip()] if args.ensemble else None
+    cascade = [m.strip() for m in args.cascade.split(",") if m.strip()] if args.cascade else None
+    if (ensemble or cascade) and args.mode != "two-stage":
+        p.error("--ensemble and --cascade need --mode two-stage")
+    if ensemble and cascade:
+        p.error("use either --ensemble or --cascade")
 
-    input_dir = Path(args.input_dir)
-    if not input_dir.exists() or not input_dir.is_dir():
-        print("Input directory missing:", input_dir)
+    try:
+        keep = None
+        if args.shard:
+            keep = record_sources.shard_filter(*record_sources.parse_shard(args.shard))
+            print(f"Shard {args.shard} of {args.input}")
+        records = record_sources.iter_records(args.input, args.ext, keep=keep)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
         return
 
-    files = sorted([p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower() == args.ext.lower()])
-
     out_path = Path(args.output)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with out_path.open("a", encoding="utf-8") as out:
-        for f in files:
-            try:
-                res = process_file(str(f), args.tissue_list, args.oncotree_base, args.model, args.temperature)
-            except Exception:
-                res = {
-                    "oncotree_tissue": "",
-                    "oncotree_code": "",
-                    "oncotree_name": "",
-                    "test_order_id": f.stem,
-                }
-            out.write(json.dumps(res) + "\n")
-            out.flush()
-            print("Wrote:", f.name)
+    cache = None
+    if args.cache:
+        cache = tools.PredictionCache(args.cache, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days)
+
+    hosts = tools.parse_hosts(args.hosts)
+    client = make_client(hosts, args.per_host_concurrency)
+    if isinstance(client, tools.OllamaPool) and not client.health_check():
+        print("Warning: no Ollama host answered the health check:", ", ".join(h["host"] for h in client.stats()))
+
+    # "-1"/"300" from the command line are numbers to Ollama, "30m" is a duration string
+    keep_alive = args.keep_alive
+    if keep_alive and keep_alive.lstrip("-").isdigit():
+        keep_alive = int(keep_alive)
+    for model in ([] if args.no_warmup else ensemble or cascade or [args.model]):
+        try:
+            warm = tools.warm_up_model(model, keep_alive=keep_alive, client=client)
+            print(f"Warm-up: {model} ready in {warm['wall_seconds']:.2f}s "
+                  f"(load {warm['load_seconds']:.2f}s, {warm['hosts']} host(s)), keep_alive={keep_alive}")
+        except Exception as e:
+            print(f"Warm-up of {model} failed:", e)
+
+    # embed every OncoTree name up front (a no-op when the on-disk index is current)
+    if args.embed_model:
+        index_started = time.perf_counter()
+        reference = tools.load_reference(args.tissue_list, args.oncotree_base)
+        for tissue in reference.tissues:
+            tools.load_embedding_index(tissue, reference.names(tissue), args.embed_model, client=client)
+        print(f"Embedding index ({args.embed_model}) ready for {len(reference.tissues)} tissues "
+              f"in {time.perf_counter() - index_started:.1f}s")
+
+    compaction = None
+    if args.compact or args.compact_keep or args.compact_drop:
+        compaction = {"max_text_chars": args.compact_max_chars}
+        if args.compact_keep:
+            compaction["keep_keys"] = [k.strip() for k in args.compact_keep.split(",") if k.strip()]
+        if args.compact_drop:
+            compaction["drop_keys"] = tuple(tools.DEFAULT_DROP_KEYS) + tuple(
+                k.strip() for k in args.compact_drop.split(",") if k.strip())
+
+    def run_one(record):
+        name, tumor_json = record
+        details = {}
+        started = time.perf_counter()
+        try:
+            res = process_record(name, tumor_json, args.tissue_list, args.oncotree_base, args.model, args.temperature,
+                               cache=cache, top_k=args.prerank_top_k, details=details,
+                               fast_path=args.fast_path, mode=args.mode, compaction=compaction,
+                               constrained=args.constrained, client=client, keep_alive=keep_alive,
+                               embed_model=args.embed_model, tissue_margin=args.tissue_margin,
+                               ensemble=ensemble, quorum=args.quorum, cascade=cascade, min_margin=args.min_margin,
+                               early_stop=args.early_stop)
+        except Exception as e:
+            record_error(details, e)
+            res = {
+                "oncotree_tissue": "",
+                "oncotree_code": "",
+                "oncotree_name": "",
+                # the full record name: JSONL lines and archive members share a file stem
+                "test_order_id": name,
+            }
+        details["record_seconds"] = time.perf_counter() - started
+        return res, details
+
+    if args.resume:
+        try:
+            done_names, done_ids = prepare_resume(out_path)
+        except ValueError as e:
+            print(e)
+            return
+        records = (r for r in records if not is_done(r, done_names, done_ids))
+        print(f"Resuming: {len(done_names) + len(done_ids)} records already done")
+
+    if args.workers is None:
+        workers = default_workers(len(hosts))
+        if isinstance(client, tools.OllamaPool):
+            workers = client.max_per_host * len(client.stats())
+    else:
+        workers = max(1, args.workers)
+    flush_every = max(1, args.flush_every)
+    start = time.perf_counter()
+    done = 0
+    failed = 0
+    per_record = []  # bounded sample for the summaries (see sample_record)
+    rng = random.Random(0)
+    lines, manifest_lines = [], []
+    metrics_out = open(args.metrics_out, "a", encoding="utf-8") if args.metrics_out else None
+    with out_path.open("a", encoding="utf-8") as out, manifest_path(out_path).open("a", encoding="utf-8") as manifest:
+        try:
+            for (name, _), (res, details) in run_ordered(run_one, records, workers):
+                if metrics_out is not None:
+                    metrics_out.write(json.dumps({
+                        "file": name,
+                        "test_order_id": res.get("test_order_id"),
+                        "record_seconds": details.get("record_seconds"),
+                        "validate_seconds": details.get("validate_seconds"),
+                        "stages": details.get("stages", {}),
+                        "salvage": details.get("salvage", {}),
+                    }) + "\n")
+                status = "failed" if details.get("errors") else "ok"
+                failed += status == "failed"
+                lines.append(json.dumps(res) + "\n")
+                manifest_lines.append(json.dumps({"file": name, "test_order_id": res.get("test_order_id"), "status": status}) + "\n")
+                done += 1
+                sample_record(per_record, details, done, rng)
+                print("Wrote:", name, f"[tissue: {details.get('tissue_path', 'llm')}, name: {details.get('name_path', 'llm')}]")
+                if len(lines) >= flush_every:
+                    write_batch(out, manifest, lines, manifest_lines)
+        finally:
+            # keep whatever completed, even on Ctrl-C
+            write_batch(out, manifest, lines, manifest_lines)
+            if metrics_out is not None:
+                metrics_out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {done} records in {elapsed:.1f}s with {workers} worker(s): {rate:.2f} records/sec")
+    if failed:
+        print(f"{failed} record(s) failed; re-run with --resume to retry them")
+    if done > len(per_record):
+        print(f"Summaries below are over a random sample of {len(per_record)} of {done} records")
+    summarize_prerank(per_record, args.tissue_list, args.oncotree_base)
+    summarize_paths(per_record)
+    summarize_ensemble(per_record)
+    if cascade:
+        summarize_cascade(per_record, cascade)
+    summarize_compaction(per_record)
+    summarize_latency(per_record)
+    summarize_salvage(per_record)
+    summarize_compare(per_record)
+    if isinstance(client, tools.OllamaPool):
+        for h in client.stats():
+            print(f"Host {h['host']}: {h['requests']} requests, {h['failures']} failures, "
+                  f"{'healthy' if h['healthy'] else 'unhealthy'}")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+        cache.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+"""
+merge_results.merge_rows: duplicate resolution between shard outputs.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import merge_results  # noqa: E402
+
+NONE_ROW = {"oncotree_tissue": "none", "oncotree_code": "none", "oncotree_name": "none"}
+
+
+def write_output(path, rows, statuses = None):
+    """
+    Write a shard output the way test_models.py does, with a .manifest when statuses are given.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    if statuses is not None:
+        with open(path + ".manifest", "w", encoding="utf-8") as f:
+            for row, status in zip(rows, statuses):
+                f.write(json.dumps({"file": f"{row['test_order_id']}.json",
+                                    "test_order_id": row["test_order_id"], "status": status}) + "\n")
+
+
+class MergeRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.good = [{"test_order_id": f"r{i}", "oncotree_tissue": "Breast", "oncotree_code": "IDC",
+                      "oncotree_name": "Breast Invasive Ductal Carcinoma"} for i in range(3)]
+        self.failed = [dict(NONE_ROW, test_order_id=f"r{i}") for i in range(3)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_failed_rerun_never_overwrites_successes(self):
+        write_output(self.path("good.jsonl"), self.good, ["ok"] * 3)
+        write_output(self.path("rerun.jsonl"), self.failed, ["failed"] * 3)
+        for order in (["good.jsonl", "rerun.jsonl"], ["rerun.jsonl", "good.jsonl"]):
+            rows, stats = merge_results.merge_rows([self.path(p) for p in order])
+            self.assertEqual(rows, self.good)
+            self.assertEqual(stats["duplicates"], 3)
+            self.assertEqual(stats["errors"], 0)
+
+    def test_failed_rows_are_counted(self):
+        write_output(self.path("rerun.jsonl"), self.failed, ["failed", "ok", "failed"])
+        rows, stats = merge_results.merge_rows([self.path("rerun.jsonl")])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(stats["errors"], 2)
+
+    def test_all_none_rows_lose_without_a_manifest(self):
+        write_output(self.path("good.jsonl"), self.good)
+        write_output(self.path("rerun.jsonl"), self.failed)
+        rows, stats = merge_results.merge_rows([self.path("good.jsonl"), self.path("rerun.jsonl")])
+        self.assertEqual(rows, self.good)
+        self.assertEqual(stats["errors"], 0)
+
+    def test_later_success_wins(self):
+        newer = [dict(row, oncotree_code="ILC") for row in self.good]
+        write_output(self.path("old.jsonl"), self.good, ["ok"] * 3)
+        write_output(self.path("new.jsonl"), newer, ["ok"] * 3)
+        rows, _ = merge_results.merge_rows([self.path("old.jsonl"), self.path("new.jsonl")])
+        self.assertEqual(rows, newer)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+OllamaPool routing and failover against in-process stub Ollama servers.
+
+    python -m pytest tests
+"""
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import ollama  # noqa: E402
+import oncotree_utils as tools  # noqa: E402
+import stub_ollama_server  # noqa: E402
+import test_models  # noqa: E402
+
+MODEL = "stub:latest"
+MESSAGES = [{"role": "user", "content": "Oncotree Names:\nBreast Carcinoma$Lung Adenocarcinoma"}]
+
+
+def dead_host():
+    """
+    Address of a local port with nothing listening on it.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{s.getsockname()[1]}"
+
+
+class OllamaPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = [stub_ollama_server.start_in_thread(port=0, prefill_tps=1e6, gen_tps=1e6, models=[MODEL])
+                      for _ in range(2)]
+
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.shutdown()
+            stub.server_close()
+
+    def test_fails_over_from_an_unreachable_host(self):
+        down = dead_host()
+        pool = tools.OllamaPool([down, self.stubs[0].address], max_per_host=2)
+        for _ in range(4):
+            response = pool.chat(model=MODEL, messages=MESSAGES)
+            self.assertTrue(response["message"]["content"])
+        stats = {h["host"]: h for h in pool.stats()}
+        self.assertFalse(stats[down]["healthy"])
+        self.assertEqual(stats[down]["failures"], 1)
+        self.assertTrue(stats[self.stubs[0].address]["healthy"])
+        self.assertEqual(pool.last_host, self.stubs[0].address)
+
+    def test_unknown_model_does_not_take_hosts_down(self):
+        pool = tools.OllamaPool([stub.address for stub in self.stubs], max_per_host=2)
+        with self.assertRaises(ollama.ResponseError) as raised:
+            pool.chat(model="missing:latest", messages=MESSAGES)
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertTrue(all(h["healthy"] for h in pool.stats()))
+        self.assertEqual(sum(h["requests"] for h in pool.stats()), 1)
+        self.assertTrue(pool.chat(model=MODEL, messages=MESSAGES)["message"]["content"])
+
+    def test_unknown_model_in_a_stream_does_not_take_hosts_down(self):
+        pool = tools.OllamaPool([stub.address for stub in self.stubs], max_per_host=2)
+        with self.assertRaises(ollama.ResponseError):
+            list(pool.chat(model="missing:latest", messages=MESSAGES, stream=True))
+        self.assertTrue(all(h["healthy"] for h in pool.stats()))
+
+    def test_single_host_is_used(self):
+        client = test_models.make_client([self.stubs[1].address])
+        client.chat(model=MODEL, messages=MESSAGES)
+        self.assertEqual(self.stubs[0].state.requests, 0)
+        self.assertEqual(self.stubs[1].state.requests, 1)
+        self.assertIsNone(test_models.make_client([]))
+        self.assertIsInstance(test_models.make_client(["a:1", "b:2"]), tools.OllamaPool)
+
+
+if __name__ == "__main__":
+    unittest.main()